@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of the opcode dispatch in CodeGenerator.
+
+Compares the per-instruction `getattr` lookup that `generate` used to do
+against the opcode-indexed table built by DispatchMeta, and reports the
+number of instructions translated per second.
+
+Usage: python benchmarks/bench_dispatch.py [num_statements] [repeat]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from pycodegen.codegen import CodeGenerator
+
+
+def make_function(num_statements):
+    lines = ["def ode(self, stimulus=0.):"]
+    for i in range(num_statements):
+        lines.append("    a{0} = (self.v + {0}.) * self.n - stimulus / 2.".format(i))
+        lines.append("    self.d_v = a{0} ** 2 + self.d_v".format(i))
+    lines.append("    return None")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace['ode']
+
+
+class GetattrGenerator(CodeGenerator):
+    """Reference implementation of the previous dispatch loop."""
+    def translate_instructions(self, instructions):
+        for ins in instructions:
+            if ins.starts_line is not None and self.line != ins.starts_line:
+                if self.line > 0 and len(self.var):
+                    self.output_statement()
+                self.line = ins.starts_line
+
+            handle = getattr(self, "handle_{}".format(ins.opname.lower()), None)
+            if handle is not None:
+                handle(ins)
+            else:
+                self.handle_unknown(ins)
+
+
+def bench(cls, code, repeat):
+    gen = cls(code, ostream=StringIO(), unknown='collect')
+    count = len(gen.instructions)
+
+    def run():
+        gen.output = StringIO()
+        gen.generate()
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return count / best
+
+
+def main(argv):
+    num_statements = int(argv[1]) if len(argv) > 1 else 2000
+    repeat = int(argv[2]) if len(argv) > 2 else 20
+    code = make_function(num_statements).__code__
+
+    before = bench(GetattrGenerator, code, repeat)
+    after = bench(CodeGenerator, code, repeat)
+    print("getattr dispatch: {:12.0f} ins/s".format(before))
+    print("table dispatch:   {:12.0f} ins/s".format(after))
+    print("speedup:          {:12.2f}x".format(after / before))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
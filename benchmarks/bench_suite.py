@@ -0,0 +1,249 @@
+"""
+Benchmark suite of translation and of generated kernels.
+
+`translate` cases time CudaGenerator on synthetic models whose `ode` grows
+in statement count, expression depth and branch nesting, and record the
+peak memory allocated while translating with tracemalloc (not under
+Python 2, where the resident set size is dominated by the interpreter).
+`kernel` cases build the C backend of synthetic models and measure how
+many thread-steps the kernel advances per second.
+
+Every timing is the median of several runs, as single runs vary by tens of
+percent. Results are written as JSON; given a baseline file written by an
+earlier run, every case is compared against it and the script exits with
+status 1 if one regressed by more than the threshold.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--only translate|kernel]
+    [--output results.json] [--baseline baseline.json] [--threshold 0.3]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pycodegen.cuda import CudaGenerator
+
+FORMAT = 2
+
+# (name, statements, depth, nesting)
+TRANSLATE_CASES = [
+    ('statements-25', 25, 1, 0),
+    ('statements-100', 100, 1, 0),
+    ('statements-400', 400, 1, 0),
+    ('depth-4', 25, 4, 0),
+    ('depth-16', 25, 16, 0),
+    ('nesting-2', 25, 1, 2),
+    ('nesting-6', 25, 1, 6),
+]
+
+# (name, statements, depth, nesting, options)
+KERNEL_CASES = [
+    ('small', 10, 2, 0, {}),
+    ('large', 100, 2, 0, {}),
+    ('branchy', 25, 2, 3, {}),
+    ('large-cse', 100, 2, 0, dict(cse=True)),
+]
+
+
+def expression(i, depth):
+    """
+    Expression of `depth` nested operations reading the model's fields.
+    """
+    expr = "self.v"
+    for level in range(depth):
+        op = ('+', '*', '-')[level % 3]
+        expr = "({} {} {}.{} * self.m)".format(expr, op, i + 1, level)
+    return "np.exp(-{} / 100.) + stimulus".format(expr)
+
+
+def make_model(num_statements, depth=1, nesting=0):
+    """
+    Model whose `ode` computes `num_statements` locals from expressions of
+    `depth` operations, every statement nested in `nesting` branches.
+    """
+    lines = ["def ode(self, stimulus=0.):", "    acc = 0."]
+    for i in range(num_statements):
+        indent = "    "
+        for level in range(nesting):
+            lines.append("{}if self.v > {}.:".format(indent, level - i % 7))
+            indent += "    "
+        lines.append("{}a{} = {}".format(indent, i, expression(i, depth)))
+        lines.append("{}acc = acc + a{} * self.a".format(indent, i))
+    lines.append("    self.d_v = acc / {}. - self.v".format(num_statements))
+    lines.append("    self.d_m = (1. - self.m) * self.a - self.m")
+    namespace = {}
+    exec("\n".join(lines), namespace)
+
+    class Synthetic(object):
+        states = {'v': -65., 'm': 0.}
+        params = {'a': 0.5}
+        bounds = {'m': (0., 1.)}
+        ode = namespace['ode']
+    return Synthetic()
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.
+
+
+def result(name, metric, value, unit, better):
+    return dict(name=name, metric=metric, value=value, unit=unit,
+        better=better)
+
+
+def bench_translate(quick=False):
+    results = []
+    repeat = 5 if quick else 15
+    for name, num_statements, depth, nesting in TRANSLATE_CASES:
+        if quick and num_statements > 100:
+            continue
+        gen = CudaGenerator(make_model(num_statements, depth, nesting))
+
+        def run():
+            gen.generate()
+            gen.render()
+        # the first run also decodes the bytecode and compiles the template
+        run()
+        elapsed = median(timeit.repeat(run, number=1, repeat=repeat))
+        results.append(result('translate/' + name, 'time', elapsed, 's',
+            'lower'))
+        if tracemalloc is not None:
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(result('translate/' + name, 'peak_memory', peak,
+                'B', 'lower'))
+    return results
+
+
+def kernel_inputs(gen, num_thread, np):
+    """
+    Arrays of the pointer arguments of a kernel, keyed by argument name.
+    """
+    rng = np.random.RandomState(0)
+    arrays = {}
+    for type_, name in gen.kernel_arguments():
+        if '*' not in type_:
+            continue
+        key = name[2:]
+        if key == 'v':
+            arrays[name] = rng.uniform(-70., 10., num_thread)
+        else:
+            arrays[name] = rng.uniform(0., 1., num_thread)
+    return arrays
+
+
+def bench_kernel(quick=False):
+    import ctypes
+    import numpy as np
+    from pycodegen.c import CGenerator
+
+    results = []
+    num_thread = 10000 if quick else 100000
+    num_steps = 10 if quick else 100
+    for name, num_statements, depth, nesting, options in KERNEL_CASES:
+        model = make_model(num_statements, depth, nesting)
+        gen = CGenerator(model, float_type='double', multi_step=True,
+            **options)
+        kernel = gen.load()
+        arrays = kernel_inputs(gen, num_thread, np)
+        ptr = ctypes.POINTER(ctypes.c_double)
+        args = []
+        for _, arg in gen.kernel_arguments():
+            if arg == 'num_thread':
+                args.append(num_thread)
+            elif arg == 'dt':
+                args.append(1e-4)
+            elif arg == 'num_steps':
+                args.append(num_steps)
+            else:
+                args.append(arrays[arg].ctypes.data_as(ptr))
+        elapsed = median(timeit.repeat(lambda: kernel(*args), number=1,
+            repeat=5 if quick else 9))
+        results.append(result('kernel/' + name, 'throughput',
+            num_thread * num_steps / elapsed, 'thread-steps/s', 'higher'))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every case against `baseline` and return the
+    cases that regressed by more than `threshold`.
+    """
+    previous = dict(((x['name'], x['metric']), x) for x in baseline['results'])
+    regressions = []
+    for res in results:
+        old = previous.get((res['name'], res['metric']))
+        if old is None or not old['value']:
+            continue
+        ratio = res['value'] / float(old['value'])
+        change = ratio - 1 if res['better'] == 'higher' else 1 - ratio
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(res)
+        print("{:32s} {:12s} {:+8.1%}{}".format(res['name'], res['metric'],
+            change, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true',
+        help='fewer and smaller cases')
+    parser.add_argument('--only', choices=('translate', 'kernel'))
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.3,
+        help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv[1:])
+    # the synthetic models mix precisions freely
+    warnings.simplefilter('ignore')
+    results = []
+    if args.only in (None, 'translate'):
+        results.extend(bench_translate(args.quick))
+    if args.only in (None, 'kernel'):
+        results.extend(bench_kernel(args.quick))
+
+    report = dict(format=FORMAT,
+        created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        quick=args.quick,
+        results=results)
+    for res in results:
+        print("{:32s} {:12s} {:14.6g} {}".format(res['name'], res['metric'],
+            res['value'], res['unit']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,97 @@
+"""
+Translation of many models over a pool of worker processes.
+
+Each worker creates its own generator from the model and the options, and
+only the rendered source travels back; models and their classes (or the
+functions given to a plain CodeGenerator) must therefore be picklable,
+i.e. defined at module level.
+"""
+import importlib
+import multiprocessing
+
+BACKENDS = {
+    'cuda': ('.cuda', 'CudaGenerator'),
+    'c': ('.c', 'CGenerator'),
+    'numpy': ('.vectorize', 'NumpyGenerator'),
+}
+
+
+def resolve_backend(backend):
+    """
+    Generator class of a backend name, or `backend` itself if it is a class.
+    """
+    if isinstance(backend, type):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError("backend must be one of {} or a generator class, "
+            "got {!r}".format(sorted(BACKENDS), backend))
+    module, name = BACKENDS[backend]
+    return getattr(importlib.import_module(module, __package__), name)
+
+
+def _render(task):
+    cls, model, options = task
+    gen = cls(model, **options)
+    src = gen.generate_source()
+    return src, gen.cache_entry(src)
+
+
+def translate_many(models, backend='cuda', workers=None, cache=None,
+        **options):
+    """
+    Render the source of every model.
+
+    Parameters
+    ----------
+    models : list
+        Model instances, or functions if `backend` is a CodeGenerator that
+        translates a single function.
+    backend : str or class
+        'cuda', 'c', 'numpy' or a generator class, created with each item
+        of `models` and the options.
+    workers : int or None
+        Number of worker processes; the number of CPUs if None. With one
+        worker, or a single model to translate, no process is started.
+    cache : TranslationCache or None
+        Looked up before translating; the sources rendered by the workers
+        are stored into it, so a later call only translates the models
+        that changed.
+
+    Other keyword arguments are options of the generator.
+
+    Returns
+    -------
+    list
+        Sources in the order of `models`.
+    """
+    cls = resolve_backend(backend)
+    sources = [None] * len(models)
+    keys = [None] * len(models)
+    pending = []
+    for i, model in enumerate(models):
+        if cache is not None:
+            gen = cls(model, **options)
+            keys[i] = gen.cache_key()
+            entry = cache.get(keys[i])
+            if entry is not None:
+                sources[i] = gen.load_entry(entry)
+        if sources[i] is None:
+            pending.append(i)
+
+    tasks = [(cls, models[i], options) for i in pending]
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1 or len(tasks) < 2:
+        results = [_render(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            results = pool.map(_render, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for i, (src, entry) in zip(pending, results):
+        sources[i] = src
+        if cache is not None:
+            cache.set(keys[i], entry)
+    return sources
@@ -0,0 +1,108 @@
+"""
+Build generated C sources into shared libraries and load them with ctypes.
+
+Artifacts are stored in an on-disk cache keyed by the source, the compiler
+and its flags, so an identical kernel is compiled only once.
+"""
+import os
+import shutil
+import ctypes
+import hashlib
+import tempfile
+import subprocess
+
+DEFAULT_CC = os.environ.get('CC', 'cc')
+DEFAULT_FLAGS = ('-O3', '-fPIC', '-shared', '-fopenmp')
+LIBRARIES = ('-lm',)
+
+
+class CompileError(RuntimeError):
+    pass
+
+
+def default_directory():
+    return os.environ.get('PYCODEGEN_BUILD_DIR',
+        os.path.join(tempfile.gettempdir(), 'pycodegen-build'))
+
+
+def artifact_key(src, cc=DEFAULT_CC, flags=DEFAULT_FLAGS):
+    text = repr((src, cc, tuple(flags)))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    Directory of build artifacts named after their key.
+
+    Entries are written to a temporary name and renamed into place, so
+    concurrent builders never observe a partially written artifact.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or default_directory()
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def path(self, key, suffix='.so'):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key, suffix='.so'):
+        path = self.path(key, suffix)
+        return path if os.path.exists(path) else None
+
+    def commit(self, tmp, key, suffix='.so'):
+        path = self.path(key, suffix)
+        os.rename(tmp, path)
+        return path
+
+
+def compile_command(src_path, out_path, cc=DEFAULT_CC, flags=DEFAULT_FLAGS):
+    return [cc] + list(flags) + ['-o', out_path, src_path] + list(LIBRARIES)
+
+
+def compile_error(cc, returncode, output):
+    if not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+    return CompileError("{} failed with exit code {}:\n{}".format(
+        cc, returncode, output))
+
+
+def build(src, cc=DEFAULT_CC, flags=DEFAULT_FLAGS, cache=None):
+    """
+    Compile C source `src` into a shared library and return its path.
+    """
+    cache = cache if isinstance(cache, ArtifactCache) else ArtifactCache(cache)
+    key = artifact_key(src, cc, flags)
+    path = cache.get(key)
+    if path is not None:
+        return path
+
+    workdir = tempfile.mkdtemp(dir=cache.directory)
+    try:
+        src_path = os.path.join(workdir, key + '.c')
+        out_path = os.path.join(workdir, key + '.so')
+        with open(src_path, 'w') as f:
+            f.write(src)
+        proc = subprocess.Popen(compile_command(src_path, out_path, cc, flags),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        if proc.returncode:
+            raise compile_error(cc, proc.returncode, output)
+        return cache.commit(out_path, key)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+_libraries = {}
+
+def load(src, **kwargs):
+    """
+    Build `src` (see `build`) and load it as a ctypes.CDLL.
+    """
+    path = build(src, **kwargs)
+    if path not in _libraries:
+        _libraries[path] = ctypes.CDLL(path)
+    return _libraries[path]
@@ -0,0 +1,153 @@
+"""
+Compact decoded bytecode shared by the generators.
+
+The instructions of a code object are decoded once into an
+InstructionStream of parallel arrays; `instruction_stream` hands the same
+stream to every generator translating that code object for as long as one
+of them holds it, along with the control-flow structure recovered from it
+(see `cfg.structure`).
+"""
+import dis
+import sys
+import weakref
+from array import array
+from opcode import (opname, HAVE_ARGUMENT, EXTENDED_ARG, hasconst, hasname,
+    hasjrel, haslocal, hascompare, hasfree, cmp_op)
+
+# placeholder of a missing argument or line number in the arrays
+NONE = -1
+
+
+class Instruction(object):
+    """
+    One decoded instruction, with the attributes of `dis.Instruction` used
+    by the generators.
+    """
+    __slots__ = ('opcode', 'arg', 'argval', 'offset', 'starts_line',
+        'is_jump_target')
+
+    def __init__(self, opcode, arg, argval, offset, starts_line,
+            is_jump_target):
+        self.opcode = opcode
+        self.arg = arg
+        self.argval = argval
+        self.offset = offset
+        self.starts_line = starts_line
+        self.is_jump_target = is_jump_target
+
+    @property
+    def opname(self):
+        return opname[self.opcode]
+
+    def __repr__(self):
+        return "Instruction({}, {!r}, offset={})".format(self.opname,
+            self.argval, self.offset)
+
+
+class InstructionStream(object):
+    """
+    Instructions of a code object as parallel arrays of opcodes, arguments,
+    offsets, line starts and jump-target flags; the resolved arguments
+    (names, constants, ...) are kept in a tuple.
+
+    Indexing or iterating creates Instruction objects on the fly.
+    """
+    __slots__ = ('code', 'opcodes', 'args', 'argvals', 'offsets', 'lines',
+        'targets', 'regions', '__weakref__')
+
+    def __init__(self, code):
+        self.code = code
+        # nested regions of the control-flow graph, built on first use
+        self.regions = None
+        self.opcodes = array('B')
+        self.args = array('l')
+        self.offsets = array('l')
+        self.lines = array('l')
+        self.targets = array('B')
+        argvals = []
+        for op, arg, argval, offset, line, target in _decode(code):
+            self.opcodes.append(op)
+            self.args.append(NONE if arg is None else arg)
+            argvals.append(argval)
+            self.offsets.append(offset)
+            self.lines.append(NONE if line is None else line)
+            self.targets.append(target)
+        self.argvals = tuple(argvals)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        arg, line = self.args[i], self.lines[i]
+        return Instruction(self.opcodes[i], None if arg == NONE else arg,
+            self.argvals[i], self.offsets[i], None if line == NONE else line,
+            bool(self.targets[i]))
+
+    def __iter__(self):
+        for i in range(len(self.opcodes)):
+            yield self[i]
+
+
+def _decode(code):
+    """
+    Yield `(opcode, arg, argval, offset, starts_line, is_jump_target)` of
+    every instruction of `code`.
+    """
+    if sys.version_info[0] == 3:
+        for ins in dis.get_instructions(code):
+            yield (ins.opcode, ins.arg, ins.argval, ins.offset,
+                ins.starts_line, ins.is_jump_target)
+        return
+
+    raw = bytearray(code.co_code)
+    labels = set(dis.findlabels(code.co_code))
+    linestarts = dict(dis.findlinestarts(code))
+    free = code.co_cellvars + code.co_freevars
+    n = len(raw)
+    i = 0
+    extended_arg = 0
+    while i < n:
+        op = raw[i]
+        offset = i
+        i += 1
+        arg = argval = None
+        if op >= HAVE_ARGUMENT:
+            arg = raw[i] + raw[i + 1] * 256 + extended_arg
+            extended_arg = 0
+            i += 2
+            if op == EXTENDED_ARG:
+                extended_arg = arg * 65536
+            if op in hasconst:
+                argval = code.co_consts[arg]
+            elif op in hasname:
+                argval = code.co_names[arg]
+            elif op in hasjrel:
+                argval = i + arg
+            elif op in haslocal:
+                argval = code.co_varnames[arg]
+            elif op in hascompare:
+                argval = cmp_op[arg]
+            elif op in hasfree:
+                argval = free[arg]
+            else:
+                argval = arg
+        yield (op, arg, argval, offset, linestarts.get(offset),
+            offset in labels)
+
+
+# id of a code object -> its stream; the stream holds the code object, so
+# the id is not reused while the entry exists
+_streams = weakref.WeakValueDictionary()
+
+
+def instruction_stream(code):
+    """
+    InstructionStream of `code`, shared while any user holds it.
+    """
+    stream = _streams.get(id(code))
+    if stream is None or stream.code is not code:
+        stream = InstructionStream(code)
+        _streams[id(code)] = stream
+    return stream
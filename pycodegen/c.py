@@ -0,0 +1,95 @@
+"""
+C/OpenMP backend sharing the CUDA translation pipeline.
+
+The generated kernel has the same parameters as the CUDA kernel and loops
+over `num_thread` with `#pragma omp parallel for simd`, so populations run
+on all CPU cores and generated kernels can be checked numerically without
+a GPU.
+"""
+import ctypes
+
+from .cuda import CudaGenerator, CudaPrinter
+from .build import load, DEFAULT_CC, DEFAULT_FLAGS
+
+C_DIALECT = dict(
+    name='c',
+    includes=('math.h',),
+    device='static inline',
+    inline='static inline',
+    kernel='void',
+    constant='',
+    restrict='restrict',
+    ref='*',
+    member='->',
+    addr='&',
+    indent=4)
+
+# structs passed to the generated functions by pointer
+STRUCT_ARGUMENTS = frozenset(['states', 'gstates', 'jac', 'inters', 'params'])
+
+
+class CPrinter(CudaPrinter):
+    """
+    Render nodes as C source; model structs are accessed through pointers.
+    """
+    def write_attr(self, node, out):
+        if getattr(node.value, 'id', None) in STRUCT_ARGUMENTS:
+            out.append(node.value.id)
+            out.append('->')
+            out.append(node.attr)
+        else:
+            CudaPrinter.write_attr(self, node, out)
+
+
+class CGenerator(CudaGenerator):
+    dialect = C_DIALECT
+
+    def create_printer(self):
+        return CPrinter(func_map=self.pyfunc_to_cufunc,
+            float_type=self.float_type)
+
+    def generate_c(self):
+        self.c_src = self.generate_source()
+
+    def load(self, cc=DEFAULT_CC, flags=DEFAULT_FLAGS, cache=None):
+        """
+        Compile the generated source and return the kernel as a ctypes
+        function; array arguments are passed as pointers, e.g.
+        `arr.ctypes.data_as(ctypes.POINTER(ctypes.c_float))`.
+        """
+        if not hasattr(self, 'c_src'):
+            self.generate_c()
+        lib = load(self.c_src, cc=cc, flags=flags, cache=cache)
+        self.library = lib
+        kernel = getattr(lib, self.model.__class__.__name__)
+        kernel.argtypes = [self.ctype(x) for x, _ in self.kernel_arguments()]
+        kernel.restype = None
+        return kernel
+
+    def set_params(self, **values):
+        """
+        Assign the runtime params of a kernel loaded with params='constant';
+        params not given keep their model values.
+        """
+        if self.params_mode != 'constant':
+            raise ValueError("set_params requires params='constant'")
+        if not hasattr(self, 'library'):
+            self.load()
+        ctype = self.ctype(self.float_type)
+        struct = type('Params', (ctypes.Structure,), dict(
+            _fields_=[(str(key), ctype) for key in self.runtime_params]))
+        params = struct.in_dll(self.library, 'params')
+        for key in self.runtime_params:
+            setattr(params, key, values.pop(key, self.model.params[key]))
+        if values:
+            raise ValueError("not runtime params: {}".format(
+                ', '.join(sorted(values))))
+
+    def ctype(self, decl):
+        for qualifier in ('const', self.dialect['restrict']):
+            decl = decl.replace(qualifier, '')
+        decl = decl.strip()
+        if decl.endswith('*'):
+            return ctypes.POINTER(self.ctype(decl[:-1]))
+        return {'int': ctypes.c_int, 'float': ctypes.c_float,
+            'double': ctypes.c_double}[decl]
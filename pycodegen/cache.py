@@ -0,0 +1,192 @@
+"""
+Content-addressed cache for generated source code.
+
+A cache entry is keyed by everything that determines the translation: the
+bytecode of the function, its constants and names, the generator class and
+its formatting options. Entries live in an in-memory LRU tier and, when a
+directory is given, in an on-disk tier that is trimmed to a size budget.
+"""
+import io
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# bump when the generated output changes for otherwise identical inputs
+CACHE_FORMAT = 2
+
+
+def _fingerprint(obj):
+    """
+    Deterministic, hashable-by-text representation of `obj`.
+    """
+    if hasattr(obj, 'co_code'):
+        return ('code', obj.co_code, _fingerprint(obj.co_consts),
+            tuple(obj.co_names), tuple(obj.co_varnames))
+    if isinstance(obj, dict):
+        return ('dict', tuple(sorted(
+            (_fingerprint(k), _fingerprint(v)) for k, v in obj.items())))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(_fingerprint(x) for x in obj))
+    if isinstance(obj, (set, frozenset)):
+        return ('set', tuple(sorted(_fingerprint(x) for x in obj)))
+    return obj
+
+
+def code_fingerprint(func):
+    """
+    Fingerprint of a function or code object.
+    """
+    return _fingerprint(getattr(func, '__code__', func))
+
+
+def make_key(*parts):
+    """
+    Hash `parts` into a hex digest usable as a cache key.
+    """
+    text = repr((CACHE_FORMAT,) + tuple(_fingerprint(x) for x in parts))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TranslationCache(object):
+    """
+    Two-tier (memory LRU + optional disk) store of generated source.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries kept in memory.
+    directory : str or None
+        Directory of the on-disk tier; disabled if None.
+    max_bytes : int
+        Size budget of the on-disk tier. The least recently used files are
+        removed once the total size exceeds the budget.
+    """
+    suffix = '.src'
+
+    def __init__(self, maxsize=128, directory=None, max_bytes=64*1024*1024):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self.directory is not None and os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._memory:
+                src = self._memory.pop(key)
+                self._memory[key] = src
+                self.hits += 1
+                self.memory_hits += 1
+                return src
+
+            src = self._read(key)
+            if src is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, src)
+            return src
+
+    def set(self, key, src):
+        with self._lock:
+            self._remember(key, src)
+            self._write(key, src)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.directory is None:
+                return
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+            memory_hits=self.memory_hits, disk_hits=self.disk_hits,
+            memory_entries=len(self._memory))
+
+    def _remember(self, key, src):
+        self._memory.pop(key, None)
+        self._memory[key] = src
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with io.open(path, 'r', encoding='utf-8') as f:
+                src = f.read()
+        except (IOError, OSError):
+            return None
+        # mark as recently used for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return src
+
+    def _write(self, key, src):
+        if self.directory is None:
+            return
+        if not isinstance(src, type(u'')):
+            src = src.decode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with io.open(fd, 'w', encoding='utf-8') as f:
+            f.write(src)
+        path = self._path(key)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,426 @@
+"""
+Control-flow graph of a function's bytecode and recovery of its structure.
+
+The instructions are split into basic blocks. Chains of conditional jumps
+that only evaluate a condition (short-circuit `and`/`or`) are merged into a
+single branch on a compound condition, and the graph is then decoded into
+nested regions using post-dominators: the join point of a branch is its
+immediate post-dominator. The only loops recognised are `for` loops, whose
+body is the region from the `FOR_ITER` header back to itself.
+"""
+from opcode import opmap, hasjrel, hasjabs
+
+from .bytecode import InstructionStream
+
+# conditional jump -> whether it jumps when its operand is true
+CONDITIONAL = dict((opmap[name], name.endswith('TRUE'))
+    for name in ('POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE') if name in opmap)
+
+# jumps that keep their operand on the stack when taken
+SHORT_CIRCUIT = dict((opmap[name], op)
+    for name, op in (('JUMP_IF_FALSE_OR_POP', 'and'),
+        ('JUMP_IF_TRUE_OR_POP', 'or')) if name in opmap)
+
+UNCONDITIONAL = frozenset(opmap[name]
+    for name in ('JUMP_FORWARD', 'JUMP_ABSOLUTE') if name in opmap)
+
+LOOPS = frozenset([opmap['FOR_ITER']])
+
+# loop exits other than exhausting the iterator
+LOOP_EXITS = frozenset(opmap[name]
+    for name in ('BREAK_LOOP', 'CONTINUE_LOOP') if name in opmap)
+
+TERMINATORS = frozenset(opmap[name]
+    for name in ('RETURN_VALUE', 'RAISE_VARARGS') if name in opmap)
+
+JUMPS = frozenset(CONDITIONAL) | frozenset(SHORT_CIRCUIT) | UNCONDITIONAL | \
+    LOOPS
+
+# instructions that evaluate an expression without side effects on the
+# function's state
+PURE_PREFIXES = ('LOAD_', 'BINARY_', 'UNARY_', 'COMPARE_OP', 'CALL_FUNCTION',
+    'BUILD_', 'DUP_TOP', 'ROT_', 'NOP')
+
+
+def jump_target(ins):
+    """
+    Offset an instruction jumps to, or None.
+    """
+    if ins.opcode not in hasjrel and ins.opcode not in hasjabs:
+        return None
+    return ins.argval
+
+
+class Block(object):
+    """
+    Basic block; `body` excludes the jump that ends it.
+    """
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.offset = instructions[0].offset
+        last = instructions[-1]
+        self.jump = last if last.opcode in JUMPS else None
+        self.body = instructions[:-1] if self.jump else instructions
+        self.next = None
+        self.target = None
+        self.preds = []
+        # set for blocks ending with a conditional jump
+        self.cond = None
+        self.true = None
+        self.false = None
+        # name bound by a `FOR_ITER` block
+        self.loop_target = None
+
+    def __repr__(self):
+        return "Block({})".format(self.offset)
+
+    @property
+    def succ(self):
+        if self.cond is not None:
+            return [self.true, self.false]
+        op = self.jump.opcode if self.jump else None
+        if op in UNCONDITIONAL:
+            return [self.target]
+        if op in SHORT_CIRCUIT or op in LOOPS:
+            return [self.next, self.target]
+        if self.instructions[-1].opcode in TERMINATORS:
+            return []
+        return [self.next] if self.next is not None else []
+
+    def is_pure(self):
+        return all(ins.opname.startswith(PURE_PREFIXES) for ins in self.body)
+
+
+# Conditions
+class Test(object):
+    """
+    Value left on the stack by a block.
+    """
+    def __init__(self, block):
+        self.block = block
+
+class Not(object):
+    def __init__(self, operand):
+        self.operand = operand
+
+class BoolOp(object):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+def negate(cond):
+    return cond.operand if isinstance(cond, Not) else Not(cond)
+
+
+# Regions
+class Branch(object):
+    """
+    Two-way branch on `cond`; `body` and `orelse` are regions.
+    """
+    def __init__(self, cond, body, orelse):
+        self.cond = cond
+        self.body = body
+        self.orelse = orelse
+
+class Loop(object):
+    """
+    `for <target> in <value left on the stack>: <body>`.
+    """
+    def __init__(self, header, body):
+        self.header = header
+        self.target = header.loop_target
+        self.body = body
+
+class ShortCircuit(object):
+    """
+    Value of `<value of block> <op> <value of rest>`.
+    """
+    def __init__(self, block, op, rest):
+        self.block = block
+        self.op = op
+        self.rest = rest
+
+
+def blocks(region):
+    """
+    Iterate over the blocks of a region and of its nested regions.
+    """
+    for item in region:
+        if isinstance(item, Block):
+            yield item
+        elif isinstance(item, Branch):
+            for block in blocks(item.body):
+                yield block
+            for block in blocks(item.orelse):
+                yield block
+        elif isinstance(item, Loop):
+            yield item.header
+            for block in blocks(item.body):
+                yield block
+        else:
+            yield item.block
+            for block in blocks(item.rest):
+                yield block
+
+
+def is_empty(region):
+    return all(isinstance(item, Block) and
+        all(ins.opname == 'NOP' for ins in item.body) for item in region)
+
+
+class ControlFlowGraph(object):
+    """
+    Basic-block graph of a list of instructions.
+    """
+    def __init__(self, instructions):
+        self.blocks = self.split(instructions)
+        index = dict((block.offset, block) for block in self.blocks)
+        for i, block in enumerate(self.blocks):
+            if i + 1 < len(self.blocks):
+                block.next = self.blocks[i + 1]
+            if block.jump is not None:
+                block.target = index[jump_target(block.jump)]
+            if block.jump is not None and block.jump.opcode in CONDITIONAL:
+                block.cond = Test(block)
+                if CONDITIONAL[block.jump.opcode]:
+                    block.true, block.false = block.target, block.next
+                else:
+                    block.true, block.false = block.next, block.target
+        self.entry = self.blocks[0] if self.blocks else None
+        for block in self.blocks:
+            if block.jump is not None and block.jump.opcode in LOOPS:
+                self.bind_loop_target(block)
+        self.link()
+        self.check_loops()
+        self.merge_conditions()
+        self.ipdom = self.post_dominators()
+
+    @staticmethod
+    def split(instructions):
+        for ins in instructions:
+            if ins.opcode in LOOP_EXITS:
+                raise NotImplementedError("'{}' at offset {} is not "
+                    "supported".format(ins.opname, ins.offset))
+        leaders = set([instructions[0].offset]) if instructions else set()
+        for i, ins in enumerate(instructions):
+            target = jump_target(ins)
+            if target is not None:
+                leaders.add(target)
+            if ins.opcode in JUMPS or ins.opcode in TERMINATORS:
+                if i + 1 < len(instructions):
+                    leaders.add(instructions[i + 1].offset)
+        blocks = []
+        for ins in instructions:
+            if ins.offset in leaders:
+                blocks.append([])
+            blocks[-1].append(ins)
+        return [Block(x) for x in blocks]
+
+    def reachable(self):
+        order = []
+        seen = set()
+        stack = [self.entry] if self.entry else []
+        while stack:
+            block = stack.pop()
+            if block in seen:
+                continue
+            seen.add(block)
+            order.append(block)
+            stack.extend(reversed([x for x in block.succ if x is not None]))
+        return order
+
+    @staticmethod
+    def bind_loop_target(block):
+        """
+        Move the store of the loop variable from the body to the header.
+        """
+        first = block.next.body[0] if block.next and block.next.body else None
+        if first is None or first.opname not in ('STORE_FAST', 'STORE_NAME'):
+            raise NotImplementedError("loop at offset {} must assign a single "
+                "name".format(block.offset))
+        block.loop_target = first.argval
+        block.next.body = block.next.body[1:]
+
+    def check_loops(self):
+        """
+        Raise NotImplementedError on a back edge to anything but a `for`
+        header, i.e. on `while` loops.
+        """
+        state = {}
+        stack = [(self.entry, iter(self.entry.succ))] if self.entry else []
+        if self.entry:
+            state[self.entry] = 'open'
+        while stack:
+            block, succ = stack[-1]
+            for other in succ:
+                if state.get(other) == 'open':
+                    if other.loop_target is None:
+                        raise NotImplementedError("loop at offset {} is not a "
+                            "for loop".format(other.offset))
+                elif other not in state:
+                    state[other] = 'open'
+                    stack.append((other, iter(other.succ)))
+                    break
+            else:
+                state[block] = 'done'
+                stack.pop()
+
+    def check_loop_body(self, header):
+        """
+        Raise NotImplementedError if the body of the `for` loop at `header`
+        leaves the loop other than by returning to the header, i.e. with
+        `break`, `return` or `raise`.
+        """
+        seen = set([header])
+        stack = [header.next]
+        while stack:
+            block = stack.pop()
+            if block in seen:
+                continue
+            seen.add(block)
+            if block is header.target:
+                raise NotImplementedError("'break' in loop at offset {} is "
+                    "not supported".format(header.jump.offset))
+            if not block.succ:
+                raise NotImplementedError("'{}' in loop at offset {} is not "
+                    "supported".format(block.instructions[-1].opname.split(
+                    '_')[0].lower(), header.jump.offset))
+            stack.extend(block.succ)
+
+    def link(self):
+        for block in self.blocks:
+            block.preds = []
+        for block in self.reachable():
+            for succ in block.succ:
+                if block not in succ.preds:
+                    succ.preds.append(block)
+
+    def merge_conditions(self):
+        """
+        Merge conditional blocks that only continue the condition of their
+        single predecessor into it, e.g. `if a and b` jumps to the test of
+        `b` only when `a` holds.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for block in self.reachable():
+                if block.cond is not None and self.merge(block):
+                    changed = True
+                    break
+
+    def merge(self, block):
+        for other in (block.true, block.false):
+            if other is block or other.cond is None or not other.is_pure() \
+                    or other.preds != [block]:
+                continue
+            cond, (true, false) = other.cond, other.succ
+            if other is block.true:
+                # block.false also when `other` fails: `block and other`
+                if false is block.false:
+                    block.cond = BoolOp('and', block.cond, cond)
+                    block.true = true
+                elif true is block.false:
+                    block.cond = BoolOp('and', block.cond, negate(cond))
+                    block.true = false
+                else:
+                    continue
+            else:
+                # block.true also when `other` holds: `block or other`
+                if true is block.true:
+                    block.cond = BoolOp('or', block.cond, cond)
+                    block.false = false
+                elif false is block.true:
+                    block.cond = BoolOp('or', block.cond, negate(cond))
+                    block.false = true
+                else:
+                    continue
+            self.link()
+            return True
+        return False
+
+    def post_dominators(self):
+        """
+        Immediate post-dominator of every reachable block; None stands for
+        the exit of the function.
+        """
+        blocks = self.reachable()
+        every = set(blocks) | set([None])
+        pdom = dict((block, every) for block in blocks)
+        pdom[None] = set([None])
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(blocks):
+                succ = block.succ or [None]
+                new = set([block]) | set.intersection(*[pdom[x] for x in succ])
+                if new != pdom[block]:
+                    pdom[block] = new
+                    changed = True
+        ipdom = {}
+        for block in blocks:
+            strict = pdom[block] - set([block])
+            for candidate in strict:
+                if pdom[candidate] == strict:
+                    ipdom[block] = candidate
+                    break
+            else:
+                ipdom[block] = None
+        return ipdom
+
+    def structure(self):
+        """
+        Decode the graph into nested regions: lists of blocks, Branch, Loop
+        and ShortCircuit objects.
+        """
+        return self.region(self.entry, None)
+
+    def region(self, block, stop):
+        items = []
+        seen = set()
+        while block is not None and block is not stop:
+            if block in seen:
+                raise NotImplementedError(
+                    "loop at offset {} is not supported".format(block.offset))
+            seen.add(block)
+            if block.cond is not None:
+                join = self.ipdom[block]
+                body = self.region(block.true, join)
+                orelse = self.region(block.false, join)
+                if is_empty(body):
+                    # e.g. `if test: continue`
+                    items.append(Branch(negate(block.cond), orelse, []))
+                else:
+                    items.append(Branch(block.cond, body, orelse))
+                block = join
+            elif block.jump is not None and block.jump.opcode in LOOPS:
+                self.check_loop_body(block)
+                items.append(Loop(block, self.region(block.next, block)))
+                block = block.target
+            elif block.jump is not None and block.jump.opcode in SHORT_CIRCUIT:
+                op = SHORT_CIRCUIT[block.jump.opcode]
+                items.append(ShortCircuit(block, op,
+                    self.region(block.next, block.target)))
+                block = block.target
+            else:
+                items.append(block)
+                succ = block.succ
+                block = succ[0] if succ else None
+        return items
+
+
+def structure(instructions):
+    """
+    Nested regions of `instructions` (see `ControlFlowGraph.structure`).
+    The regions of an InstructionStream are built once and kept on the
+    stream; translating only reads them.
+    """
+    if isinstance(instructions, InstructionStream) and \
+            instructions.regions is not None:
+        return instructions.regions
+    regions = ControlFlowGraph(list(instructions)).structure()
+    if isinstance(instructions, InstructionStream):
+        instructions.regions = regions
+    return regions
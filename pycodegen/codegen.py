@@ -1,308 +1,501 @@
 from __future__ import print_function
 
-import dis
 from opcode import *
-from collections import namedtuple
 
 import sys
+import warnings
+import threading
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from .cache import make_key, code_fingerprint
+from .expr import (Name, Const, Attr, Subscript, BinOp, UnaryOp, Call,
+    Select, Stmt, Assign, Return, If, For, Else, EndBlock, PythonPrinter)
+from .cfg import structure, Test, Not, Branch, Loop, ShortCircuit
+from .bytecode import instruction_stream
+from .inference import COMPARISONS
 
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
 
-if PY2:
-    Instruction = namedtuple('Instruction',
-        ('starts_line', 'curr_ins', 'is_jump_target', 'offset', 'opname', 'arg', 'argval'))
+UNKNOWN_POLICIES = ('raise', 'warn', 'collect')
+
+def is_truth_value(node):
+    if isinstance(node, Const):
+        return isinstance(node.value, bool)
+    if isinstance(node, UnaryOp):
+        return node.op == 'not'
+    if isinstance(node, BinOp):
+        return node.op in COMPARISONS or node.op in ('and', 'or')
+    return False
+
+def short_circuit(op, left, right):
+    """
+    Value of `left <op> right`. Python returns one of the operands, so
+    unless both are truth values this is `left ? left : right` for `or`
+    and `left ? right : left` for `and`.
+    """
+    if is_truth_value(left) and is_truth_value(right):
+        return BinOp(op, left, right)
+    if op == 'or':
+        return Select(left, left, right)
+    return Select(left, right, left)
+
+def _run_attribute(name):
+    def get(self):
+        return getattr(self.state, name)
+
+    def set(self, value):
+        setattr(self.state, name, value)
+    return property(get, set)
+
+
+class DispatchMeta(type):
+    """
+    Resolve the `handle_*` methods of a generator class into a table indexed
+    by opcode when the class is defined, and turn the names listed in its
+    `run_attributes` into properties of the state of the current run.
+    """
+    def __init__(cls, name, bases, namespace):
+        super(DispatchMeta, cls).__init__(name, bases, namespace)
+        table = []
+        for op_name in opname:
+            handle = getattr(cls, "handle_{}".format(op_name.lower()), None)
+            table.append(getattr(handle, '__func__', handle))
+        cls.dispatch_table = table
+        for attr in namespace.get('run_attributes', ()):
+            setattr(cls, attr, _run_attribute(attr))
+
+_CodeGeneratorBase = DispatchMeta('_CodeGeneratorBase', (object,), {})
+
+class RunState(object):
+    """
+    Mutable state of one translation.
+    """
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class CodeGenerator(_CodeGeneratorBase):
+    """
+    Translate the bytecode of a function.
+
+    The configuration and the analysis of the function are fixed when the
+    generator is created. Everything a translation changes lives in a
+    RunState, so one generator can translate from several threads at once
+    and translating again starts afresh. The attributes listed in
+    `run_attributes` read the state of the calling thread's current run,
+    or of the last run completed by any thread.
+    """
+    run_attributes = ('var', 'statements', 'space', 'line', 'hoisted',
+        'reports', 'unknown_instructions', 'ostream')
 
-class CodeGenerator(object):
     def __init__(self, func, **kwargs):
-        self.ostream = kwargs.pop('ostream', sys.stdout)
+        self.output = kwargs.pop('ostream', sys.stdout)
         self.indent = kwargs.pop('indent', 4)
         self.offset = kwargs.pop('offset', 0)
         self.newline = kwargs.pop('newline', '\n')
+        self.cache = kwargs.pop('cache', None)
+        # an instrument.Profiler, or None
+        self.profiler = kwargs.pop('profiler', None)
+        self.unknown = kwargs.pop('unknown', 'warn')
+        if self.unknown not in UNKNOWN_POLICIES and not callable(self.unknown):
+            raise ValueError("unknown must be one of {} or a callable, "
+                "got {!r}".format(UNKNOWN_POLICIES, self.unknown))
+
+        self.printer = self.create_printer()
 
         self.func = func
-        self.instructions = self.get_instructions(func)
+        self.instructions = self.get_instructions(getattr(func, '__code__',
+            func))
+
+        self._local = threading.local()
+        self._completed = self.new_state()
+        if self.profiler is not None:
+            self.profiler.instrument(self)
+
+    def new_state(self):
+        return RunState(
+            var=[],
+            statements=[],
+            space=0,
+            line=-1,
+            # statements emitted ahead of the expression being translated,
+            # e.g. the body of an inlined call
+            hoisted=0,
+            reports={},
+            unknown_instructions=[],
+            ostream=self.output)
+
+    @property
+    def state(self):
+        return getattr(self._local, 'state', None) or self._completed
+
+    def begin_run(self):
+        """
+        Start a translation with a fresh state in the calling thread.
+        """
+        state = self.new_state()
+        if self.profiler is not None:
+            state.ostream = self.profiler.stream(state.ostream)
+        self._local.state = state
+        return state
 
-        self.var = []
-        self.space = 0
-        self.jump_targets = []
-        self.enter_indent = False
-        self.leave_indent = False
+    def end_run(self):
+        """
+        Publish the state of the calling thread's run to other threads.
+        """
+        self._completed = self._local.state
 
-    def _post_output(self):
-        self.var = []
-        if self.enter_indent:
-            self.space += self.indent
-            self.enter_indent = False
-        if self.leave_indent:
-            self.space -= self.indent
-            self.leave_indent = False
+    def create_printer(self):
+        return PythonPrinter()
 
     def output_statement(self):
-        spaces = " " * (self.offset + self.space)
         for statement in self.var:
+            self.statements.append((self.space, statement))
+        self.var = []
+
+    def optimize(self, statements):
+        """
+        Hook for passes over the translated `(space, statement)` pairs.
+        """
+        return statements
+
+    def emit(self, statements):
+        for space, statement in statements:
+            spaces = " " * (self.offset + space)
+            statement = self.printer.statement(statement)
             self.ostream.write(spaces + statement + self.newline)
-        self._post_output()
+
+    def cache_key(self):
+        return make_key(type(self).__module__, type(self).__name__,
+            code_fingerprint(self.func), self.indent, self.offset, self.newline)
+
+    def cache_entry(self, src):
+        """
+        Text stored in the cache for source `src` of the last run.
+        """
+        return src
+
+    def load_entry(self, entry):
+        """
+        Source of a cache entry, restoring what the run that made it found.
+        """
+        return entry
 
     def generate(self, instructions=None):
+        self.begin_run()
+        if self.cache is None or instructions is not None:
+            self.translate(instructions)
+            self.end_run()
+            return
+
+        key = self.cache_key()
+        src = self.cache.get(key)
+        if src is None:
+            ostream, self.ostream = self.ostream, StringIO()
+            try:
+                self.translate()
+                src = self.ostream.getvalue()
+            finally:
+                self.ostream = ostream
+            self.cache.set(key, src)
+        self.ostream.write(src)
+        self.end_run()
+
+    def generate_source(self):
+        """
+        Translate the function and return its source instead of writing it
+        to `ostream`.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache_key()
+            entry = self.cache.get(key)
+            if entry is not None:
+                return self.load_entry(entry)
+
+        state = self.begin_run()
+        ostream = StringIO()
+        state.ostream = ostream if self.profiler is None else \
+            self.profiler.stream(ostream)
+        self.translate()
+        self.end_run()
+        src = ostream.getvalue()
+
+        if key is not None:
+            self.cache.set(key, self.cache_entry(src))
+        return src
+
+    def translate(self, instructions=None):
         instructions = instructions or self.instructions
-        line = -1
+        self.statements.extend(self.translate_body(instructions))
+        self.statements = self.optimize(self.statements)
+        self.emit(self.statements)
+
+    def translate_body(self, instructions):
+        """
+        Translate the instructions of a function and return its statements,
+        leaving the state of an ongoing translation untouched.
+        """
+        saved = self.var, self.statements, self.space, self.line, self.hoisted
+        self.var, self.statements, self.space, self.line = [], [], 0, -1
+        try:
+            self.translate_region(structure(instructions))
+            self.output_statement()
+            return self.statements
+        finally:
+            (self.var, self.statements, self.space, self.line,
+                self.hoisted) = saved
+
+    def translate_instructions(self, instructions):
+        dispatch = self.dispatch_table
         for ins in instructions:
-            if not len(ins):
-                continue
-            if ins.starts_line is not None and line != ins.starts_line:
-                if line > 0 and len(self.var):
+            if ins.starts_line is not None and self.line != ins.starts_line:
+                if self.line > 0 and len(self.var):
                     self.output_statement()
-                line = ins.starts_line
+                self.line = ins.starts_line
 
-            if ins.is_jump_target:
-                self.process_jump(ins)
-
-            handle = getattr(self, "handle_{}".format(ins.opname.lower()), None)
+            handle = dispatch[ins.opcode]
             if handle is not None:
-                handle(ins)
+                handle(self, ins)
+            else:
+                self.handle_unknown(ins)
+
+    def translate_region(self, region):
+        for item in region:
+            if isinstance(item, Branch):
+                self.translate_branch(item)
+            elif isinstance(item, Loop):
+                self.translate_loop(item)
+            elif isinstance(item, ShortCircuit):
+                self.translate_instructions(item.block.body)
+                left = self.var.pop()
+                self.translate_region(item.rest)
+                self.var.append(short_circuit(item.op, left, self.var.pop()))
             else:
-                print(ins)
+                self.translate_instructions(item.body)
+
+    def translate_loop(self, loop):
+        func, args = None, []
+        value = self.var.pop()
+        if isinstance(value, Call) and isinstance(value.func, Name):
+            func, args = value.func.id, list(value.args)
+        if func not in ('range', 'xrange') or not 1 <= len(args) <= 3:
+            raise NotImplementedError("loop at offset {} does not iterate "
+                "over range()".format(loop.header.offset))
+        if len(args) == 1:
+            args.insert(0, Const(0))
+        if len(args) == 2:
+            args.append(Const(1))
+        self.output_statement()
+        space = self.space
+        self.statements.append((space, For(Name(loop.target), *args)))
+        self.space += self.indent
+        self.translate_region(loop.body)
+        self.output_statement()
+        self.space = space
+        self.statements.append((space, EndBlock()))
+
+    def translate_condition(self, cond):
+        if isinstance(cond, Test):
+            self.translate_instructions(cond.block.body)
+            return self.var.pop()
+        if isinstance(cond, Not):
+            return UnaryOp('not', self.translate_condition(cond.operand))
+        left = self.translate_condition(cond.left)
+        return BinOp(cond.op, left, self.translate_condition(cond.right))
+
+    def translate_branch(self, branch):
+        test = self.translate_condition(branch.cond)
+        if all(isinstance(x, Stmt) for x in self.var):
+            self.output_statement()
+        depth = len(self.var)
+        mark = len(self.statements)
+        hoisted = self.hoisted
+        space = self.space
+
+        self.space += self.indent
+        self.translate_region(branch.body)
+        if len(self.var) == depth + 1 and not isinstance(self.var[-1], Stmt) \
+                and len(self.statements) - mark == self.hoisted - hoisted:
+            # both branches compute a value, as in `a if test else b`
+            body = self.var.pop()
+            self.translate_region(branch.orelse)
+            self.space = space
+            # the bodies of inlined calls run unconditionally
+            self.statements[mark:] = [(x - self.indent, stmt)
+                for x, stmt in self.statements[mark:]]
+            self.var.append(Select(test, body, self.var.pop()))
+            return
 
         self.output_statement()
+        self.statements.insert(mark, (space, If(test)))
+        if branch.orelse:
+            self.statements.append((space, Else()))
+            self.translate_region(branch.orelse)
+            self.output_statement()
+        self.space = space
+        self.statements.append((space, EndBlock()))
 
-    def get_instructions(self, co, lasti=-1):
+    def get_instructions(self, co):
         """
-        Get the bytecode instructions of a code object.
-
-        This function is modified from the official Python 2.7 dis.disassemble.
+        Get the bytecode instructions of a code object, decoded once and
+        shared with the other generators of the same code object.
         """
-        # python3
-        if sys.version_info[0] == 3:
-            return [x for x in dis.get_instructions(co)]
-
-        # python2
-        code = co.co_code
-        labels = dis.findlabels(code)
-        linestarts = dict(dis.findlinestarts(co))
-        n = len(code)
-        i = 0
-        extended_arg = 0
-        free = None
-        output = []
-        instructions = []
-
-        while i < n:
-            c = code[i]
-            op = ord(c)
-            if i in linestarts:
-                if i > 0:
-                    instructions.append([])
-                    output = []
-                output.append( int(linestarts[i]) )
-            else:
-                output.append( None )
-
-            if i == lasti: output.append( '-->' ),
-            else: output.append( '   ' ),
-
-            # determine if jump target
-            output.append( i in labels )
-            output.append( int(i) ),
-            output.append( opname[op] ),
-            i = i+1
-            if op >= HAVE_ARGUMENT:
-                oparg = ord(code[i]) + ord(code[i+1])*256 + extended_arg
-                extended_arg = 0
-                i = i+2
-                if op == EXTENDED_ARG:
-                    extended_arg = oparg*65536
-#                 output.append( repr(oparg).rjust(5) ),
-                output.append( int(oparg) )
-                if op in hasconst:
-                    output.append( co.co_consts[oparg] ),
-                elif op in hasname:
-                    output.append( co.co_names[oparg] ),
-                elif op in hasjrel:
-                    output.append( i + oparg ),
-                elif op in haslocal:
-                    output.append( co.co_varnames[oparg] ),
-                elif op in hascompare:
-                    output.append( cmp_op[oparg] ),
-                elif op in hasfree:
-                    if free is None:
-                        free = co.co_cellvars + co.co_freevars
-                    output.append( free[oparg] ),
-            for j in xrange(max(0, 7-len(output))):
-                output.append('')
-
-            ins = Instruction(*output)
-            instructions.append(ins)
-            output = []
-        return instructions
-
-    def process_jump(self, ins):
-        if len(self.jump_targets) and self.jump_targets[0] == ins.offset:
-            if len(self.var):
-                self.output_statement()
-            self.jump_targets.pop()
-            self.space -= self.indent
-            self.leave_indent = False
-            self.var.append('')
-            self.output_statement()
+        return instruction_stream(co)
+
+    def handle_unknown(self, ins):
+        if callable(self.unknown):
+            self.unknown(self, ins)
+            return
+        msg = "Opcode {} at offset {} is not supported.".format(
+            ins.opname, ins.offset)
+        if self.unknown == 'raise':
+            raise NotImplementedError(msg)
+        self.unknown_instructions.append(ins)
+        if self.unknown == 'warn':
+            warnings.warn(msg, RuntimeWarning)
+
+    def _binop(self, op):
+        self.var[-2] = BinOp(op, self.var[-2], self.var[-1])
+        del self.var[-1]
 
     def handle_load_fast(self, ins):
-        self.var.append( ins.argval )
+        self.var.append( Name(ins.argval) )
 
     def handle_load_attr(self, ins):
-        self.var[-1] += ".{0}".format(ins.argval)
-
-    def handle_store_subscr(self, ins):
-        temp = "{0}[{1}] = {2}"
-        self.var[-3] = temp.format(self.var[-2], self.var[-1], self.var[-3])
-        del self.var[-2:]
+        self.var[-1] = Attr(self.var[-1], ins.argval)
 
     # Binary operation
     def handle_binary_power(self, ins):
-        self.var[-2] = "{0} ** {1}".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('**')
 
     def handle_binary_multiply(self, ins):
-        self.var[-2] = "({0} * {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('*')
 
     def handle_binary_matrix_multiply(self, ins):
         raise TypeError("BINARY_MATRIX_MULTIPLY is not supported.")
 
     def handle_binary_floor_divide(self, ins):
-        self.var[-2] = "({0} / {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('//')
 
     def handle_binary_divide(self, ins):
-        self.var[-2] = "({0} / {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('/')
 
     def handle_binary_true_divide(self, ins):
-        self.var[-2] = "({0} / {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('/')
 
     def handle_binary_modulo(self, ins):
-        self.var[-2] = "({0} % {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('%')
 
     def handle_binary_add(self, ins):
-        self.var[-2] = "({0} + {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('+')
 
     def handle_binary_subtract(self, ins):
-        self.var[-2] = "({0} - {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('-')
 
     def handle_binary_subscr(self, ins):
-        self.var[-2] = "{0}[{1}]".format(self.var[-2], self.var[-1])
+        self.var[-2] = Subscript(self.var[-2], self.var[-1])
         del self.var[-1]
 
     def handle_binary_lshift(self, ins):
-        self.var[-2] = "({0} << {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('<<')
 
     def handle_binary_rshift(self, ins):
-        self.var[-2] = "({0} >> {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('>>')
 
     def handle_binary_and(self, ins):
-        self.var[-2] = "({0} & {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('&')
 
     def handle_binary_xor(self, ins):
-        self.var[-2] = "({0} ^ {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('^')
 
     def handle_binary_or(self, ins):
-        self.var[-2] = "({0} | {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('|')
 
     # in-place operation
     def handle_inplace_power(self, ins):
-        pass
+        self._binop('**')
 
     def handle_inplace_multiply(self, ins):
-        pass
+        self._binop('*')
 
     def handle_inplace_matrix_multiply(self, ins):
         raise TypeError("BINARY_MATRIX_MULTIPLY is not supported.")
 
     def handle_inplace_floor_divide(self, ins):
-        pass
+        self._binop('//')
 
     def handle_inplace_divide(self, ins):
-        pass
+        self._binop('/')
 
     def handle_inplace_true_divide(self, ins):
-        pass
+        self._binop('/')
 
     def handle_inplace_modulo(self, ins):
-        pass
+        self._binop('%')
 
     def handle_inplace_add(self, ins):
-        self.var[-2] = "({0} + {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
+        self._binop('+')
 
     def handle_inplace_subtract(self, ins):
-        self.var[-2] = "({0} - {1})".format(self.var[-2], self.var[-1])
-        del self.var[-1]
-
-    def handle_inplace_subscr(self, ins):
-        pass
+        self._binop('-')
 
     def handle_inplace_lshift(self, ins):
-        pass
+        self._binop('<<')
 
     def handle_inplace_rshift(self, ins):
-        pass
+        self._binop('>>')
 
     def handle_inplace_and(self, ins):
-        pass
+        self._binop('&')
 
     def handle_inplace_xor(self, ins):
-        pass
+        self._binop('^')
 
     def handle_inplace_or(self, ins):
-        pass
+        self._binop('|')
 
     def handle_store_subscr(self, ins):
-        pass
+        self.var[-3] = Assign(Subscript(self.var[-2], self.var[-1]), self.var[-3])
+        del self.var[-2:]
 
     def handle_delete_subscr(self, ins):
         pass
 
     def handle_compare_op(self, ins):
-        op = ins.argval
-        self.var[-2] = "({0} {1} {2})".format(self.var[-2], op, self.var[-1])
-        del self.var[-1]
+        self._binop(ins.argval)
 
     def handle_store_attr(self, ins):
         self.handle_load_attr(ins)
-        self.var[-2] = "{0} = {1}".format(self.var[-1], self.var[-2])
+        self.var[-2] = Assign(self.var[-1], self.var[-2])
         del self.var[-1]
 
     def handle_store_fast(self, ins):
-        self.var[-1] = "{0} = {1}".format(ins.argval, self.var[-1])
+        self.var[-1] = Assign(Name(ins.argval), self.var[-1])
 
     def handle_unary_negative(self, ins):
-        self.var[-1] = "(-{0})".format(self.var[-1])
+        self.var[-1] = UnaryOp('-', self.var[-1])
+
+    def handle_unary_positive(self, ins):
+        self.var[-1] = UnaryOp('+', self.var[-1])
 
-    def handle_pop_jump_if_true(self, ins):
-        self.jump_targets.append(ins.arg)
-        self.enter_indent = True
-        self.var[-1] = "if not {0}:".format(self.var[-1])
+    def handle_unary_not(self, ins):
+        self.var[-1] = UnaryOp('not', self.var[-1])
 
-    def handle_pop_jump_if_false(self, ins):
-        self.jump_targets.append(ins.arg)
-        self.enter_indent = True
-        self.var[-1] = "if {0}:".format(self.var[-1])
+    def handle_unary_invert(self, ins):
+        self.var[-1] = UnaryOp('~', self.var[-1])
 
     def handle_load_global(self, ins):
-        self.var.append( ins.argval )
+        self.var.append( Name(ins.argval) )
 
     def handle_load_const(self, ins):
-        self.var.append( ins.argval )
+        self.var.append( Const(ins.argval) )
 
     def handle_dup_top(self, ins):
         self.var.append( self.var[-1] )
@@ -315,27 +508,25 @@ class CodeGenerator(object):
     def handle_pop_top(self, ins):
         pass
 
+    def handle_nop(self, ins):
+        pass
+
+    def handle_setup_loop(self, ins):
+        pass
+
+    def handle_get_iter(self, ins):
+        pass
+
+    def handle_pop_block(self, ins):
+        pass
+
     def handle_call_function(self, ins):
         narg = int(ins.arg)
-        args = [] if narg == 0 else [str(x) for x in self.var[-narg:]]
-        self.var[-(narg+1)] += "({})".format(', '.join(args))
+        args = [] if narg == 0 else self.var[-narg:]
+        self.var[-(narg+1)] = Call(self.var[-(narg+1)], args)
 
         if narg > 0:
             del self.var[-narg:]
 
-    def handle_jump_forward(self, ins):
-        self.leave_indent = True
-        self.output_statement()
-
-        target, old_target = ins.argval, self.jump_targets.pop()
-
-        if target != old_target:
-            self.var.append("else:")
-            self.enter_indent = True
-            self.jump_targets.append(target)
-        else:
-            self.var.append('')
-            self.output_statement()
-
     def handle_return_value(self, ins):
-        self.var[-1] = "return {0}".format(self.var[-1])
+        self.var[-1] = Return(self.var[-1])
@@ -1,11 +1,117 @@
-from StringIO import StringIO
+import json
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from collections import OrderedDict
 
 from jinja2 import Template
 
-from codegen import CodeGenerator
-from utils import get_func_signature
+from .codegen import CodeGenerator
+from .cache import make_key, code_fingerprint
+from .expr import walk, Name, Attr, Const, Call, Stmt, Assign, Return, \
+    PythonPrinter
+from .optimize import (eliminate_common_subexpressions, fold_constants,
+    if_convert, unroll_loops)
+from .inference import infer_types
+from .dataflow import field_access, eliminate_dead_stores
+from .integrators import (resolve_integrator, add_exponential_coefficients,
+    EVALUATIONS)
+from .metrics import count_operations, arithmetic_operations
+from .inline import (function_namespace, resolve_function,
+    referenced_functions, arguments, splice)
+from .utils import get_func_signature
+
+FLOAT_TYPES = ('float', 'double')
+
+# how model.params reach the kernel: as #defines, as per-thread arrays, or
+# as a struct in constant memory
+PARAM_MODES = ('define', 'array', 'constant')
+
+# layout of the kernel I/O: one array per field, a single buffer holding
+# the arrays of all fields back to back, or a single buffer of interleaved
+# per-thread records
+LAYOUTS = ('soa', 'packed', 'aos')
+
+# how called Python functions are translated: into functions of the
+# generated source, or spliced into `ode`
+INLINE_MODES = ('device', 'splice')
+
+# names a function must not read to be emitted on its own
+MODEL_NAMES = frozenset(['self', 'states', 'gstates', 'jac', 'inters',
+    'params'])
+
+# numpy/math function name -> (single, double) precision C function
+MATH_FUNCTIONS = {
+    'exp': ('expf', 'exp'),
+    'expm1': ('expm1f', 'expm1'),
+    'log': ('logf', 'log'),
+    'log10': ('log10f', 'log10'),
+    'log2': ('log2f', 'log2'),
+    'log1p': ('log1pf', 'log1p'),
+    'sqrt': ('sqrtf', 'sqrt'),
+    'cbrt': ('cbrtf', 'cbrt'),
+    'power': ('powf', 'pow'),
+    'pow': ('powf', 'pow'),
+    'abs': ('fabsf', 'fabs'),
+    'absolute': ('fabsf', 'fabs'),
+    'fabs': ('fabsf', 'fabs'),
+    'sin': ('sinf', 'sin'),
+    'cos': ('cosf', 'cos'),
+    'tan': ('tanf', 'tan'),
+    'arcsin': ('asinf', 'asin'),
+    'arccos': ('acosf', 'acos'),
+    'arctan': ('atanf', 'atan'),
+    'arctan2': ('atan2f', 'atan2'),
+    'asin': ('asinf', 'asin'),
+    'acos': ('acosf', 'acos'),
+    'atan': ('atanf', 'atan'),
+    'atan2': ('atan2f', 'atan2'),
+    'sinh': ('sinhf', 'sinh'),
+    'cosh': ('coshf', 'cosh'),
+    'tanh': ('tanhf', 'tanh'),
+    'floor': ('floorf', 'floor'),
+    'ceil': ('ceilf', 'ceil'),
+    'fmin': ('fminf', 'fmin'),
+    'fmax': ('fmaxf', 'fmax'),
+    'minimum': ('fminf', 'fmin'),
+    'maximum': ('fmaxf', 'fmax'),
+    'hypot': ('hypotf', 'hypot'),
+    'erf': ('erff', 'erf'),
+}
+
+# builtins that are translated like their numpy counterparts
+BUILTIN_FUNCTIONS = {'abs': 'abs', 'pow': 'pow', 'min': 'fmin', 'max': 'fmax'}
+
+MATH_FUNCTION_NAMES = frozenset(
+    ['{}.{}'.format(mod, name) for mod in ('np', 'numpy', 'math')
+        for name in MATH_FUNCTIONS] + list(BUILTIN_FUNCTIONS))
 
 cuda_src_template = """
+{%- macro ode_args(addr, params_addr) -%}
+{%- if inters %}, {{ addr }}inters{% endif %}
+{%- if params %}, {{ params_addr }}params{% endif %}
+{%- for key in ode_signature %}, {{ key }}{% endfor %}
+{%- endmacro %}
+{%- macro step(indent) %}
+{{ indent }}/* compute gradient */
+{{ indent }}ode({{ dialect.addr }}states, {{ dialect.addr }}gstates
+    {%- if exp_euler %}, {{ dialect.addr }}jac{% endif %}{{ ode_args(dialect.addr, dialect.addr) }});
+
+{{ indent }}/* solve ode */
+{{ indent }}forward({{ dialect.addr }}states, {{ dialect.addr }}gstates
+    {%- if exp_euler %}, {{ dialect.addr }}jac{% endif %}
+    {%- if integrator in ('rk2', 'rk4') %}{{ ode_args('', dialect.addr) }}{% endif %}, dt);
+{%- if bounds %}
+
+{{ indent }}/* clip */
+{{ indent }}clip({{ dialect.addr }}states);
+{%- endif %}
+{%- endmacro %}
+{%- set ref, m, addr = dialect.ref, dialect.member, dialect.addr %}
+{%- for include in dialect.includes %}
+#include <{{ include }}>
+{%- endfor %}
 {% for key, val in preprocessing.items() -%}
 #define  {{ key.upper() }}\t\t{{ val }}
 {% endfor -%}
@@ -16,44 +122,60 @@ cuda_src_template = """
 {%- endfor -%}
 {% endif %}
 
-States {
+typedef struct {
     {%- for key in states %}
     {{ float_type }} {{ key }};
     {%- endfor %}
-};
+} States;
 {% if inters %}
-INTERS {
+typedef struct {
     {%- for key in inters %}
     {{ float_type }} {{ key }};
     {%- endfor %}
-};
+} Inters;
+{% endif %}
+{%- if params %}
+typedef struct {
+    {%- for key in params %}
+    {{ float_type }} {{ key }};
+    {%- endfor %}
+} Params;
+{%- if params_mode == 'constant' %}
+
+{% if dialect.constant %}{{ dialect.constant }} {% endif %}Params params;
+{%- endif %}
 {% endif %}
 
 {%- if bounds %}
-__device__ void clip(States &states)
+{{ dialect.device }} void clip(States {{ ref }}states)
 {
     {%- for key, val in bounds.items() %}
-    states.{{ key }} = fmaxf(states.{{ key }}, {{ key.upper() }}_MIN);
-    states.{{ key }} = fminf(states.{{ key }}, {{ key.upper() }}_MAX);
+    states{{ m }}{{ key }} = {{ fmax }}(states{{ m }}{{ key }}, {{ key.upper() }}_MIN);
+    states{{ m }}{{ key }} = {{ fmin }}(states{{ m }}{{ key }}, {{ key.upper() }}_MAX);
     {%- endfor %}
 }
 {%- endif %}
+{%- for func in functions %}
 
-__device__ void forward(
-    States &states,
-    States &gstates,
-    {{ float_type }} dt
+{{ dialect.inline }} {{ float_type }} {{ func.name }}(
+    {%- for key in func.params %}{{ float_type }} {{ key }}{{ ', ' if not loop.last }}{% endfor -%}
 )
 {
-    {%- for key in states %}
-    states.{{ key }} += dt * gstates.{{ key }};
-    {%- endfor %}
+{%- for line in func.variables %}
+    {{ float_type }} {{ line }};
+{%- endfor %}
+{%- if func.variables %}
+{% endif %}
+{{ func.src -}}
 }
+{%- endfor %}
 
-__device__ void ode(
-    States &states,
-    States &gstates
-    {%- if inters %},\n    Inters &inters{%- endif %}
+{{ dialect.device }} void ode(
+    States {{ ref }}states,
+    States {{ ref }}gstates
+    {%- if exp_euler %},\n    States {{ ref }}jac{%- endif %}
+    {%- if inters %},\n    Inters {{ ref }}inters{%- endif %}
+    {%- if params %},\n    const Params {{ ref }}params{%- endif %}
     {%- for key in ode_signature -%}
     ,\n    {{ float_type }} {{ key }}
     {%- endfor %}
@@ -66,106 +188,593 @@ __device__ void ode(
 {{ src -}}
 }
 
-__global__ void {{ model_name }} (
-    int num_thread,
+{{ dialect.device }} void forward(
+    States {{ ref }}states,
+    States {{ ref }}gstates,
+    {%- if exp_euler %}
+    States {{ ref }}jac,
+    {%- endif %}
+    {%- if integrator in ('rk2', 'rk4') %}
+    {%- if inters %}
+    Inters inters,
+    {%- endif %}
+    {%- if params %}
+    const Params {{ ref }}params,
+    {%- endif %}
+    {%- for key in ode_signature %}
+    {{ float_type }} {{ key }},
+    {%- endfor %}
+    {%- endif %}
     {{ float_type }} dt
-    {%- for key in states -%}
-    ,\n    {{ float_type }} *g_{{ key }}
+)
+{
+{%- if integrator == 'rk2' %}
+    States tmp, k2;
+    {%- for key in states %}
+    tmp.{{ key }} = states{{ m }}{{ key }} + {{ literal(0.5) }} * dt * gstates{{ m }}{{ key }};
     {%- endfor %}
-    {%- if inters %}
-    {%- for key in inters -%}
-    ,\n    {{ float_type }} *g_{{ key }}
+    ode({{ addr }}tmp, {{ addr }}k2{{ ode_args(addr, '') }});
+    {%- for key in states %}
+    states{{ m }}{{ key }} += dt * k2.{{ key }};
+    {%- endfor %}
+{%- elif integrator == 'rk4' %}
+    States tmp, k2, k3, k4;
+    {%- for key in states %}
+    tmp.{{ key }} = states{{ m }}{{ key }} + {{ literal(0.5) }} * dt * gstates{{ m }}{{ key }};
+    {%- endfor %}
+    ode({{ addr }}tmp, {{ addr }}k2{{ ode_args(addr, '') }});
+    {%- for key in states %}
+    tmp.{{ key }} = states{{ m }}{{ key }} + {{ literal(0.5) }} * dt * k2.{{ key }};
     {%- endfor %}
+    ode({{ addr }}tmp, {{ addr }}k3{{ ode_args(addr, '') }});
+    {%- for key in states %}
+    tmp.{{ key }} = states{{ m }}{{ key }} + dt * k3.{{ key }};
+    {%- endfor %}
+    ode({{ addr }}tmp, {{ addr }}k4{{ ode_args(addr, '') }});
+    {%- for key in states %}
+    states{{ m }}{{ key }} += dt * (gstates{{ m }}{{ key }} + {{ literal(2.0) }} * (k2.{{ key }} + k3.{{ key }}) + k4.{{ key }}) / {{ literal(6.0) }};
+    {%- endfor %}
+{%- else %}
+    {%- for key in states %}
+    {%- if methods[key] == 'exp_euler' %}
+    states{{ m }}{{ key }} += (jac{{ m }}{{ key }} == {{ literal(0.0) }} ? dt : {{ expm1 }}(jac{{ m }}{{ key }} * dt) / jac{{ m }}{{ key }}) * gstates{{ m }}{{ key }};
+    {%- else %}
+    states{{ m }}{{ key }} += dt * gstates{{ m }}{{ key }};
     {%- endif %}
-    {%- for key in ode_signature -%}
-    ,\n    {{ float_type }} *g_{{ key }}
+    {%- endfor %}
+{%- endif %}
+}
+
+{%- if device_entry %}
+{{ dialect.device }} void {{ device_entry }} (
+    int tid,
+{%- else %}
+{{ dialect.kernel }} {{ model_name }} (
+{%- endif %}
+    {%- for type, name in kernel_args %}
+    {{ type }}{{ name }}{{ ',' if not loop.last }}
     {%- endfor %}
 )
 {
+{%- if device_entry %}
+{%- elif dialect.name == 'cuda' %}
     /* TODO: option for 1-D or 2-D */
     int tid = blockIdx.x * blockDim.x + threadIdx.x;
-    if (tid > num_thread)
+    if (tid >= num_thread)
         return;
-
+{% else %}
+    #pragma omp parallel for simd
+    for (int tid = 0; tid < num_thread; ++tid) {
+{% endif %}
+{%- filter indent(dialect.indent) %}
     States states, gstates;
+    {%- if exp_euler %}
+    States jac;
+    {%- endif %}
     {%- if inters %}
     Inters inters;
-    {% endif %}
+    {%- endif %}
 
     /* import data */
-    {%- for key in states %}
-    states.{{ key }} = g_{{ key }}[tid];
+    {%- for key in states if 'states.' ~ key in loads %}
+    states.{{ key }} = {{ field(key) }};
     {%- endfor %}
     {%- if inters %}
-    {%- for key in inters %}
-    inters.{{ key }} = g_{{ key }}[tid];
+    {%- for key in inters if 'inters.' ~ key in loads %}
+    inters.{{ key }} = {{ field(key) }};
     {%- endfor %}
-    {% endif %}
+    {%- endif %}
     {%- for key in ode_signature %}
-    {{ float_type }} {{ key }} = g_{{ key }}[tid];
+    {{ float_type }} {{ key }} = {{ field(key) }};
     {%- endfor %}
+    {%- if params_mode == 'array' and params %}
+    Params params;
+    {%- for key in params if 'params.' ~ key in loads %}
+    params.{{ key }} = {{ field(key) }};
+    {%- endfor %}
+    {%- endif %}
+{% if multi_step %}
+    /* states and inputs stay in registers for all num_steps steps */
+    for (int step = 0; step < num_steps; ++step) {
+{{- step('        ') }}
+        {%- if trace %}
 
-    {% if run_step %}{% endif %}
-    /* compute gradient */
-    ode(&states, &gstates
-        {%- if inters %}, &inters{% endif %}
-        {%- for key in ode_signature -%}
-        , {{ key }}
-        {%- endfor -%}
-    );
-
-    /* solve ode */
-    forward(&states, &gstates, dt);
-
-    {% if bounds %}
-    /* clip */
-    clip(states);
-    {% endif %}
-
+        /* record trace */
+        if ((step + 1) % {{ trace }} == 0) {
+            int sample = (step + 1) / {{ trace }} - 1;
+            {%- for key in states %}
+            g_trace_{{ key }}[sample * num_thread + tid] = states.{{ key }};
+            {%- endfor %}
+        }
+        {%- endif %}
+    }
+{% else %}
+{{- step('    ') }}
+{% endif %}
     /* export data */
     {%- for key in states %}
-    g_{{ key }}[tid] = states.{{ key }};
+    {{ field(key) }} = states.{{ key }};
     {%- endfor %}
     {%- if inters %}
-    {%- for key in inters %}
-    g_{{ key }}[tid] = inters.{{ key }};
+    {%- for key in inters if 'inters.' ~ key in stores %}
+    {{ field(key) }} = inters.{{ key }};
     {%- endfor %}
-    {% endif %}
-
-    return;
+    {%- endif %}
+{%- endfilter %}
+{%- if dialect.name != 'cuda' and not device_entry %}
+    }
+{%- endif %}
 }
 """
 
+CUDA_DIALECT = dict(
+    name='cuda',
+    includes=(),
+    device='__device__',
+    inline='__device__ __forceinline__',
+    kernel='__global__ void',
+    constant='__constant__',
+    restrict='__restrict__',
+    ref='&',
+    member='.',
+    addr='',
+    indent=0)
+
+class CudaPrinter(PythonPrinter):
+    """
+    Render nodes as CUDA C source.
+    """
+    unary_ops = {'not': '!'}
+    binary_ops = {'//': '/', 'and': '&&', 'or': '||'}
+
+    def __init__(self, func_map=None, float_type='float'):
+        self.func_map = func_map
+        self.float_type = float_type
+
+    def statement(self, node):
+        src = self.expr(node)
+        return src if node.block else src + ';'
+
+    def write_const(self, node, out):
+        if node.value is None:
+            out.append('0')
+        elif isinstance(node.value, bool):
+            out.append(str(int(node.value)))
+        elif isinstance(node.value, float):
+            out.append(repr(node.value))
+            if self.float_type == 'float':
+                out.append('f')
+        else:
+            out.append(str(node.value))
+
+    def write_binop(self, node, out):
+        if node.op != '**':
+            return PythonPrinter.write_binop(self, node, out)
+        out.append(self.function('np.power'))
+        out.append('(')
+        self.write(node.left, out)
+        out.append(', ')
+        self.write(node.right, out)
+        out.append(')')
+
+    def write_call(self, node, out):
+        func = self.function(self.expr(node.func))
+        out.append(func)
+        out.append('(')
+        for i, arg in enumerate(node.args):
+            if i:
+                out.append(', ')
+            self.write(arg, out)
+        out.append(')')
+
+    def function(self, name):
+        return self.func_map(name) if self.func_map else name
+
+    def write_select(self, node, out):
+        out.append('(')
+        self.write(node.test, out)
+        out.append(' ? ')
+        self.write(node.body, out)
+        out.append(' : ')
+        self.write(node.orelse, out)
+        out.append(')')
+
+    def write_return(self, node, out):
+        if isinstance(node.value, Const) and node.value.value is None:
+            out.append('return')
+        else:
+            PythonPrinter.write_return(self, node, out)
+
+    def write_if(self, node, out):
+        out.append('if (')
+        self.write(node.test, out)
+        out.append(') {')
+
+    def write_for(self, node, out):
+        target = self.expr(node.target)
+        down = isinstance(node.step, Const) and node.step.value < 0
+        out.append('for (int {} = '.format(target))
+        self.write(node.start, out)
+        out.append('; {} {} '.format(target, '>' if down else '<'))
+        self.write(node.stop, out)
+        if node.step == Const(1):
+            out.append('; ++{}) {{'.format(target))
+        else:
+            out.append('; {} += '.format(target))
+            self.write(node.step, out)
+            out.append(') {')
+
+    def write_else(self, node, out):
+        out.append('} else {')
+
+    def write_endblock(self, node, out):
+        out.append('}')
+
 class CudaGenerator(CodeGenerator):
+    dialect = CUDA_DIALECT
+    template = cuda_src_template
+    inline_modes = INLINE_MODES
+    run_attributes = CodeGenerator.run_attributes + ('new_signature',
+        'defaults', 'variables', 'access', 'functions', 'inlining', 'splices',
+        'ode_src', 'define_src', 'declaration_src')
+    # run state stored with the source in the translation cache
+    cached_attributes = ('new_signature', 'defaults', 'variables', 'access',
+        'reports')
+
     def __init__(self, model, **kwargs):
         self.model = model
-        self.variables = []
-        self.old_signature, self.new_signature, self.kwargs = self.process_signature()
+        self.float_type = kwargs.pop('float_type', 'float')
+        if self.float_type not in FLOAT_TYPES:
+            raise ValueError("float_type must be one of {}, got {!r}".format(
+                FLOAT_TYPES, self.float_type))
+        self.multi_step = kwargs.pop('multi_step', False)
+        self.trace = kwargs.pop('trace', None)
+        if self.trace is not None and not self.multi_step:
+            raise ValueError("trace requires multi_step=True")
+        # steps of a multi-step launch the metrics amortize the global
+        # loads and stores over
+        self.steps_per_launch = kwargs.pop('steps_per_launch', 1)
+        if self.steps_per_launch < 1:
+            raise ValueError("steps_per_launch must be at least 1, got "
+                "{!r}".format(self.steps_per_launch))
+        self.integrator, self.methods = resolve_integrator(
+            kwargs.pop('integrator', getattr(model, 'integrator', 'euler')),
+            model.states)
+        self.params_mode = kwargs.pop('params', 'define')
+        if self.params_mode not in PARAM_MODES:
+            raise ValueError("params must be one of {}, got {!r}".format(
+                PARAM_MODES, self.params_mode))
+        self.fixed = self.process_fixed(kwargs.pop('fixed', None))
+        self.runtime_params = [key for key in self.model.params
+            if key not in self.fixed]
+        self.layout = kwargs.pop('layout', 'soa')
+        if self.layout not in LAYOUTS:
+            raise ValueError("layout must be one of {}, got {!r}".format(
+                LAYOUTS, self.layout))
+        self.cse = kwargs.pop('cse', False)
+        self.fold = kwargs.pop('fold', False)
+        self.dce = kwargs.pop('dce', True)
+        # max. trip count of the loops replaced by copies of their body
+        unroll = kwargs.pop('unroll', False)
+        self.unroll = 16 if unroll is True else int(unroll)
+        # max. operations of the branches turned into conditional expressions
+        select = kwargs.pop('select', False)
+        self.select = 8 if select is True else int(select)
+        self.inline = kwargs.pop('inline', self.inline_modes[0])
+        if self.inline not in self.inline_modes:
+            raise ValueError("inline must be one of {}, got {!r}".format(
+                self.inline_modes, self.inline))
+        self.namespace = function_namespace(model.ode)
+        self.old_signature, self.signature, self.kwargs = self.process_signature()
+
+        self.tpl = Template(self.template)
 
+        CodeGenerator.__init__(self, model.ode.__code__, offset=4, **kwargs)
 
-        self.ode_src = StringIO()
-        self.define_src = StringIO()
-        self.declaration_src = StringIO()
+    def new_state(self):
+        state = CodeGenerator.new_state(self)
+        # inputs of `ode`, and the source of their default values
+        state.new_signature = [x.split('=')[0] for x in self.signature]
+        state.defaults = dict(x.split('=', 1)
+            for x in self.signature if '=' in x)
+        state.variables = []
+        state.access = None
+        # translated callees in the order they were completed, so callees
+        # precede their callers
+        state.functions = OrderedDict()
+        state.inlining = []
+        state.splices = 0
+        state.ode_src = state.ostream = StringIO()
+        state.define_src = StringIO()
+        state.declaration_src = StringIO()
+        return state
 
-        CodeGenerator.__init__(self, model.ode.func_code, newline=';\n',
-                offset=4, ostream=self.ode_src, **kwargs)
+    def cache_key(self):
+        return make_key(CodeGenerator.cache_key(self),
+            self.model.__class__.__name__,
+            self.model.states,
+            getattr(self.model, 'gstates', None),
+            getattr(self.model, 'inters', None),
+            self.params_mode,
+            sorted(self.fixed.items()),
+            self.runtime_params,
+            self.model.bounds,
+            self.cse,
+            self.fold,
+            self.dce,
+            self.unroll,
+            self.select,
+            self.float_type,
+            self.multi_step,
+            self.trace,
+            self.steps_per_launch,
+            self.layout,
+            self.methods,
+            self.inline,
+            [code_fingerprint(x) for x in
+                referenced_functions(self.model.ode, type(self.model))])
 
-        self.tpl = Template(cuda_src_template)
+    def create_printer(self):
+        return CudaPrinter(func_map=self.pyfunc_to_cufunc,
+            float_type=self.float_type)
+
+    def literal(self, val):
+        return self.printer.expr(Const(val))
 
     def generate_cuda(self):
+        self.cuda_src = self.generate_source()
+
+    def generate_source(self):
+        key = None
+        if self.cache is not None:
+            key = self.cache_key()
+            entry = self.cache.get(key)
+            if entry is not None:
+                return self.load_entry(entry)
+
+        src = self.render()
+
+        if key is not None:
+            self.cache.set(key, self.cache_entry(src))
+        return src
+
+    def cache_entry(self, src):
+        return json.dumps(dict(src=src, state=self.dump_state()))
+
+    def load_entry(self, entry):
+        entry = json.loads(entry)
+        self.load_state(entry['state'])
+        return entry['src']
+
+    def dump_state(self):
+        """
+        The run state found by translating that the methods describing the
+        generated source read, e.g. `kernel_arguments`, as a JSON-able dict.
+        """
+        state = dict((key, getattr(self, key)) for key in self.cached_attributes)
+        if self.access is not None:
+            state['access'] = [sorted(x) for x in self.access]
+        return state
+
+    def load_state(self, state):
+        """
+        Make a state saved by `dump_state` the last completed run, in place
+        of translating.
+        """
+        self.begin_run()
+        for key in self.cached_attributes:
+            setattr(self, key, state[key])
+        if self.access is not None:
+            self.access = tuple(set(x) for x in self.access)
+        self.end_run()
+
+    def render(self, **extra):
+        """
+        Render the template; `device_entry` names a device function taking
+        the thread index, to emit in place of the kernel.
+        """
         if not len(self.ode_src.getvalue()):
             self.generate()
-        self.cuda_src = self.tpl.render(
-            float_type="float",
-            bounds=self.model.bounds,
-            run_step='run_step',
+        context = self.template_context()
+        context.update(extra)
+        return self.tpl.render(**context)
+
+    def macros(self):
+        """
+        Names of the preprocessor macros defined by the generated source.
+        """
+        names = [key.upper() for key in self.fixed]
+        for key in self.model.bounds:
+            names.extend([key.upper() + '_MIN', key.upper() + '_MAX'])
+        return names
+
+    def kernel_arguments(self):
+        """
+        `(type, name)` of the kernel parameters, in order.
+        """
+        ptr = self.float_type + ' *'
+        # arrays the kernel never writes
+        const = 'const {} *{} '.format(self.float_type, self.dialect['restrict'])
+        stores = self.global_stores()
+        args = [('int ', 'num_thread'), (self.float_type + ' ', 'dt')]
+        if self.multi_step:
+            args.append(('int ', 'num_steps'))
+        if self.layout != 'soa':
+            args.append((ptr, 'g_data'))
+        else:
+            args.extend((ptr, 'g_' + key) for key in self.model.states)
+            args.extend((ptr if 'inters.' + key in stores else const,
+                'g_' + key) for key in getattr(self.model, 'inters', ()))
+            args.extend((const, 'g_' + key) for key in self.new_signature)
+            if self.params_mode == 'array':
+                args.extend((const, 'g_' + key) for key in self.runtime_params)
+        if self.trace:
+            args.extend((ptr, 'g_trace_' + key) for key in self.model.states)
+        return args
+
+    def fields(self):
+        """
+        Names of the per-thread values passed to the kernel, in order.
+        """
+        fields = list(self.model.states)
+        fields.extend(getattr(self.model, 'inters', None) or ())
+        fields.extend(self.new_signature)
+        if self.params_mode == 'array':
+            fields.extend(self.runtime_params)
+        return fields
+
+    def field(self, key):
+        """
+        C expression of the value of field `key` of thread `tid`.
+        """
+        if self.layout == 'soa':
+            return 'g_{}[tid]'.format(key)
+        index = self.fields().index(key)
+        if self.layout == 'packed':
+            return 'g_data[{} * num_thread + tid]'.format(index)
+        return 'g_data[tid * {} + {}]'.format(len(self.fields()), index)
+
+    def describe_layout(self, num_thread):
+        """
+        Host-side description of the kernel I/O for `num_thread` threads.
+
+        Returns a dict with the C `dtype` and its `itemsize` in bytes, the
+        `layout`, and per field the `offset` of its first element and the
+        `stride` between threads, both counted in elements. For 'packed' and
+        'aos', `size` is the number of elements of the single buffer.
+        """
+        fields = self.fields()
+        if self.layout == 'soa':
+            offsets = dict((key, 0) for key in fields)
+            strides = dict((key, 1) for key in fields)
+        elif self.layout == 'packed':
+            offsets = dict((key, i * num_thread) for i, key in enumerate(fields))
+            strides = dict((key, 1) for key in fields)
+        else:
+            offsets = dict((key, i) for i, key in enumerate(fields))
+            strides = dict((key, len(fields)) for key in fields)
+        return dict(
+            layout=self.layout,
+            dtype=self.float_type,
+            itemsize=4 if self.float_type == 'float' else 8,
+            fields=fields,
+            offsets=offsets,
+            strides=strides,
+            size=len(fields) * num_thread)
+
+    def field_views(self, data, num_thread):
+        """
+        Slices of the single buffer `data` (e.g. a numpy array) holding each
+        field, keyed by field name.
+        """
+        desc = self.describe_layout(num_thread)
+        views = {}
+        for key in desc['fields']:
+            start, step = desc['offsets'][key], desc['strides'][key]
+            views[key] = data[start:start + step * num_thread:step]
+        return views
+
+    def global_loads(self):
+        """
+        Dotted names of the fields the kernel reads from global memory: a
+        state or intermediate variable is loaded if `ode` may read it before
+        assigning it, or if `ode` does not assign it on every path.
+        """
+        fields = ['states.' + key for key in self.model.states]
+        fields.extend('inters.' + key
+            for key in getattr(self.model, 'inters', None) or ())
+        params = ['params.' + key for key in self.runtime_params]
+        if self.access is None:
+            return set(fields + params + self.new_signature)
+        exposed, written, defined = self.access
+        loads = set(x for x in fields if x in exposed or x not in defined)
+        loads.update(x for x in params if x in exposed)
+        loads.update(x for x in self.new_signature
+            if x in exposed or x in written)
+        return loads
+
+    def global_stores(self):
+        """
+        Dotted names of the fields the kernel writes back to global memory.
+        """
+        stores = set('states.' + key for key in self.model.states)
+        inters = ['inters.' + key
+            for key in getattr(self.model, 'inters', None) or ()]
+        if self.access is None:
+            return stores.union(inters)
+        return stores.union(x for x in inters if x in self.access[1])
+
+    def template_context(self):
+        return dict(
+            dialect=self.dialect,
+            kernel_args=self.kernel_arguments(),
+            float_type=self.float_type,
+            fmin=self.pyfunc_to_cufunc('np.fmin'),
+            fmax=self.pyfunc_to_cufunc('np.fmax'),
+            bounds=dict((key, [self.literal(x) for x in val])
+                for key, val in self.model.bounds.items()),
+            multi_step=self.multi_step,
+            integrator=self.integrator,
+            methods=self.methods,
+            exp_euler='exp_euler' in self.methods.values(),
+            expm1=self.pyfunc_to_cufunc('np.expm1'),
+            literal=self.literal,
+            trace=self.trace,
             inters=getattr(self.model, 'inters', None),
             states=self.model.states,
-            ode_signature = self.new_signature,
+            field=self.field,
+            loads=self.global_loads(),
+            stores=self.global_stores(),
+            ode_signature=[x for x in self.new_signature
+                if x in self.global_loads()],
             ode_declaration = self.variables,
+            functions=[x for x in self.functions.values() if x['device']],
             src = self.ode_src.getvalue(),
             model_name=self.model.__class__.__name__,
-            preprocessing=self.model.params)
+            device_entry=None,
+            params_mode=self.params_mode,
+            params=self.runtime_params,
+            preprocessing=dict((key, self.literal(val))
+                for key, val in self.fixed.items()))
+
+    def process_fixed(self, fixed):
+        """
+        Params compiled into the source, with their values. All of them
+        unless params are passed at runtime; `fixed` names a subset, or maps
+        it to the values to specialize on.
+        """
+        params = self.model.params
+        if self.params_mode == 'define':
+            fixed = dict(params, **(fixed if isinstance(fixed, dict) else {}))
+        elif isinstance(fixed, dict):
+            fixed = dict(fixed)
+        else:
+            fixed = dict((key, params.get(key)) for key in fixed or ())
+        unknown = set(fixed) - set(params)
+        if unknown:
+            raise ValueError("fixed params are not in the model: {}".format(
+                ', '.join(sorted(unknown))))
+        return fixed
 
     def process_signature(self):
         old_signature = get_func_signature(self.model.ode)
@@ -186,124 +795,303 @@ class CudaGenerator(CodeGenerator):
 
     def generate_declaration(self):
         for key in self.variables:
-            self.declaration_src.write( "    float %s;\n" % str(key) )
+            self.declaration_src.write( "    %s %s;\n" % (self.float_type, str(key)) )
 
     def generate_preprocessing(self):
-        for key, val in self.model.params.items():
+        for key, val in self.fixed.items():
             self.define_src.write( "#define %s\t\t%s\n" % (str(key), str(val)) )
 
     def generate(self):
+        self.begin_run()
         self.generate_preprocessing()
-        super(CudaGenerator, self).generate()
-        # remove defaults from signature
-        self.new_signature = [x.split('=')[0] for x in self.new_signature]
+        self.translate()
         self.generate_declaration()
+        self.end_run()
+
+    def optimize(self, statements):
+        constants = dict((key.upper(), val) for key, val in self.fixed.items())
+        if self.unroll:
+            statements, unrolled = unroll_loops(statements, self.unroll,
+                constants)
+            self.reports['unroll'] = dict(
+                model=self.model.__class__.__name__,
+                unrolled=unrolled)
+        if self.fold:
+            statements, folded, reduced = fold_constants(statements, constants)
+            self.reports['fold'] = dict(
+                model=self.model.__class__.__name__,
+                folded=folded,
+                reduced=reduced)
+        exp_euler = [key for key, val in self.methods.items()
+            if val == 'exp_euler']
+        if exp_euler:
+            statements = add_exponential_coefficients(statements, exp_euler)
+        if self.dce:
+            statements, removed = eliminate_dead_stores(statements,
+                self.variables + self.new_signature)
+            used = set()
+            for _, stmt in statements:
+                used.update(x for x in walk(stmt) if isinstance(x, Name))
+            unused = [x for x in self.variables if Name(x) not in used]
+            self.variables = [x for x in self.variables if x not in unused]
+            self.reports['dce'] = dict(
+                model=self.model.__class__.__name__,
+                removed=[self.printer.statement(stmt) for _, stmt in removed],
+                variables=unused)
+        if self.select:
+            statements, converted = if_convert(statements, self.select)
+            self.reports['select'] = dict(
+                model=self.model.__class__.__name__,
+                converted=converted)
+        if self.cse:
+            statements, temps, removed = eliminate_common_subexpressions(
+                statements, reserved=self.variables + self.new_signature)
+            self.variables.extend(name for name, _ in temps)
+            self.reports['cse'] = dict(
+                model=self.model.__class__.__name__,
+                ops_removed=removed,
+                temporaries=[(name, self.printer.expr(expr))
+                    for name, expr in temps])
+
+        self.access = field_access(statements)
+        self.reports['access'] = self.access_report()
+
+        self.reports['types'] = dict(
+            model=self.model.__class__.__name__,
+            float_type=self.float_type,
+            promotions=[msg for x in self.functions.values()
+                for msg in x['promotions']] + infer_types(statements,
+                self.float_type, functions=MATH_FUNCTION_NAMES.union(x['name']
+                    for x in self.functions.values() if x['device']),
+                printer=self.printer))
+
+        self.reports['metrics'] = self.metrics_report(statements)
+        return statements
+
+    def metrics_report(self, statements):
+        """
+        Static cost of a step of one thread: the operations of `ode` times
+        its evaluations per step, the locals it declares as a proxy of
+        register pressure, and the global memory traffic of the kernel.
+        A multi-step kernel loads and stores once per launch, so its
+        traffic is divided by `steps_per_launch`.
+        """
+        functions = {}
+        for helper in self.functions.values():
+            if helper['device']:
+                functions[helper['name']] = count_operations(
+                    helper['statements'], self.pyfunc_to_cufunc, functions)
+        counts = count_operations(statements, self.pyfunc_to_cufunc,
+            functions)
+        itemsize = 4 if self.float_type == 'float' else 8
+        loads = len([x for x in self.global_loads()
+            if self.params_mode == 'array' or not x.startswith('params.')])
+        stores = len(self.global_stores())
+        steps = self.steps_per_launch if self.multi_step else 1
+        loads, stores = loads / float(steps), stores / float(steps)
+        if self.trace:
+            # the states are recorded every `trace` steps
+            stores += len(self.model.states) / float(self.trace)
+        evaluations = EVALUATIONS[self.integrator]
+        flops = evaluations * arithmetic_operations(counts)
+        traffic = itemsize * (loads + stores)
+        return dict(counts,
+            model=self.model.__class__.__name__,
+            temporaries=len(self.variables),
+            evaluations=evaluations,
+            flops=flops,
+            steps_per_launch=steps,
+            bytes_loaded=itemsize * loads,
+            bytes_stored=itemsize * stores,
+            arithmetic_intensity=float(flops) / traffic if traffic else None)
 
-    def _post_output(self):
-        self.newline = ';\n'
-        CodeGenerator._post_output(self)
+    def access_report(self):
+        """
+        Classify the fields by how `ode` accesses them; `forward` reads and
+        writes every state in addition.
+        """
+        exposed, written, _ = self.access
+        fields = ['states.' + key for key in self.model.states]
+        fields.extend('inters.' + key
+            for key in getattr(self.model, 'inters', None) or ())
+        fields.extend(self.new_signature)
+        fields.extend('params.' + key for key in self.runtime_params)
+        report = dict(model=self.model.__class__.__name__, read_only=[],
+            write_only=[], read_write=[], unused=[])
+        for name in fields:
+            key = {(True, False): 'read_only', (False, True): 'write_only',
+                (True, True): 'read_write', (False, False): 'unused'}[
+                (name in exposed, name in written)]
+            report[key].append(name)
+        return report
 
     def handle_load_attr(self, ins):
-        key = ins.arg_name
-        if self.var[-1] == 'self':
+        key = ins.argval
+        if self.var[-1] == Name('self'):
             if key in self.model.states:
-                self.var[-1] = "states." + key.lower()
-            elif key in self.model.gstates:
-                self.var[-1] = "gstates." + key.lower()
+                self.var[-1] = Attr(Name('states'), key)
+            elif key[:2] == 'd_' and key[2:] in self.model.states:
+                self.var[-1] = Attr(Name('gstates'), key[2:])
+            elif key in getattr(self.model, 'gstates', ()):
+                self.var[-1] = Attr(Name('gstates'), key)
+            elif key in self.fixed:
+                self.var[-1] = Name(key.upper())
             elif key in self.model.params:
-                self.var[-1] = key.upper()
+                self.var[-1] = Attr(Name('params'), key)
             elif hasattr(self.model, 'inters') and key in self.model.inters:
-                self.var[-1] = "inters." + key.lower()
+                self.var[-1] = Attr(Name('inters'), key)
+            else:
+                self.var[-1] = Attr(self.var[-1], key)
         else:
-            self.var[-1] += ".%s" % key
-
-    def process_jump(self, ins):
-        if ins.jump == ">>":
-            if len(self.jump_targets) and self.jump_targets[0] == ins.addr:
-                if len(self.var):
-                    self.output_statement()
-                self.jump_targets.pop()
-                self.space -= self.indent
-                self.leave_indent = False
-
-                self.var.append('}')
-                self.newline = '\n'
-                self.output_statement()
+            self.var[-1] = Attr(self.var[-1], key)
 
     def handle_store_fast(self, ins):
-        if ins.arg_name == self.var[-1]:
+        if Name(ins.argval) == self.var[-1]:
             del self.var[-1]
             return
-        if ins.arg_name not in self.variables:
-            self.variables.append(ins.arg_name)
-        self.var[-1] = ins.arg_name + ' = ' + self.var[-1]
-
-    def handle_binary_power(self, ins):
-        self.var[-2] = "powf(%s, %s)" % (self.var[-2], self.var[-1])
-        del self.var[-1]
+        if ins.argval not in self.variables:
+            self.variables.append(ins.argval)
+        self.var[-1] = Assign(Name(ins.argval), self.var[-1])
 
     def handle_call_function(self, ins):
         narg = int(ins.arg)
 
         # hacky way to handle keyword arguments
-        if self.kwargs and self.var[-(narg+1)] == (self.kwargs + ".pop"):
-            arg = self.var[-narg][1:-1]
-            self.var[-(narg+1)] = arg
-            new_arg = "%s=%s" % (arg, self.var[-narg+1])
-            self.new_signature.append(new_arg)
+        if self.kwargs and self.var[-(narg+1)] == Attr(Name(self.kwargs), 'pop'):
+            arg = self.var[-narg].value
+            self.var[-(narg+1)] = Name(arg)
+            if narg > 1:
+                self.defaults[arg] = self.printer.expr(self.var[-narg+1])
+            self.new_signature.append(arg)
+            del self.var[-narg:]
         else:
+            CodeGenerator.handle_call_function(self, ins)
+            self.var[-1] = self.inline_call(self.var[-1])
 
-            func = self.var[-(narg+1)]
-            func = self.pyfunc_to_cufunc(func)
-            tmp = "(%s)" % (', '.join(['%s']*narg))
-            tmp = tmp % tuple(self.var[-narg:])
+    def inline_call(self, call):
+        """
+        Translate a call to a Python function of the model's module or to
+        a method of the model; other calls are returned unchanged.
+        """
+        func, is_method = resolve_function(call.func, self.namespace,
+            type(self.model))
+        if func is None:
+            return call
+        bound = arguments(func, call.args, is_method)
+        helper = self.translate_function(func, is_method)
+        if helper['device']:
+            return Call(Name(helper['name']), [arg for _, arg in bound])
 
-            self.var[-(narg+1)] = func + tmp
+        prefix = '_{}{}_'.format(func.__name__, self.splices)
+        self.splices += 1
+        statements, names, result = splice(helper['statements'], bound,
+            helper['variables'], prefix)
+        # statements already complete on this line run first
+        pending = 0
+        while pending < len(self.var) - 1 and \
+                isinstance(self.var[pending], Stmt):
+            pending += 1
+        self.statements.extend((self.space, x) for x in self.var[:pending])
+        del self.var[:pending]
+        self.statements.extend((self.space + space, stmt)
+            for space, stmt in statements)
+        self.hoisted += len(statements)
+        self.variables.extend(x for x in names if x not in self.variables)
+        return Name(result) if result is not None else Const(None)
 
-        del self.var[-narg:]
+    def translate_function(self, func, is_method=False):
+        """
+        Translate a called function once per generator.
 
-    def handle_pop_jump_if_true(self, ins):
-        self.jump_targets.append(ins.arg)
-        self.enter_indent = True
-        self.var[-1] = 'if (!%s) {' % self.var[-1]
-        self.newline = '\n'
+        A function that only computes a value from its arguments becomes a
+        function of the generated source with `inline='device'`; any other
+        is spliced into its callers.
+        """
+        if func in self.functions:
+            return self.functions[func]
+        if func in self.inlining:
+            chain = self.inlining[self.inlining.index(func):] + [func]
+            raise NotImplementedError("recursive call {} cannot be "
+                "inlined".format(' -> '.join(x.__name__ for x in chain)))
 
-    def handle_pop_jump_if_false(self, ins):
-        self.jump_targets.append(ins.arg)
-        self.enter_indent = True
-        self.var[-1] = 'if (%s) {' % self.var[-1]
-        self.newline = '\n'
+        self.inlining.append(func)
+        variables = self.variables
+        self.variables = []
+        try:
+            statements = self.translate_body(
+                self.get_instructions(func.__code__))
+            local_names = self.variables
+        finally:
+            self.variables = variables
+            self.inlining.pop()
 
-    def handle_jump_forward(self, ins):
-        self.leave_indent = True
-        self.output_statement()
+        code = func.__code__
+        params = list(code.co_varnames[:code.co_argcount])[int(is_method):]
+        returns = [stmt for _, stmt in statements if isinstance(stmt, Return)]
+        reads = set(node.id for _, stmt in statements for node in walk(stmt)
+            if isinstance(node, Name))
+        device = self.inline == 'device' and not reads & MODEL_NAMES and \
+            bool(returns) and Const(None) not in [x.value for x in returns]
 
-        target = int(ins.arg_name.split(' ')[-1])
-        old_target = self.jump_targets.pop()
+        name = func.__name__
+        taken = set(x['name'] for x in self.functions.values())
+        suffix = 1
+        while name in taken:
+            name = '{}_{}'.format(func.__name__, suffix)
+            suffix += 1
+        local_names = [x for x in local_names if x not in params]
+        promotions = []
+        if device:
+            statements, local_names, promotions = self.optimize_function(
+                statements, params, local_names)
+        helper = dict(name=name, params=params, statements=statements,
+            variables=local_names, device=device, promotions=promotions)
+        if device:
+            helper['src'] = ''.join('{}{}{}'.format(
+                ' ' * (self.offset + space), self.printer.statement(stmt),
+                self.newline) for space, stmt in statements)
+        self.functions[func] = helper
+        return helper
 
-        if target != old_target:
-            self.newline = '\n'
-            self.var.append("} else {")
-            self.enter_indent = True
-            self.jump_targets.append(target)
-        else:
-            self.var.append('}')
-            self.newline = '\n'
-            self.output_statement()
+    def optimize_function(self, statements, params, variables):
+        """
+        Run the passes of `optimize` that apply to the body of a device
+        function with parameters `params` and locals `variables`.
 
-    def handle_return_value(self, ins):
-        val = self.var[-1]
-        if val == 'None':
-            val = '0'
-        self.var[-1] = "return %s" % val
+        Returns the rewritten statements, the locals still used and the
+        implicit promotions found by type inference.
+        """
+        constants = dict((key.upper(), val) for key, val in self.fixed.items())
+        if self.unroll:
+            statements, _ = unroll_loops(statements, self.unroll, constants)
+        if self.fold:
+            statements, _, _ = fold_constants(statements, constants)
+        if self.dce:
+            statements, _ = eliminate_dead_stores(statements, variables)
+            used = set()
+            for _, stmt in statements:
+                used.update(x for x in walk(stmt) if isinstance(x, Name))
+            variables = [x for x in variables if Name(x) in used]
+        if self.select:
+            statements, _ = if_convert(statements, self.select)
+        if self.cse:
+            statements, temps, _ = eliminate_common_subexpressions(
+                statements, reserved=variables + params)
+            variables = variables + [name for name, _ in temps]
+        promotions = infer_types(statements, self.float_type,
+            functions=MATH_FUNCTION_NAMES.union(x['name']
+                for x in self.functions.values() if x['device']),
+            printer=self.printer)
+        return statements, variables, promotions
 
     def pyfunc_to_cufunc(self, func):
         seg = func.split('.')
-        if seg[0] == 'np' or seg[0] == 'numpy':
-            if seg[1] == 'exp':
-                return 'expf'
-            elif seg[1] == 'power':
-                return 'powf'
-            elif seg[1] == 'cbrt':
-                return 'cbrtf'
-        return func
+        if len(seg) == 2 and seg[0] in ('np', 'numpy', 'math'):
+            name = seg[1]
+        elif len(seg) == 1 and seg[0] in BUILTIN_FUNCTIONS:
+            name = BUILTIN_FUNCTIONS[seg[0]]
+        else:
+            return func
+        if name not in MATH_FUNCTIONS:
+            return func
+        return MATH_FUNCTIONS[name][FLOAT_TYPES.index(self.float_type)]
@@ -0,0 +1,148 @@
+"""
+Dataflow analyses over translated statements.
+"""
+from .expr import (reads, ref_name, Name, Subscript, UnaryOp, Assign,
+    Return, If, For, Else, EndBlock)
+from .optimize import expressions, is_pure, block_end
+
+
+def field_access(statements):
+    """
+    Find how the statements of a function access each dotted name.
+
+    Returns
+    -------
+    exposed : set
+        Names read before they are assigned on some path, i.e. whose value
+        on entry is used.
+    written : set
+        Names assigned on some path.
+    defined : set
+        Names assigned on every path.
+    """
+    exposed = set()
+    written = set()
+    defined = set()
+    # one frame per open `if` or `for`: (defined before, defined at the end
+    # of the `if` branch or None)
+    frames = []
+    for pos, (_, stmt) in enumerate(statements):
+        if isinstance(stmt, Else):
+            before, _ = frames[-1]
+            frames[-1] = (before, defined)
+            defined = set(before)
+            continue
+        if isinstance(stmt, EndBlock):
+            before, branch = frames.pop()
+            defined = before if branch is None else branch & defined
+            continue
+
+        for expr in expressions(stmt):
+            exposed.update(reads(expr) - defined)
+        if isinstance(stmt, Assign):
+            name = ref_name(stmt.target)
+            if isinstance(stmt.target, Subscript):
+                # partial update of an array
+                exposed.update(reads(stmt.target) - defined)
+                written.add(name)
+            elif name is not None:
+                written.add(name)
+                defined = defined | set([name])
+        if isinstance(stmt, For):
+            # the body may run zero times, and an iteration may read what
+            # the previous one assigned
+            for _, inner in statements[pos + 1:block_end(statements, pos)]:
+                for expr in expressions(inner):
+                    exposed.update(reads(expr) - defined)
+        if isinstance(stmt, (If, For)):
+            frames.append((set(defined), None))
+    return exposed, written, defined
+
+
+def _prune_blocks(statements):
+    """
+    Drop the markers left around branches and loops that became empty.
+    """
+    changed = True
+    while changed:
+        changed = False
+        for pos in range(len(statements) - 1):
+            (space, stmt), (_, after) = statements[pos], statements[pos + 1]
+            if isinstance(stmt, (If, For)) and isinstance(after, EndBlock) \
+                    and all(is_pure(x) for x in expressions(stmt)):
+                del statements[pos:pos + 2]
+            elif isinstance(stmt, Else) and isinstance(after, EndBlock):
+                del statements[pos]
+            elif isinstance(stmt, If) and isinstance(after, Else):
+                statements[pos] = (space, If(UnaryOp('not', stmt.test)))
+                del statements[pos + 1]
+            else:
+                continue
+            changed = True
+            break
+    return statements
+
+
+def eliminate_dead_stores(statements, names):
+    """
+    Remove assignments to the local variables `names` whose value is never
+    read afterwards, on any path.
+
+    Stores to other names (model fields) are always kept, as are
+    assignments of values that may have side effects.
+
+    Returns the rewritten statements and the removed statements.
+    """
+    names = set(names)
+    live = set()
+    # one frame per block being walked backwards: (live after the block,
+    # live at the start of the `else` branch or None)
+    frames = []
+    # start of the loop closed at each position
+    loops = {}
+    opened = []
+    for pos, (_, stmt) in enumerate(statements):
+        if isinstance(stmt, EndBlock):
+            start = opened.pop()
+            if isinstance(statements[start][1], For):
+                loops[pos] = start
+        elif stmt.block and not isinstance(stmt, Else):
+            opened.append(pos)
+    out = []
+    removed = []
+    for pos in reversed(range(len(statements))):
+        space, stmt = statements[pos]
+        if isinstance(stmt, EndBlock):
+            frames.append((live, None))
+            if pos in loops:
+                # anything the body reads may come from an earlier iteration
+                for _, inner in statements[loops[pos] + 1:pos]:
+                    for expr in expressions(inner):
+                        live = live | (reads(expr) & names)
+        elif isinstance(stmt, Else):
+            after, _ = frames[-1]
+            frames[-1] = (after, live)
+            live = after
+        elif isinstance(stmt, (If, For)):
+            after, orelse = frames.pop()
+            live = live | (after if orelse is None else orelse)
+            for expr in expressions(stmt):
+                live = live | (reads(expr) & names)
+        elif isinstance(stmt, Return):
+            # nothing after a return runs
+            live = reads(stmt.value) & names
+        elif isinstance(stmt, Assign) and isinstance(stmt.target, Name) and \
+                stmt.target.id in names:
+            if stmt.target.id not in live and is_pure(stmt.value):
+                removed.append((space, stmt))
+                continue
+            live = (live - set([stmt.target.id])) | (reads(stmt.value) & names)
+        else:
+            for expr in expressions(stmt):
+                live = live | (reads(expr) & names)
+            if isinstance(stmt, Assign):
+                live = live | (reads(stmt.target) & names)
+        out.append((space, stmt))
+    out.reverse()
+    removed.reverse()
+    return _prune_blocks(out), removed
@@ -0,0 +1,296 @@
+"""
+Expression tree used by the generators in place of source strings.
+
+Handlers push nodes onto the `var` stack of a generator; the nodes are
+rendered to text by a printer only once, when a statement is written out.
+"""
+
+class Node(object):
+    __slots__ = ()
+    visit = None
+    block = False
+
+    def __init__(self, *args):
+        for name, val in zip(self.__slots__, args):
+            setattr(self, name, val)
+
+    def _key(self):
+        return (type(self),) + tuple(getattr(self, x) for x in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,
+            ', '.join(repr(getattr(self, x)) for x in self.__slots__))
+
+    def children(self):
+        for name in self.__slots__:
+            val = getattr(self, name)
+            if isinstance(val, Node):
+                yield val
+            elif isinstance(val, (list, tuple)):
+                for x in val:
+                    if isinstance(x, Node):
+                        yield x
+
+
+def walk(node):
+    """
+    Iterate over `node` and all of its descendants, parents first.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(list(node.children())))
+
+
+def replace(node, func):
+    """
+    Rebuild `node` top-down, substituting every subtree for which `func`
+    returns a node other than None.
+    """
+    new = func(node)
+    if new is not None:
+        return new
+    if not isinstance(node, Node) or not node.__slots__:
+        return node
+    args = []
+    for name in node.__slots__:
+        val = getattr(node, name)
+        if isinstance(val, Node):
+            val = replace(val, func)
+        elif isinstance(val, list):
+            val = [replace(x, func) for x in val]
+        args.append(val)
+    return type(node)(*args)
+
+
+def ref_name(node):
+    """
+    Dotted name referred to by a Name/Attr chain, e.g. 'states.v'; the base
+    name for a subscript, and None for anything else.
+    """
+    if isinstance(node, Name):
+        return node.id
+    if isinstance(node, Attr):
+        base = ref_name(node.value)
+        return None if base is None else base + '.' + node.attr
+    if isinstance(node, Subscript):
+        return ref_name(node.value)
+    return None
+
+
+def reads(node):
+    """
+    Set of dotted names read by an expression.
+    """
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (Name, Attr)):
+            name = ref_name(node)
+            if name is not None:
+                names.add(name)
+                continue
+        elif isinstance(node, Call):
+            # the callee is not a value read
+            stack.extend(node.args)
+            continue
+        stack.extend(node.children())
+    return names
+
+
+# Expressions
+class Expr(Node):
+    __slots__ = ()
+
+class Name(Expr):
+    __slots__ = ('id',)
+    visit = 'write_name'
+
+class Const(Expr):
+    __slots__ = ('value',)
+    visit = 'write_const'
+
+    def _key(self):
+        # keep 1, 1.0 and True apart
+        return (Const, type(self.value), self.value)
+
+class Attr(Expr):
+    __slots__ = ('value', 'attr')
+    visit = 'write_attr'
+
+class Subscript(Expr):
+    __slots__ = ('value', 'index')
+    visit = 'write_subscript'
+
+class BinOp(Expr):
+    __slots__ = ('op', 'left', 'right')
+    visit = 'write_binop'
+
+class UnaryOp(Expr):
+    __slots__ = ('op', 'operand')
+    visit = 'write_unaryop'
+
+class Call(Expr):
+    __slots__ = ('func', 'args')
+    visit = 'write_call'
+
+    def _key(self):
+        return (Call, self.func, tuple(self.args))
+
+class Select(Expr):
+    """
+    `body` if `test` holds, else `orelse`.
+    """
+    __slots__ = ('test', 'body', 'orelse')
+    visit = 'write_select'
+
+
+# Statements
+class Stmt(Node):
+    __slots__ = ()
+
+class Assign(Stmt):
+    __slots__ = ('target', 'value')
+    visit = 'write_assign'
+
+class Return(Stmt):
+    __slots__ = ('value',)
+    visit = 'write_return'
+
+class If(Stmt):
+    __slots__ = ('test',)
+    visit = 'write_if'
+    block = True
+
+class For(Stmt):
+    """
+    `for target in range(start, stop, step)`.
+    """
+    __slots__ = ('target', 'start', 'stop', 'step')
+    visit = 'write_for'
+    block = True
+
+class Else(Stmt):
+    __slots__ = ()
+    visit = 'write_else'
+    block = True
+
+class EndBlock(Stmt):
+    __slots__ = ()
+    visit = 'write_endblock'
+    block = True
+
+
+class PythonPrinter(object):
+    """
+    Render nodes as Python source.
+    """
+    unary_ops = {'not': 'not '}
+    binary_ops = {}
+
+    def expr(self, node):
+        out = []
+        self.write(node, out)
+        return ''.join(out)
+
+    def statement(self, node):
+        return self.expr(node)
+
+    def write(self, node, out):
+        if isinstance(node, Node):
+            getattr(self, node.visit)(node, out)
+        else:
+            out.append(str(node))
+
+    def write_name(self, node, out):
+        out.append(node.id)
+
+    def write_const(self, node, out):
+        if isinstance(node.value, (str, type(u''))):
+            out.append(repr(node.value))
+        else:
+            out.append(str(node.value))
+
+    def write_attr(self, node, out):
+        self.write(node.value, out)
+        out.append('.')
+        out.append(node.attr)
+
+    def write_subscript(self, node, out):
+        self.write(node.value, out)
+        out.append('[')
+        self.write(node.index, out)
+        out.append(']')
+
+    def write_binop(self, node, out):
+        out.append('(')
+        self.write(node.left, out)
+        out.append(' {} '.format(self.binary_ops.get(node.op, node.op)))
+        self.write(node.right, out)
+        out.append(')')
+
+    def write_unaryop(self, node, out):
+        out.append('(')
+        out.append(self.unary_ops.get(node.op, node.op))
+        self.write(node.operand, out)
+        out.append(')')
+
+    def write_call(self, node, out):
+        self.write(node.func, out)
+        out.append('(')
+        for i, arg in enumerate(node.args):
+            if i:
+                out.append(', ')
+            self.write(arg, out)
+        out.append(')')
+
+    def write_select(self, node, out):
+        out.append('(')
+        self.write(node.body, out)
+        out.append(' if ')
+        self.write(node.test, out)
+        out.append(' else ')
+        self.write(node.orelse, out)
+        out.append(')')
+
+    def write_assign(self, node, out):
+        self.write(node.target, out)
+        out.append(' = ')
+        self.write(node.value, out)
+
+    def write_return(self, node, out):
+        out.append('return ')
+        self.write(node.value, out)
+
+    def write_if(self, node, out):
+        out.append('if ')
+        self.write(node.test, out)
+        out.append(':')
+
+    def write_for(self, node, out):
+        out.append('for ')
+        self.write(node.target, out)
+        out.append(' in range(')
+        self.write(node.start, out)
+        out.append(', ')
+        self.write(node.stop, out)
+        out.append(', ')
+        self.write(node.step, out)
+        out.append('):')
+
+    def write_else(self, node, out):
+        out.append('else:')
+
+    def write_endblock(self, node, out):
+        pass
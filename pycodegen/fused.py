@@ -0,0 +1,156 @@
+"""
+One CUDA kernel advancing several populations of different models.
+
+The device code of every model is emitted in a namespace of its own, so
+the `States`, `ode`, ... of different models do not collide; the kernel
+assigns each population a contiguous range of thread indices and calls
+the `run` function of its model.
+"""
+import json
+
+from jinja2 import Template
+
+from .cache import make_key
+from .cuda import CudaGenerator
+
+DISPATCH = ('range', 'warp')
+
+fused_src_template = """
+{%- for pop in populations %}
+namespace {{ pop.namespace }} {
+{{ pop.src }}
+} // namespace {{ pop.namespace }}
+{%- for macro in pop.macros %}
+#undef {{ macro }}
+{%- endfor %}
+{% endfor %}
+__global__ void {{ name }} (
+    {%- for type, name in kernel_args %}
+    {{ type }}{{ name }}{{ ',' if not loop.last }}
+    {%- endfor %}
+)
+{
+    int tid = blockIdx.x * blockDim.x + threadIdx.x;
+    {%- for pop in populations %}
+    {{ 'if' if loop.first else 'else if' }} (tid >= {{ pop.start }} && tid < {{ pop.start + pop.count }})
+        {{ pop.namespace }}::run(tid - {{ pop.start }}, {{ pop.count }}, {{ pop.args|join(', ') }});
+    {%- endfor %}
+}
+"""
+
+
+class FusedGenerator(object):
+    """
+    Generate a kernel for a list of `(model, count)` populations.
+
+    An entry may carry a third item, a dict of options for the generator of
+    that population only; other keyword arguments apply to every population.
+
+    Parameters
+    ----------
+    name : str
+        Name of the kernel.
+    dispatch : str
+        'range' packs the populations back to back; 'warp' starts each one
+        at a multiple of `warp_size`, so that no warp executes two models.
+    generator : class
+        Generator of the populations, CudaGenerator by default.
+
+    The kernel takes `dt` (and `num_steps` with `multi_step=True`)
+    followed by the arrays of every population, prefixed by its namespace,
+    and must be launched with at least `num_thread` threads.
+    """
+    def __init__(self, populations, **kwargs):
+        self.name = kwargs.pop('name', 'fused')
+        self.dispatch = kwargs.pop('dispatch', 'warp')
+        if self.dispatch not in DISPATCH:
+            raise ValueError("dispatch must be one of {}, got {!r}".format(
+                DISPATCH, self.dispatch))
+        self.warp_size = kwargs.pop('warp_size', 32)
+        self.cache = kwargs.get('cache')
+        generator = kwargs.pop('generator', CudaGenerator)
+        if generator.dialect['name'] != 'cuda':
+            raise ValueError("fused kernels require the CUDA dialect")
+
+        self.populations = []
+        start = 0
+        used = set()
+        for entry in populations:
+            model, count = entry[0], entry[1]
+            options = dict(kwargs, **(entry[2] if len(entry) > 2 else {}))
+            namespace = model.__class__.__name__
+            suffix = 1
+            while namespace in used:
+                namespace = '{}_{}'.format(model.__class__.__name__, suffix)
+                suffix += 1
+            used.add(namespace)
+            if self.dispatch == 'warp':
+                start = -(-start // self.warp_size) * self.warp_size
+            self.populations.append(dict(namespace=namespace,
+                generator=generator(model, **options), start=start,
+                count=count))
+            start += count
+        self.num_thread = start
+
+        gens = [x['generator'] for x in self.populations]
+        for attr in ('float_type', 'multi_step'):
+            if len(set(getattr(x, attr) for x in gens)) > 1:
+                raise ValueError("populations must share '{}'".format(attr))
+        self.float_type = gens[0].float_type if gens else 'float'
+        self.multi_step = gens[0].multi_step if gens else False
+        self.tpl = Template(fused_src_template)
+
+    def cache_key(self):
+        return make_key(type(self).__name__, self.name, self.dispatch,
+            self.warp_size, [(x['namespace'], x['start'], x['count'],
+                x['generator'].cache_key()) for x in self.populations])
+
+    def population_arguments(self, pop):
+        """
+        `(type, name)` of the kernel parameters of population `pop`.
+        """
+        args = pop['generator'].kernel_arguments()
+        skip = 3 if self.multi_step else 2
+        return [(type_, '{}_{}'.format(pop['namespace'], name))
+            for type_, name in args[skip:]]
+
+    def kernel_arguments(self):
+        args = [(self.float_type + ' ', 'dt')]
+        if self.multi_step:
+            args.append(('int ', 'num_steps'))
+        for pop in self.populations:
+            args.extend(self.population_arguments(pop))
+        return args
+
+    def generate_cuda(self):
+        key = None
+        if self.cache is not None:
+            key = self.cache_key()
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry = json.loads(entry)
+                for pop, state in zip(self.populations, entry['states']):
+                    pop['generator'].load_state(state)
+                self.cuda_src = entry['src']
+                return
+
+        populations = []
+        for pop in self.populations:
+            gen = pop['generator']
+            # translating may add inputs, e.g. from `kwargs.pop`
+            src = gen.render(device_entry='run').strip('\n')
+            args = ['dt'] + (['num_steps'] if self.multi_step else [])
+            args.extend(name for _, name in self.population_arguments(pop))
+            populations.append(dict(pop,
+                src=src,
+                macros=gen.macros(),
+                args=args))
+        self.cuda_src = self.tpl.render(
+            name=self.name,
+            populations=populations,
+            kernel_args=self.kernel_arguments())
+
+        if key is not None:
+            self.cache.set(key, json.dumps(dict(src=self.cuda_src,
+                states=[x['generator'].dump_state()
+                    for x in self.populations])))
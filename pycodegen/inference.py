@@ -0,0 +1,141 @@
+"""
+Type inference over translated statements.
+
+Types are the C scalar types 'bool', 'int', 'float' and 'double', ordered
+by the usual arithmetic conversions. The pass is used by the C-like
+backends to find expressions that are silently promoted to double
+precision when the kernel is meant to run in single precision.
+"""
+import warnings
+
+from .expr import (ref_name, Name, Const, Attr, Subscript, BinOp,
+    UnaryOp, Call, Select, Assign, Return, If, For)
+
+RANK = {'bool': 0, 'int': 1, 'float': 2, 'double': 3}
+
+COMPARISONS = frozenset(['<', '<=', '>', '>=', '==', '!=', 'is', 'is not',
+    'in', 'not in'])
+
+
+class PrecisionWarning(RuntimeWarning):
+    pass
+
+
+def promote(*types):
+    return max(types, key=lambda x: RANK.get(x, RANK['double']))
+
+
+class TypeInference(object):
+    """
+    Infer the type of every expression of a translated function.
+
+    Parameters
+    ----------
+    float_type : str
+        'float' or 'double'; the type of floating-point literals, of model
+        variables and of the results of known math functions.
+    env : dict
+        Types of names known up front, keyed by dotted name.
+    functions : container
+        Dotted names of functions that return `float_type`.
+    """
+    def __init__(self, float_type='float', env=None, functions=()):
+        self.float_type = float_type
+        self.env = dict(env or {})
+        self.functions = functions
+        self.promotions = []
+
+    def default(self, name):
+        return self.float_type
+
+    def type_of(self, node):
+        if isinstance(node, Const):
+            val = node.value
+            if isinstance(val, bool) or val is None:
+                return 'bool' if val is not None else 'int'
+            if isinstance(val, float):
+                return self.float_type
+            return 'int'
+        if isinstance(node, (Name, Attr)) and ref_name(node) is not None:
+            name = ref_name(node)
+            return self.env.get(name) or self.default(name)
+        if isinstance(node, Subscript):
+            return self.type_of(node.value)
+        if isinstance(node, UnaryOp):
+            operand = self.type_of(node.operand)
+            return 'bool' if node.op == 'not' else operand
+        if isinstance(node, BinOp):
+            left, right = self.type_of(node.left), self.type_of(node.right)
+            if node.op in COMPARISONS:
+                self.check(node, left, right)
+                return 'bool'
+            if node.op in ('and', 'or'):
+                return 'bool'
+            if node.op in ('<<', '>>', '&', '|', '^'):
+                return 'int'
+            self.check(node, left, right)
+            return promote(left, right, 'int')
+        if isinstance(node, Select):
+            self.type_of(node.test)
+            return promote(self.type_of(node.body), self.type_of(node.orelse))
+        if isinstance(node, Call):
+            for arg in node.args:
+                self.type_of(arg)
+            name = ref_name(node.func)
+            if name in self.functions:
+                return self.float_type
+            if self.float_type != 'double':
+                self.promotions.append(
+                    (node, "call to unknown function '{}' is assumed to "
+                        "return double".format(name)))
+            return 'double'
+        return self.float_type
+
+    def check(self, node, left, right):
+        if self.float_type == 'double':
+            return
+        if 'double' not in (left, right) or left == right:
+            return
+        # report only where the promotion starts, not for every enclosing op
+        source = node.left if left == 'double' else node.right
+        if not isinstance(source, (BinOp, UnaryOp)):
+            self.promotions.append(
+                (node, "operands of '{}' are promoted to double".format(node.op)))
+
+    def visit(self, statements):
+        for _, stmt in statements:
+            # locals are declared with `float_type`, so an assignment
+            # converts its value back and needs no bookkeeping
+            if isinstance(stmt, Assign):
+                self.type_of(stmt.value)
+            elif isinstance(stmt, Return):
+                self.type_of(stmt.value)
+            elif isinstance(stmt, If):
+                self.type_of(stmt.test)
+            elif isinstance(stmt, For):
+                self.env[ref_name(stmt.target)] = 'int'
+                for expr in (stmt.start, stmt.stop, stmt.step):
+                    self.type_of(expr)
+            elif not stmt.block:
+                self.type_of(stmt)
+        return self.promotions
+
+
+def infer_types(statements, float_type='float', env=None, functions=(),
+        printer=None, warn=True):
+    """
+    Run TypeInference over `statements`.
+
+    Returns a list of messages describing every implicit promotion to
+    double; each message is also issued as a PrecisionWarning unless `warn`
+    is False.
+    """
+    inference = TypeInference(float_type, env, functions)
+    messages = []
+    for node, msg in inference.visit(statements):
+        if printer is not None:
+            msg = "{}: {}".format(msg, printer.expr(node))
+        messages.append(msg)
+        if warn:
+            warnings.warn(msg, PrecisionWarning)
+    return messages
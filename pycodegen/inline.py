@@ -0,0 +1,129 @@
+"""
+Resolution and inlining of the Python functions called from `ode`.
+
+A call to a module-level function of the model's module, or to a method of
+the model, is translated recursively. The callee either becomes a function
+of the generated source, or its statements are spliced into the caller
+with its locals renamed and every `return` turned into an assignment to a
+result variable.
+"""
+import types
+
+from .expr import replace, Name, Const, Attr, Assign, Return
+
+
+def function_namespace(func):
+    """
+    Globals a function resolves its names in.
+    """
+    return getattr(func, '__func__', func).__globals__
+
+
+def resolve_function(node, namespace, cls=None):
+    """
+    Python function a call target refers to.
+
+    Returns `(function, is_method)`, or `(None, False)` if `node` is not a
+    name of `namespace` or an attribute of `self` bound to a Python
+    function.
+    """
+    if isinstance(node, Name):
+        func = namespace.get(node.id)
+        if isinstance(func, types.FunctionType):
+            return func, False
+    elif isinstance(node, Attr) and node.value == Name('self') and \
+            cls is not None:
+        for klass in getattr(cls, '__mro__', (cls,)):
+            attr = vars(klass).get(node.attr)
+            if attr is None:
+                continue
+            if isinstance(attr, staticmethod):
+                return attr.__get__(None, cls), False
+            if isinstance(attr, types.FunctionType):
+                return attr, True
+            break
+    return None, False
+
+
+def referenced_functions(func, cls=None):
+    """
+    Python functions `func` may call, directly or not, found from the names
+    its code refers to. Used to key caches on the code of the callees.
+    """
+    found = []
+    stack = [getattr(func, '__func__', func)]
+    while stack:
+        caller = stack.pop()
+        namespace = function_namespace(caller)
+        for name in caller.__code__.co_names:
+            for node in (Name(name), Attr(Name('self'), name)):
+                callee, _ = resolve_function(node, namespace, cls)
+                if callee is not None and callee not in found:
+                    found.append(callee)
+                    stack.append(callee)
+    return found
+
+
+def arguments(func, args, is_method=False):
+    """
+    Expressions bound to the parameters of `func` by a call with positional
+    `args`, keyed by parameter name.
+    """
+    code = func.__code__
+    params = list(code.co_varnames[:code.co_argcount])
+    if is_method:
+        params = params[1:]
+    defaults = func.__defaults__ or ()
+    if len(args) > len(params) or \
+            len(args) < len(params) - len(defaults):
+        raise TypeError("{}() takes {} arguments, got {}".format(
+            func.__name__, len(params), len(args)))
+    bound = list(args) + [Const(x) for x in
+        defaults[len(defaults) - (len(params) - len(args)):]]
+    return list(zip(params, bound))
+
+
+def splice(statements, bound, local_names, prefix):
+    """
+    Rewrite the translated statements of a callee for insertion into its
+    caller.
+
+    `bound` lists `(parameter, argument)` pairs: simple arguments of
+    parameters the callee never assigns are substituted, the others are
+    assigned to a renamed copy of the parameter. Every other local in
+    `local_names` is renamed with `prefix`.
+
+    Returns the new statements, the names of the locals they assign and
+    the name of the variable holding the result, or None if the callee
+    returns no value.
+    """
+    assigned = set(stmt.target.id for _, stmt in statements
+        if isinstance(stmt, Assign) and isinstance(stmt.target, Name))
+    renamed = dict((name, Name(prefix + name)) for name in local_names)
+    out = []
+    for param, arg in bound:
+        simple = isinstance(arg, (Name, Const)) or (
+            isinstance(arg, Attr) and isinstance(arg.value, Name))
+        if simple and param not in assigned:
+            renamed[param] = arg
+        else:
+            renamed[param] = Name(prefix + param)
+            out.append((0, Assign(renamed[param], arg)))
+
+    result = None
+    sub = lambda node: renamed.get(node.id) if isinstance(node, Name) else None
+    for space, stmt in statements:
+        stmt = replace(stmt, sub)
+        if isinstance(stmt, Return):
+            # every return ends its path through the structured statements
+            if stmt.value == Const(None):
+                continue
+            result = prefix.rstrip('_')
+            stmt = Assign(Name(result), stmt.value)
+        out.append((space, stmt))
+    names = [renamed[x].id for x in [p for p, _ in bound] + list(local_names)
+        if isinstance(renamed[x], Name) and renamed[x].id.startswith(prefix)]
+    names = sorted(set(names), key=names.index)
+    if result is not None:
+        names.append(result)
+    return out, names, result
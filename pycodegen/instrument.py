@@ -0,0 +1,142 @@
+"""
+Opt-in instrumentation of a generator.
+
+A Profiler passed as `profiler=` to a generator replaces, on that instance
+only, the dispatch table and the methods it measures with timed wrappers,
+so generators created without one run the uninstrumented code.
+"""
+import marshal
+import timeit
+
+# categories of the measured calls
+CATEGORIES = ('handlers', 'statements', 'phases')
+
+# methods of a generator timed as phases
+PHASES = ('optimize', 'emit')
+
+
+class CountingStream(object):
+    """
+    Forward writes to `stream`, counting the characters written.
+    """
+    def __init__(self, stream, profiler):
+        self.stream = stream
+        self.profiler = profiler
+
+    def write(self, data):
+        self.profiler.bytes_written += len(data)
+        self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Profiler(object):
+    """
+    Call counts and times of the opcode handlers, of the printing of each
+    kind of statement and of the phases of a translation, and the number
+    of characters written to `ostream`.
+
+    Times are measured with `timer`; a call's own time excludes the time
+    of the measured calls it makes, e.g. the handlers of an inlined
+    function called from `handle_call_function`. A profiler is not meant
+    to be shared between threads.
+    """
+    def __init__(self, timer=timeit.default_timer):
+        self.timer = timer
+        self.bytes_written = 0
+        # category -> key -> [calls, own time, cumulative time, code]
+        self.records = dict((x, {}) for x in CATEGORIES)
+        # time spent in measured calls made by each open call
+        self._children = []
+
+    def timed(self, category, key, func, code=None):
+        """
+        Wrap `func` to add its calls to the record `key` of `category`.
+        """
+        record = self.records[category].setdefault(key, [0, 0., 0., code])
+        timer = self.timer
+        children = self._children
+
+        def wrapper(*args, **kwargs):
+            children.append(0.)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                inner = children.pop()
+                if children:
+                    children[-1] += elapsed
+                record[0] += 1
+                record[1] += elapsed - inner
+                record[2] += elapsed
+        return wrapper
+
+    def instrument(self, gen):
+        """
+        Time the handlers, statement printing, phases and template
+        rendering of generator `gen`.
+        """
+        table = []
+        for handle in gen.dispatch_table:
+            if handle is not None:
+                handle = self.timed('handlers', handle.__name__, handle,
+                    handle.__code__)
+            table.append(handle)
+        gen.dispatch_table = table
+        gen.handle_unknown = self.timed('handlers', 'handle_unknown',
+            gen.handle_unknown)
+
+        statement = gen.printer.statement
+        wrappers = {}
+
+        def print_statement(node):
+            kind = type(node).__name__
+            if kind not in wrappers:
+                wrappers[kind] = self.timed('statements', kind, statement)
+            return wrappers[kind](node)
+        gen.printer.statement = print_statement
+
+        for name in PHASES:
+            setattr(gen, name, self.timed('phases', name, getattr(gen, name)))
+        tpl = getattr(gen, 'tpl', None)
+        if tpl is not None:
+            tpl.render = self.timed('phases', 'render', tpl.render)
+
+    def stream(self, ostream):
+        return CountingStream(ostream, self)
+
+    def as_dict(self):
+        """
+        Records as `{category: {key: {'calls', 'time', 'cumulative'}}}`,
+        with the characters written under 'bytes_written'.
+        """
+        out = dict(bytes_written=self.bytes_written)
+        for category, records in self.records.items():
+            out[category] = dict((key, dict(calls=calls, time=own,
+                cumulative=cumulative))
+                for key, (calls, own, cumulative, _) in records.items()
+                if calls)
+        return out
+
+    def create_stats(self):
+        """
+        Fill `stats` in the format of cProfile, so that a profiler can be
+        passed to `pstats.Stats`.
+        """
+        self.stats = {}
+        for category, records in self.records.items():
+            for key, (calls, own, cumulative, code) in records.items():
+                if not calls:
+                    continue
+                if code is not None:
+                    label = (code.co_filename, code.co_firstlineno, key)
+                else:
+                    label = ('<pycodegen:{}>'.format(category), 0, key)
+                self.stats[label] = (calls, calls, own, cumulative, {})
+
+    def dump_stats(self, filename):
+        self.create_stats()
+        with open(filename, 'wb') as f:
+            marshal.dump(self.stats, f)
@@ -0,0 +1,217 @@
+"""
+Integration schemes for the generated `forward` step.
+
+'euler' and 'exp_euler' can be chosen per state; 'rk2' (midpoint) and
+'rk4' apply to the whole model. Exponential Euler requires the derivative
+of a state to be linear in that state, dx/dt = A + B*x with A and B free
+of x; B is computed alongside the derivative in `ode`.
+"""
+from .expr import (reads, replace, ref_name, Name, Const, Attr, BinOp, UnaryOp,
+    Assign)
+
+INTEGRATORS = ('euler', 'rk2', 'rk4', 'exp_euler')
+PER_STATE = ('euler', 'exp_euler')
+
+# evaluations of `ode` per step of each model-wide scheme
+EVALUATIONS = {'euler': 1, 'rk2': 2, 'rk4': 4}
+
+
+def resolve_integrator(integrator, states):
+    """
+    Normalise `integrator` (a name, or a dict of state -> name) into the
+    model-wide scheme and the method of every state.
+    """
+    if isinstance(integrator, dict):
+        unknown = set(integrator) - set(states)
+        if unknown:
+            raise ValueError("integrator given for unknown states: {}".format(
+                ', '.join(sorted(unknown))))
+        methods = dict((key, integrator.get(key, 'euler')) for key in states)
+    else:
+        methods = dict((key, integrator) for key in states)
+
+    for key, method in methods.items():
+        if method not in INTEGRATORS:
+            raise ValueError("integrator of '{}' must be one of {}, "
+                "got {!r}".format(key, INTEGRATORS, method))
+
+    schemes = set(methods.values())
+    if schemes - set(PER_STATE):
+        if len(schemes) > 1:
+            raise ValueError("{} cannot be mixed with other integrators".format(
+                ' and '.join(sorted(schemes - set(PER_STATE)))))
+        return schemes.pop(), methods
+    return 'euler', methods
+
+
+def _add(a, b):
+    if a == Const(0):
+        return b
+    if b == Const(0):
+        return a
+    return BinOp('+', a, b)
+
+
+def _neg(a):
+    if isinstance(a, Const):
+        return Const(-a.value)
+    if isinstance(a, UnaryOp) and a.op == '-':
+        return a.operand
+    return UnaryOp('-', a)
+
+
+def _mul(a, b):
+    if Const(0) in (a, b):
+        return Const(0)
+    if a == Const(1):
+        return b
+    if b == Const(1):
+        return a
+    if a == Const(-1):
+        return _neg(b)
+    if b == Const(-1):
+        return _neg(a)
+    return BinOp('*', a, b)
+
+
+def linearize(expr, var, definitions=None, ambiguous=None):
+    """
+    Split `expr` into (A, B) such that expr == A + B * var.
+
+    `definitions` maps local names and fields such as `inters.*` to the
+    expression they hold; `ambiguous` maps those whose value depends on
+    control flow to every name their assignments read. Returns None if
+    `expr` is not linear in `var`.
+    """
+    definitions = definitions or {}
+    ambiguous = ambiguous or {}
+    if ref_name(expr) == var:
+        return Const(0), Const(1)
+    if var not in depends(expr, definitions, ambiguous):
+        return expr, Const(0)
+    if isinstance(expr, (Name, Attr)):
+        name = ref_name(expr)
+        if name in definitions:
+            return linearize(definitions[name], var, definitions, ambiguous)
+        return None
+
+    if isinstance(expr, UnaryOp) and expr.op in ('-', '+'):
+        parts = linearize(expr.operand, var, definitions, ambiguous)
+        if parts is None or expr.op == '+':
+            return parts
+        return _neg(parts[0]), _neg(parts[1])
+
+    if not isinstance(expr, BinOp):
+        return None
+
+    left = linearize(expr.left, var, definitions, ambiguous)
+    right = linearize(expr.right, var, definitions, ambiguous)
+    if left is None or right is None:
+        return None
+    if expr.op == '+':
+        return _add(left[0], right[0]), _add(left[1], right[1])
+    if expr.op == '-':
+        return _add(left[0], _neg(right[0])), _add(left[1], _neg(right[1]))
+    if expr.op == '*':
+        if right[1] == Const(0):
+            return _mul(left[0], expr.right), _mul(left[1], expr.right)
+        if left[1] == Const(0):
+            return _mul(expr.left, right[0]), _mul(expr.left, right[1])
+        return None
+    if expr.op == '/' and right[1] == Const(0):
+        return (BinOp('/', left[0], expr.right),
+            BinOp('/', left[1], expr.right))
+    return None
+
+
+def depends(expr, definitions, ambiguous):
+    """
+    Names `expr` reads, directly or through the variables it reads.
+    """
+    names = set()
+    stack = list(reads(expr))
+    while stack:
+        name = stack.pop()
+        if name in names:
+            continue
+        names.add(name)
+        if name in definitions:
+            stack.extend(reads(definitions[name]))
+        elif name in ambiguous:
+            stack.extend(ambiguous[name])
+    return names
+
+
+def _rebind(name, definitions, ambiguous):
+    """
+    Before `name` is assigned, make the definitions reading it hold its
+    current value instead, or any value if that is not known.
+    """
+    prev = definitions.get(name)
+    for other, value in list(definitions.items()):
+        if other == name or name not in reads(value):
+            continue
+        if prev is None:
+            ambiguous[other] = ambiguous.get(other, set()) | depends(
+                definitions.pop(other), definitions, ambiguous)
+        else:
+            definitions[other] = replace(value, lambda x: prev if isinstance(
+                x, (Name, Attr)) and ref_name(x) == name else None)
+
+
+def add_exponential_coefficients(statements, states, target='jac'):
+    """
+    After every assignment to `gstates.<x>` for `x` in `states`, assign the
+    coefficient of `states.<x>` in the derivative to `<target>.<x>`.
+
+    Raises ValueError if a derivative is not linear in its state.
+    """
+    states = set(states)
+    definitions = {}
+    spaces = {}
+    ambiguous = {}
+    out = []
+    for space, stmt in statements:
+        if stmt.block:
+            # locals assigned inside the block that just closed may hold
+            # any of the values assigned to them
+            for name in [x for x in definitions if spaces[x] > space]:
+                ambiguous[name] = ambiguous.get(name, set()) | depends(
+                    definitions.pop(name), definitions, ambiguous)
+        out.append((space, stmt))
+        if not isinstance(stmt, Assign):
+            continue
+
+        name = ref_name(stmt.target)
+        if name is not None:
+            _rebind(name, definitions, ambiguous)
+        if isinstance(stmt.target, Name) or (isinstance(stmt.target, Attr)
+                and name is not None
+                and not name.startswith(('states.', 'gstates.'))):
+            value = stmt.value
+            if name in ambiguous or (name in reads(value) and
+                    name not in definitions):
+                ambiguous[name] = ambiguous.get(name, set()) | depends(
+                    value, definitions, ambiguous)
+                definitions.pop(name, None)
+                continue
+            if name in reads(value):
+                prev = definitions[name]
+                value = replace(value, lambda x: prev if isinstance(x,
+                    (Name, Attr)) and ref_name(x) == name else None)
+            definitions[name] = value
+            spaces[name] = space
+            continue
+
+        if name is None or not name.startswith('gstates.'):
+            continue
+        key = name[len('gstates.'):]
+        if key not in states:
+            continue
+
+        parts = linearize(stmt.value, 'states.' + key, definitions, ambiguous)
+        if parts is None:
+            raise ValueError("derivative of state '{}' is not linear in '{}', "
+                "exponential Euler cannot be used".format(key, key))
+        out.append((space, Assign(Attr(Name(target), key), parts[1])))
+    return out
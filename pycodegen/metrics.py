@@ -0,0 +1,119 @@
+"""
+Static cost model of translated statements.
+
+Operations are counted on the statements as written: both branches of an
+`if` contribute, and the body of a loop counts once per iteration when its
+trip count is a constant, once otherwise.
+"""
+from .expr import walk, Const, BinOp, UnaryOp, Call, Select, If, For, EndBlock
+from .optimize import expressions, func_name
+
+OP_KINDS = {
+    '+': 'add', '-': 'add',
+    '*': 'mul',
+    '/': 'div', '//': 'div', '%': 'div',
+    '**': 'pow',
+    '<': 'compare', '<=': 'compare', '>': 'compare', '>=': 'compare',
+    '==': 'compare', '!=': 'compare',
+    'and': 'logic', 'or': 'logic', 'not': 'logic',
+}
+
+# kinds counted as floating-point work; `**` counts as a transcendental call
+ARITHMETIC = ('add', 'mul', 'div')
+
+TRANSCENDENTAL = frozenset(['exp', 'expm1', 'log', 'log10', 'log2', 'log1p',
+    'pow', 'power', 'cbrt', 'sqrt', 'sin', 'cos', 'tan', 'arcsin', 'arccos',
+    'arctan', 'asin', 'acos', 'atan', 'arctan2', 'atan2', 'sinh', 'cosh',
+    'tanh', 'hypot'])
+
+
+def _trips(loop):
+    bounds = [x.value if isinstance(x, Const) else None
+        for x in (loop.start, loop.stop, loop.step)]
+    if not all(isinstance(x, int) for x in bounds) or not bounds[2]:
+        return None
+    return len(range(*bounds))
+
+
+def _add(counts, other, scale=1):
+    for key in ('ops', 'calls'):
+        for name, n in other[key].items():
+            counts[key][name] = counts[key].get(name, 0) + scale * n
+    for key in ('transcendental', 'branches', 'selects', 'loops',
+            'unbounded_loops'):
+        counts[key] += scale * other[key]
+
+
+def count_operations(statements, function_name=None, functions=None):
+    """
+    Count the work done by `statements`.
+
+    Parameters
+    ----------
+    function_name : callable
+        Maps the dotted Python name of a called function to the name
+        reported under `calls`, e.g. 'np.exp' to 'expf'.
+    functions : dict
+        Counts of the generated functions the statements may call, keyed
+        by name; a call adds the counts of the callee.
+
+    Returns
+    -------
+    dict
+        `ops` by kind, `calls` by function, the number of `transcendental`
+        calls, `branches` (`if` statements), `selects` (conditional
+        expressions), `loops`, and `unbounded_loops` whose trip count is
+        not a constant.
+    """
+    function_name = function_name or (lambda name: name)
+    functions = functions or {}
+    counts = dict(ops={}, calls={}, transcendental=0, branches=0, selects=0,
+        loops=0, unbounded_loops=0)
+    # multiplier of the statements in each open block
+    scales = [1]
+    for _, stmt in statements:
+        scale = scales[-1]
+        if isinstance(stmt, EndBlock):
+            scales.pop()
+            continue
+        for expr in expressions(stmt):
+            for node in walk(expr):
+                if isinstance(node, (BinOp, UnaryOp)):
+                    kind = OP_KINDS.get(node.op, 'other')
+                    counts['ops'][kind] = counts['ops'].get(kind, 0) + scale
+                    if kind == 'pow':
+                        # emitted as a call
+                        callee = function_name('pow')
+                        counts['calls'][callee] = \
+                            counts['calls'].get(callee, 0) + scale
+                        counts['transcendental'] += scale
+                elif isinstance(node, Select):
+                    counts['selects'] += scale
+                elif isinstance(node, Call):
+                    name = func_name(node)
+                    callee = function_name(name) if name else '<call>'
+                    counts['calls'][callee] = \
+                        counts['calls'].get(callee, 0) + scale
+                    if name and name.split('.')[-1] in TRANSCENDENTAL:
+                        counts['transcendental'] += scale
+                    if callee in functions:
+                        _add(counts, functions[callee], scale)
+        if isinstance(stmt, If):
+            counts['branches'] += scale
+            scales.append(scale)
+        elif isinstance(stmt, For):
+            trips = _trips(stmt)
+            counts['loops'] += scale
+            if trips is None:
+                counts['unbounded_loops'] += scale
+            scales.append(scale * (1 if trips is None else trips))
+    return counts
+
+
+def arithmetic_operations(counts):
+    """
+    Floating-point work of `counts`: arithmetic operations plus
+    transcendental calls.
+    """
+    return sum(counts['ops'].get(kind, 0) for kind in ARITHMETIC) + \
+        counts['transcendental']
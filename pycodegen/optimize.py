@@ -0,0 +1,492 @@
+"""
+Optimisation passes over translated statements.
+
+A pass takes the list of `(space, statement)` pairs collected by
+CodeGenerator.output_statement and returns a new list.
+"""
+from collections import OrderedDict
+
+from .expr import (walk, replace, reads, ref_name, Name, Const, Attr,
+    Subscript, BinOp, UnaryOp, Call, Select, Assign, Return, If, For, Else,
+    EndBlock)
+
+# functions without side effects whose calls may be merged
+PURE_FUNCTIONS = frozenset(
+    prefix + name
+    for prefix in ('np.', 'numpy.', 'math.', '')
+    for name in ('exp', 'expm1', 'log', 'log10', 'log2', 'log1p', 'sqrt',
+        'cbrt', 'power', 'pow', 'abs', 'fabs', 'absolute', 'sin', 'cos',
+        'tan', 'arcsin', 'arccos', 'arctan', 'asin', 'acos', 'atan',
+        'sinh', 'cosh', 'tanh', 'floor', 'ceil', 'fmin', 'fmax', 'minimum',
+        'maximum', 'min', 'max', 'sign', 'arctan2', 'atan2', 'hypot')
+)
+
+OPS = (BinOp, UnaryOp, Call)
+
+
+def func_name(call):
+    return ref_name(call.func) if isinstance(call.func, (Name, Attr)) else None
+
+
+def is_pure(node):
+    for x in walk(node):
+        if isinstance(x, Call) and func_name(x) not in PURE_FUNCTIONS:
+            return False
+    return True
+
+
+def count_ops(node):
+    return sum(1 for x in walk(node) if isinstance(x, OPS))
+
+
+def expressions(stmt):
+    """
+    Value expressions evaluated by a statement.
+    """
+    if isinstance(stmt, Assign):
+        return [stmt.value]
+    if isinstance(stmt, Return):
+        return [stmt.value]
+    if isinstance(stmt, If):
+        return [stmt.test]
+    if isinstance(stmt, For):
+        return [stmt.start, stmt.stop, stmt.step]
+    if stmt.block:
+        return []
+    return [stmt]
+
+
+def _with_expressions(stmt, func):
+    if isinstance(stmt, Assign):
+        return Assign(stmt.target, func(stmt.value))
+    if isinstance(stmt, Return):
+        return Return(func(stmt.value))
+    if isinstance(stmt, If):
+        return If(func(stmt.test))
+    if isinstance(stmt, For):
+        return For(stmt.target, func(stmt.start), func(stmt.stop),
+            func(stmt.step))
+    if stmt.block:
+        return stmt
+    return func(stmt)
+
+
+def block_end(statements, pos):
+    """
+    Position of the EndBlock closing the block opened at `pos`.
+    """
+    depth = 0
+    for end in range(pos, len(statements)):
+        stmt = statements[end][1]
+        if isinstance(stmt, EndBlock):
+            depth -= 1
+            if depth == 0:
+                return end
+        elif stmt.block and not isinstance(stmt, Else):
+            depth += 1
+    raise ValueError("block at {} is not closed".format(pos))
+
+
+def basic_blocks(statements):
+    """
+    Split statements into straight-line runs. An `If` ends the run that
+    computes its test; `Else`/`EndBlock` markers belong to no run and are
+    yielded as single-item lists flagged False.
+    """
+    block = []
+    for item in statements:
+        stmt = item[1]
+        if stmt.block and not isinstance(stmt, If):
+            if block:
+                yield True, block
+            yield False, [item]
+            block = []
+            continue
+        block.append(item)
+        if isinstance(stmt, If):
+            yield True, block
+            block = []
+    if block:
+        yield True, block
+
+
+def _is_candidate(node):
+    if not isinstance(node, OPS):
+        return False
+    if isinstance(node, UnaryOp) and not isinstance(node.operand, OPS):
+        return False
+    return is_pure(node) and bool(reads(node))
+
+
+def _occurrences(block):
+    versions = {}
+    found = OrderedDict()
+    for pos, (_, stmt) in enumerate(block):
+        for expr in expressions(stmt):
+            for node in walk(expr):
+                if not _is_candidate(node):
+                    continue
+                key = (node, tuple(sorted(
+                    (name, versions.get(name, 0)) for name in reads(node))))
+                found.setdefault(key, []).append(pos)
+        if isinstance(stmt, Assign):
+            name = ref_name(stmt.target)
+            versions[name] = versions.get(name, 0) + 1
+    return found
+
+
+def _cse_block(block, new_name):
+    temps = []
+    removed = 0
+    while True:
+        best = None
+        for (expr, _), positions in _occurrences(block).items():
+            if len(positions) < 2:
+                continue
+            size = count_ops(expr)
+            if best is None or size > best[0]:
+                best = (size, expr, positions)
+        if best is None:
+            break
+
+        size, expr, positions = best
+        name = new_name()
+        temp = Name(name)
+        sub = lambda node: temp if node == expr else None
+        for pos in sorted(set(positions)):
+            space, stmt = block[pos]
+            block[pos] = (space, _with_expressions(
+                stmt, lambda x: replace(x, sub)))
+        block.insert(positions[0], (block[positions[0]][0], Assign(temp, expr)))
+
+        temps.append((name, expr))
+        removed += (len(positions) - 1) * size
+    return temps, removed
+
+
+def eliminate_common_subexpressions(statements, reserved=(), prefix='_cse'):
+    """
+    Hoist pure subexpressions repeated within a basic block into temporaries.
+
+    Returns
+    -------
+    statements : list
+        The rewritten `(space, statement)` pairs.
+    temps : list
+        `(name, expression)` of every temporary introduced.
+    removed : int
+        Number of arithmetic operations and calls no longer evaluated.
+    """
+    reserved = set(reserved)
+    counter = [0]
+
+    def new_name():
+        while True:
+            name = '{}{}'.format(prefix, counter[0])
+            counter[0] += 1
+            if name not in reserved:
+                return name
+
+    out = []
+    temps = []
+    removed = 0
+    for straight, block in basic_blocks(statements):
+        if straight:
+            block = list(block)
+            _temps, _removed = _cse_block(block, new_name)
+            temps.extend(_temps)
+            removed += _removed
+        out.extend(block)
+    return out, temps, removed
+
+
+_FOLDABLE = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '**': lambda a, b: float(a) ** b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+_NUMBER = (int, float) + ((long,) if str is bytes else ())
+
+
+def _is_number(x):
+    return isinstance(x, _NUMBER) and not isinstance(x, bool)
+
+
+def _is_simple(node):
+    return isinstance(node, (Name, Const)) or (
+        isinstance(node, Attr) and ref_name(node) is not None)
+
+
+def _sqrt(node):
+    return Call(Attr(Name('np'), 'sqrt'), [node])
+
+
+class Folder(object):
+    """
+    Fold constant subexpressions and replace expensive operations on
+    constant operands by cheaper ones.
+
+    `constants` maps names (e.g. the macros emitted for `model.params`) to
+    their values; they are substituted only when a whole subexpression
+    becomes constant. `ints` names the integer variables, i.e. loop
+    counters, which C divides without a remainder.
+    """
+    def __init__(self, constants=None, ints=()):
+        self.constants = dict(
+            (k, v) for k, v in (constants or {}).items() if _is_number(v))
+        self.ints = frozenset(ints)
+        self.folded = 0
+        self.reduced = 0
+
+    def is_int(self, node):
+        if isinstance(node, Const):
+            return isinstance(node.value, int)
+        if isinstance(node, Name):
+            return node.id in self.ints or \
+                isinstance(self.constants.get(node.id), int)
+        if isinstance(node, UnaryOp):
+            return node.op != 'not' and self.is_int(node.operand)
+        if isinstance(node, BinOp):
+            return self.is_int(node.left) and self.is_int(node.right)
+        return False
+
+    def value(self, node):
+        if isinstance(node, Const) and _is_number(node.value):
+            return node.value
+        if isinstance(node, Name):
+            return self.constants.get(node.id)
+        return None
+
+    def __call__(self, node):
+        if isinstance(node, BinOp):
+            return self.binop(node.op, self(node.left), self(node.right))
+        if isinstance(node, UnaryOp):
+            operand = self(node.operand)
+            val = self.value(operand)
+            if node.op in ('-', '+') and val is not None:
+                self.folded += 1
+                return Const(-val if node.op == '-' else val)
+            return UnaryOp(node.op, operand)
+        if isinstance(node, Call):
+            args = [self(x) for x in node.args]
+            if func_name(node) in ('np.power', 'numpy.power') and len(args) == 2:
+                return self.binop('**', args[0], args[1])
+            return Call(node.func, args)
+        if isinstance(node, Subscript):
+            return Subscript(self(node.value), self(node.index))
+        if isinstance(node, Select):
+            test = self(node.test)
+            if isinstance(test, Const) and test.value is not None:
+                self.folded += 1
+                return self(node.body) if test.value else self(node.orelse)
+            return Select(test, self(node.body), self(node.orelse))
+        return node
+
+    def binop(self, op, left, right):
+        a, b = self.value(left), self.value(right)
+        if a is not None and b is not None and op in _FOLDABLE:
+            # C truncates integer division, Python floors it
+            if not (op == '/' and isinstance(a, int) and isinstance(b, int)):
+                try:
+                    val = _FOLDABLE[op](a, b)
+                except (ZeroDivisionError, OverflowError, ValueError):
+                    val = None
+                if _is_number(val) or isinstance(val, bool):
+                    self.folded += 1
+                    return Const(val)
+
+        if op == '**' and b is not None:
+            node = self.power(left, b)
+            if node is not None:
+                self.reduced += 1
+                return node
+
+        # an integer divisor is promoted unless both operands are integers
+        if op == '/' and b is not None and b != 0 and (isinstance(b, float)
+                or not self.is_int(left)):
+            self.reduced += 1
+            return BinOp('*', left, Const(1. / b))
+
+        return BinOp(op, left, right)
+
+    def power(self, base, exponent):
+        if exponent == 1:
+            return base
+        if exponent == 0.5:
+            return _sqrt(base)
+        if exponent == -0.5:
+            return BinOp('/', Const(1.), _sqrt(base))
+        if exponent == -1:
+            return BinOp('/', Const(1.), base)
+        # the products below evaluate `base` more than once
+        if _is_simple(base):
+            if exponent == 2:
+                return BinOp('*', base, base)
+            if exponent == -2:
+                return BinOp('/', Const(1.), BinOp('*', base, base))
+            if exponent == 3:
+                return BinOp('*', BinOp('*', base, base), base)
+            if exponent == 4:
+                square = BinOp('*', base, base)
+                return BinOp('*', square, square)
+        return None
+
+
+def fold_constants(statements, constants=None):
+    """
+    Apply Folder to every expression evaluated by `statements`.
+
+    Returns the rewritten statements, and the number of folded
+    subexpressions and strength-reduced operations.
+    """
+    folder = Folder(constants, [ref_name(stmt.target)
+        for _, stmt in statements if isinstance(stmt, For)])
+    out = [(space, _with_expressions(stmt, folder))
+        for space, stmt in statements]
+    return out, folder.folded, folder.reduced
+
+
+def _assignments(statements):
+    """
+    `{target name: (target, value)}` of a branch made only of assignments to
+    distinct names, else None.
+    """
+    found = OrderedDict()
+    for _, stmt in statements:
+        if not isinstance(stmt, Assign) or isinstance(stmt.target, Subscript):
+            return None
+        name = ref_name(stmt.target)
+        if name is None or name in found or not is_pure(stmt.value):
+            return None
+        found[name] = (stmt.target, stmt.value)
+    return found
+
+
+def _convert(test, body, orelse, max_ops):
+    body, orelse = _assignments(body), _assignments(orelse)
+    if body is None or orelse is None or not is_pure(test):
+        return None
+    targets = OrderedDict(body)
+    targets.update(orelse)
+    values = [v for _, v in body.values()] + [v for _, v in orelse.values()]
+    if sum(count_ops(v) for v in values) > max_ops:
+        return None
+    # every select evaluates the test anew, and all values are computed
+    # before any target is assigned
+    if any(reads(x) & set(targets) for x in values + [test]):
+        return None
+    out = []
+    for name, (target, _) in targets.items():
+        then = body[name][1] if name in body else target
+        other = orelse[name][1] if name in orelse else target
+        out.append(Assign(target, Select(test, then, other)))
+    return out
+
+
+def if_convert(statements, max_ops=8):
+    """
+    Replace `if` blocks that only assign a few cheap values by conditional
+    expressions, e.g. `if c: x = a else: x = b` becomes `x = c ? a : b`,
+    so that threads of a warp do not diverge on the branch.
+
+    Blocks are converted from the innermost outwards while the values of
+    both branches cost at most `max_ops` operations.
+
+    Returns the rewritten statements and the number of converted blocks.
+    """
+    statements = list(statements)
+    converted = 0
+    changed = True
+    while changed:
+        changed = False
+        opened = None
+        middle = None
+        for pos, (space, stmt) in enumerate(statements):
+            if isinstance(stmt, If):
+                opened, middle = pos, None
+            elif isinstance(stmt, For):
+                opened = None
+            elif isinstance(stmt, Else) and opened is not None:
+                middle = pos
+            elif isinstance(stmt, EndBlock) and opened is not None:
+                test = statements[opened][1].test
+                end = middle if middle is not None else pos
+                body = statements[opened + 1:end]
+                orelse = statements[middle + 1:pos] if middle is not None else []
+                new = _convert(test, body, orelse, max_ops)
+                if new is not None:
+                    indent = statements[opened][0]
+                    statements[opened:pos + 1] = [(indent, x) for x in new]
+                    converted += 1
+                    changed = True
+                    break
+                opened = None
+    return statements, converted
+
+
+def _trips(loop, folder):
+    # a bound may be a bare name of `constants`, which folding leaves as is
+    bounds = [folder.value(folder(x))
+        for x in (loop.start, loop.stop, loop.step)]
+    if not all(x is not None and not isinstance(x, float) for x in bounds):
+        return None
+    start, stop, step = bounds
+    return range(start, stop, step) if step else None
+
+
+def _unroll(statements, max_trips, folder, counter):
+    out = []
+    pos = 0
+    while pos < len(statements):
+        space, stmt = statements[pos]
+        if not isinstance(stmt, For):
+            out.append((space, stmt))
+            pos += 1
+            continue
+        end = block_end(statements, pos)
+        body = _unroll(statements[pos + 1:end], max_trips, folder, counter)
+        trips = _trips(stmt, folder)
+        if trips is None or len(trips) > max_trips or any(
+                isinstance(x, Assign) and x.target == stmt.target
+                for _, x in body):
+            out.append((space, stmt))
+            out.extend(body)
+            out.append(statements[end])
+        else:
+            shift = body[0][0] - space if body else 0
+            for i in trips:
+                sub = lambda node, i=i: Const(i) if node == stmt.target else None
+                func = lambda x: replace(x, sub)
+                for inner_space, inner in body:
+                    if isinstance(inner, Assign):
+                        inner = Assign(func(inner.target), func(inner.value))
+                    else:
+                        inner = _with_expressions(inner, func)
+                    out.append((inner_space - shift, inner))
+            counter[0] += 1
+        pos = end + 1
+    return out
+
+
+def unroll_loops(statements, max_trips=16, constants=None):
+    """
+    Replace `for` loops whose trip count is known and at most `max_trips`
+    by copies of their body, with the loop variable substituted.
+
+    `constants` maps names to their values as for `fold_constants`, so
+    loops over fixed parameters are unrolled as well.
+
+    Returns the rewritten statements and the number of unrolled loops.
+    """
+    counter = [0]
+    out = _unroll(list(statements), max_trips, Folder(constants), counter)
+    return out, counter[0]
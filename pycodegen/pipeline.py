@@ -0,0 +1,87 @@
+"""
+Concurrent compilation of generated sources with asyncio; requires
+Python 3 and is left out of Python 2 installs.
+
+The generators translate Python 2 bytecode only, so no single interpreter
+both translates models and runs this module: sources are generated under
+Python 2 and handed over, e.g. as files, to a Python 3 process that
+compiles them.
+
+Artifacts go to the same on-disk cache as `build.build`, keyed by the
+source, the compiler and its flags, so a source compiled by any job is
+reused by every other one. Identical sources in a batch are compiled
+once.
+"""
+import os
+import shutil
+import asyncio
+import tempfile
+
+from .build import (DEFAULT_CC, DEFAULT_FLAGS, ArtifactCache, artifact_key,
+    compile_command, compile_error)
+
+NVCC_FLAGS = ('-O3', '-shared', '-Xcompiler', '-fPIC')
+
+
+async def build_async(src, cc=DEFAULT_CC, flags=DEFAULT_FLAGS, cache=None,
+        suffix='.c'):
+    """
+    Compile `src` in a subprocess and return the path of the artifact.
+
+    `suffix` is the extension of the source file handed to the compiler,
+    e.g. '.cu' for nvcc.
+    """
+    cache = cache if isinstance(cache, ArtifactCache) else ArtifactCache(cache)
+    key = artifact_key(src, cc, flags)
+    path = cache.get(key)
+    if path is not None:
+        return path
+
+    workdir = tempfile.mkdtemp(dir=cache.directory)
+    try:
+        src_path = os.path.join(workdir, key + suffix)
+        out_path = os.path.join(workdir, key + '.so')
+        with open(src_path, 'w') as f:
+            f.write(src)
+        proc = await asyncio.create_subprocess_exec(
+            *compile_command(src_path, out_path, cc, flags),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        output, _ = await proc.communicate()
+        if proc.returncode:
+            raise compile_error(cc, proc.returncode, output)
+        return cache.commit(out_path, key)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def build_many_async(sources, cc=DEFAULT_CC, flags=DEFAULT_FLAGS,
+        cache=None, workers=None, suffix='.c'):
+    """
+    Compile `sources` with at most `workers` compilers running at once
+    (the number of CPUs if None) and return the artifact paths in order.
+    """
+    cache = cache if isinstance(cache, ArtifactCache) else ArtifactCache(cache)
+    limit = asyncio.Semaphore(workers or os.cpu_count() or 1)
+
+    async def run(src):
+        async with limit:
+            return await build_async(src, cc, flags, cache, suffix)
+
+    tasks = {}
+    for src in sources:
+        key = artifact_key(src, cc, flags)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(run(src))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    return [tasks[artifact_key(src, cc, flags)].result() for src in sources]
+
+
+def build_many(sources, **kwargs):
+    """
+    Blocking form of `build_many_async`.
+    """
+    return asyncio.run(build_many_async(sources, **kwargs))
@@ -1,7 +1,10 @@
 import inspect
 
+# getargspec was removed in Python 3.11
+getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
 def get_func_signature(func):
-    args = inspect.getargspec(func)
+    args = getargspec(func)
     num_defaults = 0 if args.defaults is None else len(args.defaults)
     num_args =  len(args.args) - num_defaults
 
@@ -12,6 +15,7 @@ def get_func_signature(func):
         _args.extend( _defaults )
     if args.varargs:
         _args.append( '*%s' % args.varargs )
-    if args.keywords:
-        _args.append( '**%s' % args.keywords )
+    keywords = getattr(args, 'varkw', None) or getattr(args, 'keywords', None)
+    if keywords:
+        _args.append( '**%s' % keywords )
     return _args
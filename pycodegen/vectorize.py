@@ -0,0 +1,544 @@
+"""
+NumPy backend evaluating a model over whole populations at once.
+
+Every arithmetic operation of `ode` becomes a ufunc call writing into a
+buffer of a Workspace (`np.add(a, b, out=_f0)`), so a step allocates no
+arrays once the workspace has been sized. Branches are evaluated for every
+neuron under a boolean mask: the ufuncs of a branch only write the lanes
+whose mask is set (`where=`).
+"""
+import numpy as np
+
+from .cuda import CudaGenerator
+from .expr import (reads, Name, Const, Attr, Subscript, BinOp,
+    UnaryOp, Select, Assign, Return, If, For, Else, EndBlock,
+    PythonPrinter)
+from .inference import COMPARISONS
+
+DTYPES = {'float': np.float32, 'double': np.float64}
+
+# structs whose fields are arrays, printed as `<struct>_<field>`
+STRUCTS = frozenset(['states', 'gstates', 'jac', 'inters'])
+
+BINARY_UFUNCS = {
+    '+': 'add',
+    '-': 'subtract',
+    '*': 'multiply',
+    '/': 'true_divide',
+    '//': 'floor_divide',
+    '%': 'remainder',
+    '**': 'power',
+    '<<': 'left_shift',
+    '>>': 'right_shift',
+    '&': 'bitwise_and',
+    '|': 'bitwise_or',
+    '^': 'bitwise_xor',
+    '<': 'less',
+    '<=': 'less_equal',
+    '>': 'greater',
+    '>=': 'greater_equal',
+    '==': 'equal',
+    '!=': 'not_equal',
+    'and': 'logical_and',
+    'or': 'logical_or',
+}
+
+UNARY_UFUNCS = {'-': 'negative', '~': 'invert', 'not': 'logical_not'}
+
+# builtin and `math` names of numpy ufuncs
+FUNCTION_ALIASES = {
+    'abs': 'absolute',
+    'pow': 'power',
+    'min': 'fmin',
+    'max': 'fmax',
+    'asin': 'arcsin',
+    'acos': 'arccos',
+    'atan': 'arctan',
+    'atan2': 'arctan2',
+}
+
+
+def ufunc_name(func):
+    """
+    Name of the numpy ufunc computing the function `func` refers to, e.g.
+    'np.exp' for 'math.exp', or None.
+    """
+    seg = func.split('.')
+    if len(seg) == 2 and seg[0] in ('np', 'numpy', 'math'):
+        name = seg[1]
+    elif len(seg) == 1 and seg[0] in FUNCTION_ALIASES:
+        name = seg[0]
+    else:
+        return None
+    name = FUNCTION_ALIASES.get(name, name)
+    if isinstance(getattr(np, name, None), np.ufunc):
+        return 'np.' + name
+    return None
+
+
+class VectorPrinter(PythonPrinter):
+    """
+    Render nodes as Python source over the arrays bound by the generated
+    function.
+    """
+    def write_attr(self, node, out):
+        if getattr(node.value, 'id', None) in STRUCTS:
+            out.append(node.value.id)
+            out.append('_')
+            out.append(node.attr)
+        elif getattr(node.value, 'id', None) == 'params':
+            out.append("params[{!r}]".format(node.attr))
+        else:
+            PythonPrinter.write_attr(self, node, out)
+
+    def write_call(self, node, out):
+        func = self.expr(node.func)
+        out.append(ufunc_name(func) or func)
+        out.append('(')
+        for i, arg in enumerate(node.args):
+            if i:
+                out.append(', ')
+            self.write(arg, out)
+        out.append(')')
+
+
+class Vectorizer(object):
+    """
+    Lower translated statements to ufunc calls over preallocated buffers.
+
+    Parameters
+    ----------
+    printer : VectorPrinter
+    arrays : container
+        Names bound to arrays: locals and inputs. Fields of STRUCTS are
+        always arrays; any other name (e.g. a parameter) is a scalar, and
+        expressions reading only scalars are left to Python.
+    """
+    def __init__(self, printer, arrays):
+        self.printer = printer
+        self.arrays = frozenset(arrays)
+        self.lines = []
+        self.buffers = []
+        self.kinds = {}
+        self.free = {'float': [], 'bool': []}
+        self.count = {'float': 0, 'bool': 0}
+        self.masks = []
+        # for every open block, None for an `if`, else the number of lines
+        # emitted before the body of the loop
+        self.blocks = []
+        self.depth = 0
+
+    @property
+    def mask(self):
+        return self.masks[-1][2] if self.masks else None
+
+    def where(self):
+        mask = self.mask
+        return '' if mask is None else ', where={}'.format(mask)
+
+    def buffer(self, kind):
+        if self.free[kind]:
+            return self.free[kind].pop()
+        name = '_{}{}'.format(kind[0], self.count[kind])
+        self.count[kind] += 1
+        self.buffers.append((name, kind))
+        self.kinds[name] = kind
+        return name
+
+    def release(self, name):
+        if name is not None:
+            self.free[self.kinds[name]].append(name)
+
+    def is_array(self, name):
+        return name in self.arrays or name.split('.')[0] in STRUCTS
+
+    def uniform(self, node):
+        return not any(self.is_array(x) for x in reads(node))
+
+    def kind(self, node):
+        if isinstance(node, Const):
+            return 'bool' if isinstance(node.value, bool) else 'float'
+        if isinstance(node, Name):
+            return self.kinds.get(node.id, 'float')
+        if isinstance(node, UnaryOp):
+            return 'bool' if node.op == 'not' else self.kind(node.operand)
+        if isinstance(node, Select):
+            body, orelse = self.kind(node.body), self.kind(node.orelse)
+            return 'bool' if body == orelse == 'bool' else 'float'
+        if isinstance(node, BinOp):
+            if node.op in COMPARISONS or node.op in ('and', 'or'):
+                return 'bool'
+            if node.op in ('&', '|', '^') and \
+                    self.kind(node.left) == self.kind(node.right) == 'bool':
+                return 'bool'
+        return 'float'
+
+    def ufunc(self, node):
+        if isinstance(node, BinOp):
+            if node.op not in BINARY_UFUNCS:
+                raise ValueError("operator '{}' cannot be vectorized".format(
+                    node.op))
+            return 'np.' + BINARY_UFUNCS[node.op], [node.left, node.right]
+        if isinstance(node, UnaryOp):
+            return 'np.' + UNARY_UFUNCS[node.op], [node.operand]
+        return ufunc_name(self.printer.expr(node.func)), node.args
+
+    def emit(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def value(self, node, out=None):
+        """
+        Emit the computation of `node`, into `out` if given.
+
+        Returns the source referring to the result and the temporary buffer
+        holding it, if any, which the caller must release.
+        """
+        if isinstance(node, UnaryOp) and node.op == '+':
+            return self.value(node.operand, out)
+        if self.uniform(node) or isinstance(node, (Name, Attr, Const,
+                Subscript)):
+            src = self.printer.expr(node)
+            if out is None or src == out:
+                return src, None
+            self.emit('np.copyto({}, {}{})'.format(out, src, self.where()))
+            return out, None
+
+        if isinstance(node, Select):
+            dest = out or self.buffer(self.kind(node))
+            self.push_mask(node.test)
+            self.value(node.body, out=dest)
+            self.flip_mask()
+            self.value(node.orelse, out=dest)
+            self.pop_mask()
+            return dest, None if out else dest
+
+        func, operands = self.ufunc(node)
+        args = [self.value(x) for x in operands]
+        for _, temp in args:
+            self.release(temp)
+        dest = out or self.buffer(self.kind(node))
+        args = ', '.join(src for src, _ in args)
+        if func is None:
+            # not a ufunc: evaluate over every lane and copy the result
+            self.emit('np.copyto({}, {}({}){})'.format(dest,
+                self.printer.expr(node.func), args, self.where()))
+        else:
+            self.emit('{}({}, out={}{})'.format(func, args, dest, self.where()))
+        return dest, None if out else dest
+
+    def statement(self, stmt):
+        if isinstance(stmt, Assign):
+            if isinstance(stmt.target, Subscript):
+                if self.masks:
+                    raise ValueError("subscript assignment inside a branch "
+                        "cannot be vectorized")
+                src, temp = self.value(stmt.value)
+                self.emit('{} = {}'.format(self.printer.expr(stmt.target), src))
+                self.release(temp)
+            else:
+                self.value(stmt.value, out=self.printer.expr(stmt.target))
+        elif isinstance(stmt, If):
+            self.push_mask(stmt.test)
+            self.blocks.append(None)
+        elif isinstance(stmt, For):
+            bounds = (stmt.start, stmt.stop, stmt.step)
+            if not all(self.uniform(x) for x in bounds):
+                raise ValueError("loop bounds that differ between neurons "
+                    "cannot be vectorized")
+            self.emit('for {} in range({}):'.format(
+                self.printer.expr(stmt.target),
+                ', '.join(self.printer.expr(x) for x in bounds)))
+            self.depth += 1
+            self.blocks.append(len(self.lines))
+        elif isinstance(stmt, Else):
+            self.flip_mask()
+        elif isinstance(stmt, EndBlock):
+            start = self.blocks.pop()
+            if start is None:
+                self.pop_mask()
+                return
+            if start == len(self.lines):
+                self.emit('pass')
+            self.depth -= 1
+        elif isinstance(stmt, Return):
+            if self.masks or self.depth or stmt.value != Const(None):
+                raise ValueError("only a final 'return' without a value can "
+                    "be vectorized")
+        else:
+            src, temp = self.value(stmt)
+            self.release(temp)
+
+    def push_mask(self, test):
+        """
+        Restrict the following computations to the lanes where `test` holds.
+        """
+        src, temp = self.value(test)
+        cond = temp
+        if temp is None or self.kinds[temp] != 'bool':
+            cond = self.buffer('bool')
+            if self.kind(test) == 'bool':
+                self.emit('np.copyto({}, {})'.format(cond, src))
+            else:
+                self.emit('np.not_equal({}, 0, out={})'.format(src, cond))
+            self.release(temp)
+        parent = self.mask
+        mask = cond
+        if parent is not None:
+            mask = self.buffer('bool')
+            self.emit('np.logical_and({}, {}, out={})'.format(
+                parent, cond, mask))
+        self.masks.append((parent, cond, mask))
+
+    def flip_mask(self):
+        parent, cond, mask = self.masks[-1]
+        self.emit('np.logical_not({0}, out={0})'.format(cond))
+        if parent is not None:
+            self.emit('np.logical_and({}, {}, out={})'.format(
+                parent, cond, mask))
+
+    def pop_mask(self):
+        parent, cond, mask = self.masks.pop()
+        self.release(cond)
+        if mask != cond:
+            self.release(mask)
+
+    def lower(self, statements):
+        """
+        Returns the lines of Python source for `statements`.
+        """
+        for _, stmt in statements:
+            if isinstance(stmt, Assign) and isinstance(stmt.target, Name):
+                name = stmt.target.id
+                kind = self.kind(stmt.value)
+                self.kinds[name] = 'bool' if kind == 'bool' and \
+                    self.kinds.get(name, 'bool') == 'bool' else 'float'
+        self.buffers.extend((name, self.kinds[name]) for name in sorted(
+            x for x in self.kinds if x in self.arrays))
+        for _, stmt in statements:
+            self.statement(stmt)
+        return self.lines
+
+
+numpy_src_template = """\
+import numpy as np
+
+
+def ode(states, gstates, jac, inters, inputs, params, work):
+    {%- for key in states %}
+    states_{{ key }} = states['{{ key }}']
+    {%- endfor %}
+    {%- for key in gstates %}
+    gstates_{{ key }} = gstates['{{ key }}']
+    {%- endfor %}
+    {%- for key in jac %}
+    jac_{{ key }} = jac['{{ key }}']
+    {%- endfor %}
+    {%- for key in inters %}
+    inters_{{ key }} = inters['{{ key }}']
+    {%- endfor %}
+    {%- for key in params %}
+    {{ key.upper() }} = params['{{ key }}']
+    {%- endfor %}
+    {%- for key in ode_signature %}
+    {%- if key in defaults %}
+    {{ key }} = inputs.get('{{ key }}', {{ defaults[key] }})
+    {%- else %}
+    {{ key }} = inputs['{{ key }}']
+    {%- endif %}
+    {%- endfor %}
+    {%- if buffers %}
+    {{ buffers|join(', ') }}, = work
+    {%- endif %}
+
+{{ src -}}
+"""
+
+
+class Workspace(object):
+    """
+    Arrays reused across calls; an array is reallocated only when the
+    requested shape or dtype changes.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        arr = self.arrays.get(name)
+        if arr is None or arr.shape != shape or arr.dtype != dtype:
+            arr = np.empty(shape, dtype)
+            self.arrays[name] = arr
+        return arr
+
+    def struct(self, name, keys, shape, dtype):
+        return dict((key, self.get(name + '.' + key, shape, dtype))
+            for key in keys)
+
+
+class NumpyKernel(object):
+    """
+    Advance a population of neurons, held as one array per state.
+
+    Calling the kernel integrates `num_steps` steps of size `dt` in place:
+    `states` (and `inters`) map names to arrays of `dtype`; `inputs` maps
+    the inputs of `ode` to arrays or scalars; `params` overrides the model
+    parameters.
+    """
+    def __init__(self, ode, generator):
+        model = generator.model
+        self.ode = ode
+        self.dtype = DTYPES[generator.float_type]
+        self.states = list(model.states)
+        self.gstates = generator.gstate_names()
+        self.inters = list(getattr(model, 'inters', None) or ())
+        self.params = dict(model.params)
+        self.bounds = dict(model.bounds)
+        self.inputs = list(generator.new_signature)
+        # evaluated by `ode`, as they may read the parameters
+        self.defaults = frozenset(generator.defaults)
+        self.buffers = list(generator.buffers)
+        self.integrator = generator.integrator
+        self.methods = dict(generator.methods)
+        self.workspace = Workspace()
+
+    def _work(self, shape):
+        ws = self.workspace
+        bool_ = np.dtype(bool)
+        return [ws.get(name, shape, bool_ if kind == 'bool' else self.dtype)
+            for name, kind in self.buffers]
+
+    def __call__(self, dt, states, inputs=None, inters=None, params=None,
+            num_steps=1):
+        shape = np.shape(states[self.states[0]])
+        ws, dtype = self.workspace, self.dtype
+        inputs = inputs or {}
+        missing = set(self.inputs) - set(inputs) - self.defaults
+        if missing:
+            raise ValueError("missing inputs: {}".format(
+                ', '.join(sorted(missing))))
+        if params is not None:
+            params = dict(self.params, **params)
+        else:
+            params = self.params
+        if inters is None:
+            inters = ws.struct('inters', self.inters, shape, dtype)
+
+        work = self._work(shape)
+        gstates = ws.struct('gstates', self.gstates, shape, dtype)
+        jac = ws.struct('jac', [key for key in self.states
+            if self.methods[key] == 'exp_euler'], shape, dtype)
+        for _ in range(num_steps):
+            self.ode(states, gstates, jac, inters, inputs, params, work)
+            self.forward(dt, states, gstates, jac, inputs, params, work)
+            for key, (low, high) in self.bounds.items():
+                np.clip(states[key], low, high, out=states[key])
+
+    def forward(self, dt, states, gstates, jac, inputs, params, work):
+        shape = np.shape(states[self.states[0]])
+        ws, dtype = self.workspace, self.dtype
+        if self.integrator in ('rk2', 'rk4'):
+            # stages write intermediate variables to scratch arrays, as the
+            # compiled kernels pass `inters` to `forward` by value
+            inters = ws.struct('rk.inters', self.inters, shape, dtype)
+            tmp = ws.struct('rk.tmp', self.states, shape, dtype)
+            stages = ['k2', 'k3', 'k4'] if self.integrator == 'rk4' else ['k2']
+            k = [gstates] + [ws.struct('rk.' + x, self.gstates, shape, dtype)
+                for x in stages]
+            # (weight of previous stage in the next argument, output stage)
+            if self.integrator == 'rk2':
+                scheme = [(0.5, 1)]
+            else:
+                scheme = [(0.5, 1), (0.5, 2), (1., 3)]
+            for weight, i in scheme:
+                for key in self.states:
+                    np.multiply(k[i-1][key], weight * dt, out=tmp[key])
+                    np.add(states[key], tmp[key], out=tmp[key])
+                self.ode(tmp, k[i], jac, inters, inputs, params, work)
+            for key in self.states:
+                if self.integrator == 'rk2':
+                    np.multiply(k[1][key], dt, out=tmp[key])
+                else:
+                    np.add(k[1][key], k[2][key], out=tmp[key])
+                    np.multiply(tmp[key], 2., out=tmp[key])
+                    np.add(tmp[key], k[0][key], out=tmp[key])
+                    np.add(tmp[key], k[3][key], out=tmp[key])
+                    np.multiply(tmp[key], dt / 6., out=tmp[key])
+                np.add(states[key], tmp[key], out=states[key])
+            return
+
+        for key in self.states:
+            g = gstates[key]
+            if self.methods[key] == 'exp_euler':
+                # x += (expm1(B * dt) / B) * dx, and dt * dx where B == 0
+                b, scale = jac[key], ws.get('exp.scale', shape, dtype)
+                nonzero = ws.get('exp.nonzero', shape, np.dtype(bool))
+                np.not_equal(b, 0, out=nonzero)
+                np.multiply(b, dt, out=scale)
+                np.expm1(scale, out=scale)
+                np.true_divide(scale, b, out=scale, where=nonzero)
+                np.logical_not(nonzero, out=nonzero)
+                np.copyto(scale, dt, where=nonzero)
+                np.multiply(g, scale, out=g)
+            else:
+                np.multiply(g, dt, out=g)
+            np.add(states[key], g, out=states[key])
+
+
+class NumpyGenerator(CudaGenerator):
+    """
+    Translate a model into a Python module of NumPy ufunc calls.
+
+    The module defines `ode`; `load` returns a NumpyKernel driving it with
+    the integrator of the model. Called Python functions are always
+    spliced into `ode`.
+    """
+    template = numpy_src_template
+    inline_modes = ('splice',)
+    run_attributes = CudaGenerator.run_attributes + ('buffers',)
+    cached_attributes = CudaGenerator.cached_attributes + ('buffers',)
+
+    def create_printer(self):
+        return VectorPrinter()
+
+    def new_state(self):
+        state = CudaGenerator.new_state(self)
+        state.buffers = None
+        return state
+
+    def gstate_names(self):
+        names = list(self.model.states)
+        names.extend(x for x in getattr(self.model, 'gstates', None) or ()
+            if x not in names)
+        return names
+
+    def emit(self, statements):
+        vectorizer = Vectorizer(self.printer,
+            list(self.variables) + list(self.new_signature))
+        lines = vectorizer.lower(statements)
+        self.buffers = vectorizer.buffers
+        for line in lines:
+            self.ostream.write(' ' * self.offset + line + self.newline)
+
+    def template_context(self):
+        return dict(
+            states=self.model.states,
+            gstates=self.gstate_names(),
+            jac=[key for key in self.model.states
+                if self.methods[key] == 'exp_euler'],
+            inters=getattr(self.model, 'inters', None) or (),
+            ode_signature=self.new_signature,
+            defaults=self.defaults,
+            params=self.model.params,
+            buffers=[name for name, _ in self.buffers],
+            src=self.ode_src.getvalue())
+
+    def generate_numpy(self):
+        self.numpy_src = self.generate_source()
+
+    def load(self):
+        if not hasattr(self, 'numpy_src'):
+            self.generate_numpy()
+        namespace = {}
+        code = compile(self.numpy_src,
+            '<pycodegen:{}>'.format(self.model.__class__.__name__), 'exec')
+        exec(code, namespace)
+        return NumpyKernel(namespace['ode'], self)
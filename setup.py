@@ -14,6 +14,7 @@ from distutils.command.install import INSTALL_SCHEMES
 from distutils.command.install_headers import install_headers
 from setuptools import find_packages
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 NAME =               'pycodegen'
 VERSION =            '0.1'
@@ -41,6 +42,17 @@ CLASSIFIERS = [
 os.chdir(os.path.dirname(os.path.realpath(__file__)))
 PACKAGES = find_packages()
 
+# modules using Python 3 syntax
+PY3_MODULES = [('pycodegen', 'pipeline')]
+
+class BuildPy(build_py):
+    """Leave the Python 3 only modules out of Python 2 builds."""
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info[0] == 2:
+            modules = [x for x in modules if x[:2] not in PY3_MODULES]
+        return modules
+
 if __name__ == "__main__":
     if os.path.exists('MANIFEST'):
         os.remove('MANIFEST')
@@ -62,6 +74,7 @@ if __name__ == "__main__":
         maintainer = MAINTAINER,
         maintainer_email = MAINTAINER_EMAIL,
         packages=PACKAGES,
+        cmdclass={'build_py': BuildPy},
         install_requires=[
             'jinja2 >= 2.8'
         ]
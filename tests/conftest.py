@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pycodegen.cuda import CudaGenerator
+from pycodegen.build import DEFAULT_CC
+
+
+class Probe(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        self.d_x = np.exp(stimulus - self.x)
+
+
+def translates():
+    """
+    Whether the bytecode of this interpreter is translated correctly.
+    """
+    try:
+        gen = CudaGenerator(Probe())
+        gen.generate()
+    except Exception:
+        return False
+    return 'gstates.x = expf((stimulus - states.x));' in \
+        gen.ode_src.getvalue()
+
+
+TRANSLATES = translates()
+
+
+def find_executable(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        exe = os.path.join(path, name)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+    return None
+
+
+@pytest.fixture
+def translation():
+    """
+    Skip tests translating `ode` where the bytecode is not supported.
+    """
+    if not TRANSLATES:
+        pytest.skip("bytecode of Python {}.{} is not supported".format(
+            *sys.version_info[:2]))
+
+
+@pytest.fixture
+def build_dir(tmpdir):
+    """
+    Artifact directory of the C kernels; skips without a C compiler.
+    """
+    if find_executable(DEFAULT_CC.split()[0]) is None:
+        pytest.skip("no C compiler '{}'".format(DEFAULT_CC))
+    return str(tmpdir)
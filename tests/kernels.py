@@ -0,0 +1,100 @@
+"""
+Running generated kernels, and a reference integration in Python.
+"""
+import ctypes
+
+import numpy as np
+
+
+def initial(model, num, seed=0):
+    """
+    Random states, with `v` in a membrane-potential range, and zeroed
+    intermediates of `num` neurons.
+    """
+    rng = np.random.RandomState(seed)
+    states = dict((key, rng.uniform(-80., 10., num) if key == 'v' else
+        rng.uniform(0., 1., num)) for key in model.states)
+    inters = dict((key, np.zeros(num))
+        for key in getattr(model, 'inters', None) or ())
+    return states, inters
+
+
+def reference(model, states, inputs, dt, steps, trace=None):
+    """
+    Forward Euler of `model.ode` run by Python on one neuron at a time.
+
+    Returns the final states and, given `trace`, the states after every
+    `trace` steps under 'trace_<name>', one row per sample.
+    """
+    num = len(states[list(model.states)[0]])
+    out = dict((key, np.empty(num)) for key in model.states)
+    if trace:
+        out.update(('trace_' + key, np.empty((steps // trace, num)))
+            for key in model.states)
+    for i in range(num):
+        neuron = type(model)()
+        for key, val in model.params.items():
+            setattr(neuron, key, val)
+        for key, val in (getattr(model, 'inters', None) or {}).items():
+            setattr(neuron, key, val)
+        for key in model.states:
+            setattr(neuron, key, states[key][i])
+        for step in range(steps):
+            neuron.ode(**dict((key, val[i]) for key, val in inputs.items()))
+            for key in model.states:
+                val = getattr(neuron, key) + dt * getattr(neuron, 'd_' + key)
+                low, high = model.bounds.get(key, (-np.inf, np.inf))
+                setattr(neuron, key, min(max(val, low), high))
+            if trace and (step + 1) % trace == 0:
+                for key in model.states:
+                    out['trace_' + key][(step + 1) // trace - 1, i] = \
+                        getattr(neuron, key)
+        for key in model.states:
+            out[key][i] = getattr(neuron, key)
+    return out
+
+
+def run_c(gen, states, inters, inputs, dt, steps, build_dir):
+    """
+    Advance copies of `states` and `inters` by `steps` steps with the
+    double-precision C kernel of `gen`, launched once per step unless it
+    is multi-step.
+
+    Returns the arrays of the kernel by field name, e.g. 'v' or 'trace_v'.
+    """
+    kernel = gen.load(cache=build_dir)
+    if gen.params_mode == 'constant':
+        gen.set_params()
+    num = len(states[list(states)[0]])
+    arrays = dict((key, val.copy()) for key, val in states.items())
+    arrays.update((key, val.copy()) for key, val in inters.items())
+    arrays.update(inputs)
+    if gen.trace:
+        arrays.update(('trace_' + key, np.zeros((steps // gen.trace, num)))
+            for key in states)
+    ptr = ctypes.POINTER(ctypes.c_double)
+    args = []
+    for _, arg in gen.kernel_arguments():
+        if arg == 'num_thread':
+            args.append(num)
+        elif arg == 'dt':
+            args.append(dt)
+        elif arg == 'num_steps':
+            args.append(steps)
+        else:
+            args.append(arrays[arg[2:]].ctypes.data_as(ptr))
+    for _ in range(1 if gen.multi_step else steps):
+        kernel(*args)
+    return arrays
+
+
+def run_numpy(gen, states, inters, inputs, dt, steps):
+    """
+    Advance copies of `states` and `inters` with the NumPy kernel of `gen`.
+    """
+    kernel = gen.load()
+    arrays = dict((key, val.copy()) for key, val in states.items())
+    inters = dict((key, val.copy()) for key, val in inters.items())
+    kernel(dt, arrays, inputs, inters=inters or None, num_steps=steps)
+    arrays.update(inters)
+    return arrays
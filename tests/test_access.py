@@ -0,0 +1,93 @@
+"""
+Read/write analysis of `ode` and the global-memory traffic it trims.
+"""
+import pytest
+
+from pycodegen.cuda import CudaGenerator
+from pycodegen.dataflow import field_access
+from pycodegen.expr import (Name, Const, Attr, BinOp, Assign, If, For,
+    Else, EndBlock)
+
+translates = pytest.mark.usefixtures('translation')
+
+
+class Gated(object):
+    states = {'v': 0., 'm': 0.}
+    inters = {'g': 0., 'h': 0.}
+    params = {'gm': 1.}
+    bounds = {}
+
+    def ode(self, stim=0., unused=0.):
+        self.g = self.gm * self.m
+        if self.v > 0.:
+            self.h = self.v
+        self.d_v = stim - self.g
+        self.d_m = -self.m
+
+
+def field(name):
+    struct, key = name.split('.')
+    return Attr(Name(struct), key)
+
+
+def access(*stmts):
+    return field_access([(0, x) for x in stmts])
+
+
+def test_read_before_write():
+    exposed, written, defined = access(
+        Assign(field('inters.g'), field('states.m')),
+        Assign(field('states.m'), BinOp('+', field('inters.g'), Const(1.))))
+    assert exposed == set(['states.m'])
+    assert written == defined == set(['inters.g', 'states.m'])
+
+
+def test_branch_defines_on_both_paths():
+    exposed, written, defined = access(
+        If(field('states.v')),
+        Assign(Name('a'), Const(1.)),
+        Assign(Name('b'), Const(1.)),
+        Else(),
+        Assign(Name('a'), Const(2.)),
+        EndBlock(),
+        Assign(field('inters.g'), BinOp('+', Name('a'), Name('b'))))
+    assert exposed == set(['states.v', 'b'])
+    assert written == set(['a', 'b', 'inters.g'])
+    assert defined == set(['a', 'inters.g'])
+
+
+def test_loop_may_not_run():
+    exposed, written, defined = access(
+        For(Name('i'), Const(0), Name('n'), Const(1)),
+        Assign(field('inters.g'), Name('a')),
+        Assign(Name('a'), Const(1.)),
+        EndBlock())
+    # `a` of the previous iteration, or on entry
+    assert exposed == set(['n', 'a'])
+    assert defined == set()
+
+
+@translates
+def test_report():
+    gen = CudaGenerator(Gated(), params='array')
+    gen.generate()
+    report = gen.reports['access']
+    assert sorted(report['read_only']) == \
+        ['params.gm', 'states.m', 'states.v', 'stim']
+    assert sorted(report['write_only']) == ['inters.g', 'inters.h']
+    assert report['read_write'] == []
+    assert report['unused'] == ['unused']
+
+
+@translates
+def test_trimmed_traffic():
+    gen = CudaGenerator(Gated())
+    src = gen.render()
+    # g is assigned on every path, h only when v > 0
+    assert gen.global_loads() == set(['states.m', 'states.v', 'inters.h',
+        'stim'])
+    assert 'inters.g = g_g[tid];' not in src
+    assert 'inters.h = g_h[tid];' in src
+    assert 'g_g[tid] = inters.g;' in src
+    assert 'unused = g_unused[tid]' not in src
+    assert ('const float *__restrict__ ', 'g_stim') in gen.kernel_arguments()
@@ -0,0 +1,81 @@
+"""
+The C and NumPy kernels against Python running the model's own `ode`.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+from kernels import initial, reference, run_c, run_numpy
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+def rate(v, scale=1.):
+    if v > -40.:
+        return scale * 0.1 * (v + 40.)
+    return scale * 0.01
+
+
+class Neuron(object):
+    states = {'v': -65., 'm': 0.}
+    inters = {'g': 0.}
+    params = {'gm': 2., 'n': 3}
+    bounds = {'m': (0., 1.)}
+
+    def ode(self, stimulus=0.):
+        acc = 0.
+        for i in range(self.n):
+            acc = acc + self.m ** 2 / (i + 1.)
+        self.g = self.gm * acc
+        am = rate(self.v) + rate(self.v, 2.)
+        self.d_m = am * (1. - self.m) - 0.1 * self.m
+        leak = self.g * (self.v + 70.)
+        self.d_v = stimulus - leak if self.v < 0. else -self.v
+
+
+NUM = 64
+DT = 1e-3
+STEPS = 20
+
+OPTIONS = [
+    {},
+    dict(fold=True, cse=True),
+    dict(unroll=True, select=True),
+    dict(fixed=['n'], unroll=True),
+    dict(params='constant'),
+    dict(multi_step=True),
+    dict(inline='device', fold=True, cse=True),
+]
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_c_matches_reference(options, build_dir):
+    model = Neuron()
+    states, inters = initial(model, NUM)
+    inputs = dict(stimulus=np.linspace(0., 10., NUM))
+    expected = reference(model, states, inputs, DT, STEPS)
+    gen = CGenerator(model, float_type='double', **options)
+    out = run_c(gen, states, inters, inputs, DT, STEPS, build_dir)
+    for key in model.states:
+        np.testing.assert_allclose(out[key], expected[key], rtol=1e-9)
+
+
+@pytest.mark.parametrize('options', OPTIONS[:4])
+def test_numpy_matches_reference(options):
+    model = Neuron()
+    states, inters = initial(model, NUM)
+    inputs = dict(stimulus=np.linspace(0., 10., NUM))
+    expected = reference(model, states, inputs, DT, STEPS)
+    gen = NumpyGenerator(model, float_type='double', **options)
+    out = run_numpy(gen, states, inters, inputs, DT, STEPS)
+    for key in model.states:
+        np.testing.assert_allclose(out[key], expected[key], rtol=1e-9)
+
+
+def test_source():
+    gen = CGenerator(Neuron())
+    src = gen.render()
+    assert '__global__' not in src and 'threadIdx' not in src
+    assert '#pragma omp parallel for' in src
@@ -0,0 +1,84 @@
+"""
+Translation of many models or functions over worker processes.
+"""
+import pytest
+
+from pycodegen.batch import resolve_backend, translate_many
+from pycodegen.cache import TranslationCache
+from pycodegen.c import CGenerator
+from pycodegen.codegen import CodeGenerator
+from pycodegen.cuda import CudaGenerator
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+def add(a, b):
+    c = a + b
+    return c * 2
+
+
+def scale(a):
+    return a * 3
+
+
+def shift(a):
+    b = a - 1
+    return b
+
+
+class Decay(object):
+    states = {'x': 1.}
+    params = {'tau': 2.}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        self.d_x = stimulus - self.x / self.tau
+
+
+class Growth(object):
+    states = {'x': 1.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        self.d_x = self.x
+
+
+FUNCTIONS = [add, scale, shift, add]
+SOURCES = ['c = (a + b)\nreturn (c * 2)\n', 'return (a * 3)\n',
+    'b = (a - 1)\nreturn b\n', 'c = (a + b)\nreturn (c * 2)\n']
+
+
+def test_resolve_backend():
+    assert resolve_backend('c') is CGenerator
+    assert resolve_backend(CodeGenerator) is CodeGenerator
+    with pytest.raises(ValueError):
+        resolve_backend('fortran')
+
+
+def test_plain_code_generator():
+    assert CodeGenerator(add).generate_source() == SOURCES[0]
+    assert translate_many(FUNCTIONS, backend=CodeGenerator,
+        workers=1) == SOURCES
+
+
+def test_workers_keep_order_and_fill_cache():
+    cache = TranslationCache()
+    assert translate_many(FUNCTIONS, backend=CodeGenerator, workers=2,
+        cache=cache) == SOURCES
+    # `add` is translated twice, in different workers
+    assert len(cache) == 3 and cache.hits == 0
+    assert translate_many(FUNCTIONS, backend=CodeGenerator, workers=2,
+        cache=cache) == SOURCES
+    assert cache.hits == 4
+
+
+def test_models():
+    models = [Decay(), Growth(), Decay()]
+    expected = [CudaGenerator(x).generate_source() for x in models]
+    cache = TranslationCache()
+    assert translate_many(models, workers=2, cache=cache) == expected
+    assert len(cache) == 2
+    sources = translate_many(models, backend='c', workers=2, fold=True)
+    assert sources == [CGenerator(x, fold=True).generate_source()
+        for x in models]
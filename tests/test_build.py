@@ -0,0 +1,55 @@
+"""
+Building C sources into the artifact cache.
+"""
+import os
+
+import pytest
+
+from pycodegen.build import (ArtifactCache, CompileError, artifact_key,
+    build, compile_command, load)
+
+SRC = 'int answer(void) { return 42; }\n'
+
+
+def test_artifact_key():
+    key = artifact_key(SRC)
+    assert key == artifact_key(SRC)
+    assert key != artifact_key(SRC + '\n')
+    assert key != artifact_key(SRC, cc='clang')
+    assert key != artifact_key(SRC, flags=('-O0', '-fPIC', '-shared'))
+
+
+def test_artifact_cache(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('sub', 'dir')))
+    assert os.path.isdir(cache.directory)
+    assert cache.get('key') is None
+    tmp = tmpdir.join('tmp.so')
+    tmp.write('artifact')
+    path = cache.commit(str(tmp), 'key')
+    assert path == cache.path('key') and cache.get('key') == path
+    assert not tmp.exists()
+    # a second cache on the same directory sees the entry
+    assert ArtifactCache(cache.directory).get('key') == path
+
+
+def test_compile_command():
+    assert compile_command('k.c', 'k.so', cc='cc', flags=('-O2',)) == \
+        ['cc', '-O2', '-o', 'k.so', 'k.c', '-lm']
+
+
+def test_build_is_cached(build_dir):
+    path = build(SRC, cache=build_dir)
+    assert path == ArtifactCache(build_dir).get(artifact_key(SRC))
+    mtime = os.path.getmtime(path)
+    assert build(SRC, cache=build_dir) == path
+    assert os.path.getmtime(path) == mtime
+    # only the artifact is left behind
+    assert os.listdir(build_dir) == [os.path.basename(path)]
+    assert load(SRC, cache=build_dir).answer() == 42
+
+
+def test_compile_error(build_dir):
+    with pytest.raises(CompileError) as info:
+        build('int answer(void) { return }\n', cache=build_dir)
+    assert 'failed with exit code' in str(info.value)
+    assert os.listdir(build_dir) == []
@@ -0,0 +1,82 @@
+"""
+Decoded instruction streams and the structure kept on them.
+"""
+import dis
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pytest
+
+from pycodegen.bytecode import InstructionStream, instruction_stream
+from pycodegen.cfg import structure, Branch, Loop
+from pycodegen.codegen import CodeGenerator
+
+translates = pytest.mark.usefixtures('translation')
+
+
+def clip(a, n):
+    for i in range(n):
+        if a > i:
+            a = a - 1
+    return a
+
+
+def test_stream_is_shared():
+    stream = instruction_stream(clip.__code__)
+    assert instruction_stream(clip.__code__) is stream
+    assert CodeGenerator(clip, ostream=StringIO()).instructions is stream
+
+
+def test_decoding():
+    stream = instruction_stream(clip.__code__)
+    instructions = list(stream)
+    assert len(instructions) == len(stream)
+    assert [x.offset for x in stream[1:3]] == \
+        [x.offset for x in instructions[1:3]]
+    assert instructions[-1].opname == 'RETURN_VALUE'
+    if sys.version_info[0] == 3:
+        expected = list(dis.get_instructions(clip))
+        assert [(x.opcode, x.argval, x.offset) for x in instructions] == \
+            [(x.opcode, x.argval, x.offset) for x in expected]
+    names = [x.argval for x in instructions if x.opname == 'LOAD_FAST']
+    assert set(names) == set(['a', 'n', 'i'])
+    targets = [x.offset for x in instructions if x.is_jump_target]
+    assert targets and all(isinstance(x, int) for x in targets)
+
+
+def test_instructions_are_not_kept():
+    stream = InstructionStream(clip.__code__)
+    assert stream[0] is not stream[0]
+    assert stream[0].offset == stream[0].offset
+
+
+@translates
+def test_structure_is_kept_on_the_stream():
+    stream = instruction_stream(clip.__code__)
+    regions = structure(stream)
+    assert structure(stream) is regions
+    loops = [x for x in regions if isinstance(x, Loop)]
+    assert len(loops) == 1
+    assert any(isinstance(x, Branch) for x in loops[0].body)
+    # a list of instructions is split afresh
+    assert structure(list(stream)) is not regions
+
+
+@translates
+def test_generators_share_the_structure():
+    # held here, the stream outlives the generators
+    stream = instruction_stream(clip.__code__)
+    out = []
+    regions = []
+    for _ in range(2):
+        ostream = StringIO()
+        CodeGenerator(clip, ostream=ostream).generate()
+        out.append(ostream.getvalue())
+        regions.append(stream.regions)
+    assert out[0] == out[1]
+    assert 'for i in range(0, n, 1):' in out[0]
+    assert regions[0] is not None and regions[1] is regions[0]
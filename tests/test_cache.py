@@ -0,0 +1,177 @@
+"""
+Translation cache: tiers, keys, and the state restored on a hit.
+"""
+import os
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
+import pytest
+
+from pycodegen.cache import TranslationCache, make_key, code_fingerprint
+from pycodegen.codegen import CodeGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.fused import FusedGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+
+class Keywords(object):
+    states = {'x': 0.}
+    params = {'a': 1.}
+    bounds = {}
+
+    def ode(self, **kwargs):
+        I = kwargs.pop('I', 0.)
+        self.d_x = I * self.a - self.x
+
+
+HELPER = """
+def rate(v):
+    return v * {}
+
+def ode(self):
+    self.d_x = rate(self.x)
+"""
+
+
+def model_calling(scale):
+    """
+    Model whose `ode` calls a module-level helper scaling by `scale`.
+    """
+    namespace = {}
+    exec(HELPER.format(scale), namespace)
+
+    class Scaled(object):
+        states = {'x': 0.}
+        params = {}
+        bounds = {}
+        ode = namespace['ode']
+    return Scaled()
+
+
+translates = pytest.mark.usefixtures('translation')
+
+
+def test_memory_hit_and_miss():
+    cache = TranslationCache()
+    assert cache.get('a') is None
+    cache.set('a', u'src')
+    assert cache.get('a') == u'src'
+    assert cache.stats() == dict(hits=1, misses=1, memory_hits=1,
+        disk_hits=0, memory_entries=1)
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = TranslationCache(maxsize=2)
+    cache.set('a', u'1')
+    cache.set('b', u'2')
+    cache.get('a')
+    cache.set('c', u'3')
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert len(cache) == 2
+
+
+def test_disk_tier_outlives_memory(tmpdir):
+    directory = str(tmpdir)
+    TranslationCache(directory=directory).set('a', u'src')
+    cache = TranslationCache(directory=directory)
+    assert cache.get('a') == u'src'
+    assert cache.disk_hits == 1
+    # now in memory as well
+    assert cache.get('a') == u'src'
+    assert cache.memory_hits == 1
+
+
+def test_disk_tier_is_trimmed_to_budget(tmpdir):
+    directory = str(tmpdir)
+    cache = TranslationCache(maxsize=1, directory=directory, max_bytes=10)
+    cache.set('a', u'x' * 8)
+    os.utime(os.path.join(directory, 'a.src'), (0, 0))
+    cache.set('b', u'y' * 8)
+    assert sorted(os.listdir(directory)) == ['b.src']
+    cache.clear()
+    assert os.listdir(directory) == [] and len(cache) == 0
+
+
+def test_key_depends_on_code_and_options():
+    def f(x):
+        return x + 1
+
+    def g(x):
+        return x + 2
+    assert make_key(code_fingerprint(f)) == make_key(code_fingerprint(f))
+    assert make_key(code_fingerprint(f)) != make_key(code_fingerprint(g))
+    model = Keywords()
+    assert CudaGenerator(model).cache_key() == \
+        CudaGenerator(model).cache_key()
+    assert CudaGenerator(model).cache_key() != \
+        CudaGenerator(model, cse=True).cache_key()
+    assert CudaGenerator(model).cache_key() != \
+        CudaGenerator(model, float_type='double').cache_key()
+
+
+def test_key_depends_on_called_functions():
+    keys = [CudaGenerator(model_calling(x)).cache_key() for x in (2, 2, 3)]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+
+@translates
+def test_code_generator_hit():
+    def f(a, b):
+        c = a + b
+        return c * 2
+    cache = TranslationCache()
+    out = []
+    for _ in range(2):
+        stream = StringIO()
+        CodeGenerator(f.__code__, ostream=stream, cache=cache).generate()
+        out.append(stream.getvalue())
+    assert out[0] == out[1] == 'c = (a + b)\nreturn (c * 2)\n'
+    assert cache.hits == 1
+
+
+@translates
+@pytest.mark.parametrize('disk', [False, True])
+def test_hit_restores_translation_state(tmpdir, disk):
+    directory = str(tmpdir) if disk else None
+    first = CudaGenerator(Keywords(), cache=TranslationCache(
+        directory=directory))
+    src = first.generate_source()
+    cache = first.cache if not disk else TranslationCache(directory=directory)
+    second = CudaGenerator(Keywords(), cache=cache)
+    assert second.generate_source() == src
+    assert cache.hits == 1
+    assert ('const float *__restrict__ ', 'g_I') in second.kernel_arguments()
+    assert second.kernel_arguments() == first.kernel_arguments()
+    assert 'I' in second.describe_layout(10)['fields']
+    assert second.describe_layout(10) == first.describe_layout(10)
+    for key in CudaGenerator.cached_attributes:
+        assert getattr(second, key) == getattr(first, key)
+
+
+@translates
+def test_fused_hit_restores_population_state():
+    cache = TranslationCache()
+    first = FusedGenerator([(Keywords(), 4)], cache=cache)
+    first.generate_cuda()
+    second = FusedGenerator([(Keywords(), 4)], cache=cache)
+    second.generate_cuda()
+    assert cache.hits == 1
+    assert second.cuda_src == first.cuda_src
+    assert 'Keywords_g_I' in [name for _, name in second.kernel_arguments()]
+
+
+@translates
+def test_numpy_kernel_from_hit():
+    cache = TranslationCache()
+    NumpyGenerator(Keywords(), cache=cache).load()
+    kernel = NumpyGenerator(Keywords(), cache=cache).load()
+    assert cache.hits == 1
+    states = dict(x=np.zeros(3))
+    kernel(0.1, states, dict(I=np.ones(3)))
+    np.testing.assert_allclose(states['x'], 0.1)
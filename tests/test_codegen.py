@@ -0,0 +1,95 @@
+"""
+CodeGenerator: opcode dispatch and the policies for unknown opcodes.
+"""
+import warnings
+from opcode import opmap
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pytest
+
+from pycodegen.codegen import CodeGenerator
+from pycodegen.cuda import CudaGenerator
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+def builds_list(a):
+    b = [a, 1.]
+    return a
+
+
+def translate(func, **kwargs):
+    stream = StringIO()
+    gen = CodeGenerator(func.__code__, ostream=stream, **kwargs)
+    gen.generate()
+    return gen, stream.getvalue()
+
+
+def test_dispatch_table_is_indexed_by_opcode():
+    table = CodeGenerator.dispatch_table
+    assert len(table) == 256
+    assert table[opmap['LOAD_FAST']] is \
+        CodeGenerator.__dict__['handle_load_fast']
+    assert table[opmap['BUILD_LIST']] is None
+
+
+def test_subclass_handlers_are_dispatched():
+    class Listing(CodeGenerator):
+        def handle_build_list(self, ins):
+            self.var[-ins.arg:] = [self.var[-1]]
+
+    assert Listing.dispatch_table[opmap['BUILD_LIST']] is \
+        Listing.__dict__['handle_build_list']
+    assert CodeGenerator.dispatch_table[opmap['BUILD_LIST']] is None
+    stream = StringIO()
+    Listing(builds_list.__code__, ostream=stream).generate()
+    assert stream.getvalue() == 'b = 1.0\nreturn a\n'
+
+
+def test_unknown_opcode_raises():
+    with pytest.raises(NotImplementedError) as info:
+        translate(builds_list, unknown='raise')
+    assert 'BUILD_LIST' in str(info.value)
+
+
+@pytest.mark.parametrize('policy, warns', [('warn', True), ('collect', False)])
+def test_unknown_opcode_is_collected(policy, warns):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        gen, _ = translate(builds_list, unknown=policy)
+    assert [x.opname for x in gen.unknown_instructions] == ['BUILD_LIST']
+    assert any('BUILD_LIST' in str(x.message) for x in caught) == warns
+
+
+def test_unknown_opcode_callback():
+    seen = []
+
+    def callback(gen, ins):
+        seen.append(ins.opname)
+        gen.var[-ins.arg:] = [gen.var[-1]]
+    gen, src = translate(builds_list, unknown=callback)
+    assert seen == ['BUILD_LIST']
+    assert src == 'b = 1.0\nreturn a\n'
+    assert gen.unknown_instructions == []
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        CodeGenerator(builds_list.__code__, unknown='ignore')
+
+
+def test_unknown_opcode_policy_of_cuda_generator():
+    class Listing(object):
+        states = {'x': 0.}
+        params = {}
+        bounds = {}
+
+        def ode(self):
+            b = [self.x, 1.]
+            self.d_x = -self.x
+    with pytest.raises(NotImplementedError):
+        CudaGenerator(Listing(), unknown='raise').generate()
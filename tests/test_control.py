@@ -0,0 +1,103 @@
+"""
+Branches, early returns and short-circuit operators, executed by the
+kernels.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+from kernels import reference, run_c, run_numpy
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Nested(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, s=0.):
+        if self.x < 1.:
+            if s > 0.5:
+                self.d_x = 1.
+            elif s > 0.25:
+                self.d_x = 2.
+            else:
+                self.d_x = 3.
+        elif self.x < 2. or s > 0.9:
+            self.d_x = -1.
+        else:
+            self.d_x = -2.
+
+
+class EarlyReturn(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, s=0.):
+        self.d_x = 0.
+        if self.x > 1. and s > 0.5:
+            return
+        self.d_x = s
+
+
+class Operands(object):
+    states = {'x': 0.}
+    params = {'a': 3., 'b': 7.}
+    bounds = {}
+
+    def ode(self, s=0.):
+        y = s and self.b
+        z = s or self.a
+        w = self.x > 0. and self.x < 1.
+        self.d_x = y + z + w
+
+
+NUM = 9
+DT = 1e-2
+STEPS = 3
+
+STATES = dict(x=np.array([0., 0.5, 0.5, 0.5, 1.5, 1.5, 2.5, 2.5, 2.5]))
+INPUTS = dict(s=np.array([0., 0.75, 0.3, 0.1, 0.2, 0.95, 0.2, 0.95, 0.]))
+
+
+def check(model, numpy=True, build_dir=None):
+    expected = reference(model, STATES, INPUTS, DT, STEPS)
+    out = run_c(CGenerator(model, float_type='double'), STATES, {}, INPUTS,
+        DT, STEPS, build_dir)
+    np.testing.assert_allclose(out['x'], expected['x'], rtol=1e-12)
+    if numpy:
+        out = run_numpy(NumpyGenerator(model, float_type='double'), STATES,
+            {}, INPUTS, DT, STEPS)
+        np.testing.assert_allclose(out['x'], expected['x'], rtol=1e-12)
+
+
+def test_nested_branches(build_dir):
+    check(Nested(), build_dir=build_dir)
+
+
+def test_early_return(build_dir):
+    # a return inside a branch cannot be vectorized
+    check(EarlyReturn(), numpy=False, build_dir=build_dir)
+
+
+def test_short_circuit_values(build_dir):
+    check(Operands(), build_dir=build_dir)
+
+
+def test_short_circuit_source():
+    gen = CudaGenerator(Operands())
+    gen.generate()
+    src = gen.ode_src.getvalue()
+    assert 'y = (s ? B : s);' in src
+    assert 'z = (s ? s : A);' in src
+    # both operands are truth values
+    assert 'w = ((states.x > 0.0f) && (states.x < 1.0f));' in src
+    gen = CudaGenerator(EarlyReturn())
+    gen.generate()
+    assert 'if (((states.x > 1.0f) && (s > 0.5f))) {' in \
+        gen.ode_src.getvalue()
@@ -0,0 +1,67 @@
+"""
+Kernels advancing several populations of different models.
+"""
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.fused import FusedGenerator
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Defaulted(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, stim=0.):
+        self.d_x = 1. if stim > 0.5 else -1.
+
+
+class Keywords(object):
+    states = {'x': 0.}
+    params = {'a': 1.}
+    bounds = {}
+
+    def ode(self, **kwargs):
+        I = kwargs.pop('I', 0.)
+        self.d_x = I * self.a - self.x
+
+
+def test_dispatch():
+    populations = [(Keywords(), 40), (Defaulted(), 3), (Keywords(), 5)]
+    fused = FusedGenerator(populations)
+    assert [(x['namespace'], x['start'], x['count'])
+        for x in fused.populations] == \
+        [('Keywords', 0, 40), ('Defaulted', 64, 3), ('Keywords_1', 96, 5)]
+    assert fused.num_thread == 101
+    fused = FusedGenerator(populations, dispatch='range')
+    assert [x['start'] for x in fused.populations] == [0, 40, 43]
+    assert fused.num_thread == 48
+
+
+def test_keyword_input():
+    fused = FusedGenerator([(Keywords(), 4), (Defaulted(), 3)])
+    fused.generate_cuda()
+    assert [name for _, name in fused.kernel_arguments()] == ['dt',
+        'Keywords_g_x', 'Keywords_g_I', 'Defaulted_g_x', 'Defaulted_g_stim']
+    assert 'Keywords::run(tid - 0, 4, dt, Keywords_g_x, Keywords_g_I);' in \
+        fused.cuda_src
+    assert 'Defaulted::run(tid - 32, 3, dt, Defaulted_g_x, ' \
+        'Defaulted_g_stim);' in fused.cuda_src
+
+
+def test_options_per_population():
+    fused = FusedGenerator([(Keywords(), 4, dict(layout='packed')),
+        (Defaulted(), 3)], float_type='double')
+    fused.generate_cuda()
+    assert [x for x in fused.kernel_arguments() if x[1] == 'Keywords_g_data']
+    assert fused.float_type == 'double'
+    with pytest.raises(ValueError):
+        FusedGenerator([(Keywords(), 4, dict(float_type='double')),
+            (Defaulted(), 3)])
+
+
+def test_requires_cuda():
+    with pytest.raises(ValueError):
+        FusedGenerator([(Keywords(), 4)], generator=CGenerator)
@@ -0,0 +1,105 @@
+"""
+Helper functions and methods called from `ode`.
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.inference import PrecisionWarning
+from pycodegen.vectorize import NumpyGenerator
+
+from kernels import initial, reference, run_c, run_numpy
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+def sign_term(v):
+    y = v * 2.
+    unused = v + 1.
+    return np.sign(y) * (v * v + 1.) + (v * v + 1.) * 3.
+
+
+def clipped(v, low=-1.):
+    if v < low:
+        return low
+    return v
+
+
+def countdown(n):
+    return countdown(n - 1)
+
+
+class Helper(object):
+    states = {'v': -65.}
+    params = {}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        self.d_v = sign_term(self.v) + stimulus
+
+
+class Calls(object):
+    states = {'v': -65., 'w': 0.}
+    params = {'k': 0.5}
+    bounds = {}
+
+    def rate(self, x):
+        return self.k * x
+
+    def ode(self, stimulus=0.):
+        self.d_w = self.rate(clipped(self.v / 10.)) - self.w
+        self.d_v = clipped(stimulus, 2.) - self.rate(self.v)
+
+
+class Recursive(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        self.d_x = countdown(self.x)
+
+
+def test_device_helper_is_optimized():
+    gen = CudaGenerator(Helper(), inline='device', cse=True)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        src = gen.render()
+    helper = src[src.index('sign_term('):src.index('void ode(')]
+    assert 'unused' not in helper
+    assert helper.count('((v * v) + 1.0f)') == 1
+    assert any(issubclass(x.category, PrecisionWarning) and
+        'np.sign' in str(x.message) for x in caught)
+    assert any('np.sign' in x for x in gen.reports['types']['promotions'])
+
+
+@pytest.mark.parametrize('inline', ['device', 'splice'])
+def test_c_matches_reference(inline, build_dir):
+    model = Calls()
+    states, inters = initial(model, 16)
+    inputs = dict(stimulus=np.linspace(0., 4., 16))
+    expected = reference(model, states, inputs, 1e-2, 5)
+    gen = CGenerator(model, float_type='double', inline=inline)
+    out = run_c(gen, states, inters, inputs, 1e-2, 5, build_dir)
+    for key in model.states:
+        np.testing.assert_allclose(out[key], expected[key], rtol=1e-12)
+
+
+def test_numpy_splices_calls():
+    model = Calls()
+    states, inters = initial(model, 16)
+    inputs = dict(stimulus=np.linspace(0., 4., 16))
+    expected = reference(model, states, inputs, 1e-2, 5)
+    out = run_numpy(NumpyGenerator(model, float_type='double'), states,
+        inters, inputs, 1e-2, 5)
+    for key in model.states:
+        np.testing.assert_allclose(out[key], expected[key], rtol=1e-12)
+
+
+def test_recursion_is_rejected():
+    with pytest.raises(NotImplementedError) as info:
+        CudaGenerator(Recursive()).generate()
+    assert 'countdown -> countdown' in str(info.value)
@@ -0,0 +1,111 @@
+"""
+Profiling of translations.
+"""
+import pstats
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import pytest
+
+from pycodegen.codegen import CodeGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.instrument import Profiler
+
+translates = pytest.mark.usefixtures('translation')
+
+
+class Ticks(object):
+    """
+    Timer advancing by one on every call.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class Decay(object):
+    states = {'x': 1.}
+    params = {'tau': 2.}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        a = self.x / self.tau
+        if a > 1.:
+            a = 1.
+        self.d_x = stimulus - a
+
+
+def add(a, b):
+    c = a + b
+    return c * 2
+
+
+def test_own_time_excludes_measured_callees():
+    profiler = Profiler(timer=Ticks())
+    inner = profiler.timed('phases', 'inner', lambda: None)
+
+    def body():
+        inner()
+        inner()
+    outer = profiler.timed('phases', 'outer', body)
+    outer()
+    records = profiler.as_dict()['phases']
+    # every inner call takes one tick; outer takes 5, of which 2 are inner
+    assert records['inner'] == dict(calls=2, time=2., cumulative=2.)
+    assert records['outer'] == dict(calls=1, time=3., cumulative=5.)
+
+
+def test_timed_call_may_raise():
+    profiler = Profiler(timer=Ticks())
+
+    def fail():
+        raise KeyError
+    with pytest.raises(KeyError):
+        profiler.timed('phases', 'fail', fail)()
+    assert profiler.as_dict()['phases']['fail']['calls'] == 1
+    assert profiler._children == []
+
+
+@translates
+def test_translation_is_profiled(tmpdir):
+    profiler = Profiler()
+    gen = CudaGenerator(Decay(), profiler=profiler)
+    gen.render()
+    records = profiler.as_dict()
+    # self.x and self.tau; self.d_x
+    assert records['handlers']['handle_load_attr']['calls'] == 2
+    assert records['handlers']['handle_store_attr']['calls'] == 1
+    assert dict((key, val['calls']) for key, val in
+        records['statements'].items()) == \
+        dict(Assign=3, If=1, EndBlock=1, Return=1)
+    assert sorted(records['phases']) == ['emit', 'optimize', 'render']
+    assert records['phases']['render']['calls'] == 1
+    assert records['bytes_written'] == len(gen.ode_src.getvalue())
+
+    path = str(tmpdir.join('profile'))
+    profiler.dump_stats(path)
+    stats = pstats.Stats(path)
+    assert any(name == 'handle_load_attr' for _, _, name in stats.stats)
+
+
+@translates
+def test_only_the_instance_is_instrumented():
+    profiler = Profiler()
+    stream = StringIO()
+    gen = CodeGenerator(add, ostream=stream, profiler=profiler)
+    plain = CodeGenerator(add, ostream=StringIO())
+    assert gen.dispatch_table is not plain.dispatch_table
+    assert plain.dispatch_table is CodeGenerator.dispatch_table
+    gen.generate()
+    plain.generate()
+    assert profiler.bytes_written == len(stream.getvalue())
+    calls = profiler.as_dict()['handlers']['handle_load_fast']['calls']
+    plain.generate()
+    assert profiler.as_dict()['handlers']['handle_load_fast']['calls'] == \
+        calls
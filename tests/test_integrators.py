@@ -0,0 +1,143 @@
+"""
+Forward steps of the integrators, and the coefficients of exponential
+Euler.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+from kernels import initial, run_c, run_numpy
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Decay(object):
+    states = {'x': 1.}
+    params = {'k': 3.}
+    bounds = {}
+
+    def ode(self):
+        self.d_x = -self.k * self.x
+
+
+class Linear(object):
+    states = {'n': 0.9, 'v': 1.}
+    inters = {'b': 0.}
+    params = {}
+    bounds = {}
+    integrator = 'exp_euler'
+
+    def ode(self):
+        self.b = 2. * self.n + self.v
+        self.d_n = 1. - self.b
+        self.d_v = -self.v
+
+
+class Quadratic(object):
+    states = {'n': 0.5}
+    inters = {'b': 0.}
+    params = {}
+    bounds = {}
+    integrator = 'exp_euler'
+
+    def ode(self):
+        self.b = self.n * self.n
+        self.d_n = -self.b
+
+
+class Reassigned(object):
+    states = {'n': 0.5}
+    params = {}
+    bounds = {}
+    integrator = 'exp_euler'
+
+    def ode(self):
+        a = 2.
+        b = a * self.n
+        a = 5.
+        self.d_n = -b + a
+
+
+class StateReassigned(object):
+    states = {'n': 0.5}
+    params = {}
+    bounds = {}
+    integrator = 'exp_euler'
+
+    def ode(self):
+        b = 2. * self.n
+        self.n = 1.
+        self.d_n = -b
+
+
+NUM = 16
+DT = 1e-2
+STEPS = 10
+
+# growth of x per step of size h = k * dt for d_x = -k * x
+FACTORS = {
+    'euler': lambda h: 1. - h,
+    'rk2': lambda h: 1. - h + h ** 2 / 2.,
+    'rk4': lambda h: 1. - h + h ** 2 / 2. - h ** 3 / 6. + h ** 4 / 24.,
+    'exp_euler': lambda h: np.exp(-h),
+}
+
+
+def jacobian(model):
+    gen = CudaGenerator(model)
+    gen.generate()
+    lines = gen.ode_src.getvalue().splitlines()
+    return [x.strip() for x in lines if x.strip().startswith('jac.')]
+
+
+@pytest.mark.parametrize('integrator', sorted(FACTORS))
+def test_step_of_linear_decay(integrator, build_dir):
+    model = Decay()
+    states, inters = initial(model, NUM)
+    expected = states['x'] * FACTORS[integrator](3. * DT) ** STEPS
+    for gen in (CGenerator(model, float_type='double', integrator=integrator),
+            NumpyGenerator(model, float_type='double', integrator=integrator)):
+        if isinstance(gen, CGenerator):
+            out = run_c(gen, states, inters, {}, DT, STEPS, build_dir)
+        else:
+            out = run_numpy(gen, states, inters, {}, DT, STEPS)
+        np.testing.assert_allclose(out['x'], expected, rtol=1e-12)
+
+
+def test_exp_euler_through_intermediate(build_dir):
+    model = Linear()
+    states, inters = initial(model, NUM)
+    states['v'][:] = 0.
+    # exact while v == 0
+    expected = 0.5 + (states['n'] - 0.5) * np.exp(-2. * DT * STEPS)
+    out_c = run_c(CGenerator(model, float_type='double'), states, inters, {},
+        DT, STEPS, build_dir)
+    out_np = run_numpy(NumpyGenerator(model, float_type='double'), states,
+        inters, {}, DT, STEPS)
+    np.testing.assert_allclose(out_c['n'], expected, rtol=1e-12)
+    np.testing.assert_allclose(out_np['n'], expected, rtol=1e-12)
+
+
+def test_coefficient_follows_intermediate():
+    assert jacobian(Linear()) == ['jac.n = -2.0f;', 'jac.v = -1;']
+
+
+def test_coefficient_uses_value_before_reassignment():
+    assert jacobian(Reassigned()) == ['jac.n = -2.0f;']
+
+
+@pytest.mark.parametrize('model', [Quadratic(), StateReassigned()])
+def test_nonlinear_derivative_is_rejected(model):
+    with pytest.raises(ValueError) as info:
+        CudaGenerator(model).generate()
+    assert "not linear in 'n'" in str(info.value)
+
+
+def test_integrator_per_state():
+    gen = CudaGenerator(Linear(), integrator=dict(n='exp_euler'))
+    gen.generate()
+    assert gen.methods == dict(n='exp_euler', v='euler')
+    assert 'jac.v' not in gen.ode_src.getvalue()
@@ -0,0 +1,89 @@
+"""
+Layouts of the kernel I/O: separate arrays, or a single packed or
+interleaved buffer.
+"""
+import ctypes
+
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+
+from kernels import initial, reference
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Cell(object):
+    states = {'v': -65., 'w': 0.}
+    inters = {'g': 0.}
+    params = {'tau': 10.}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        self.g = self.w / self.tau
+        self.d_v = stimulus - self.g * (self.v + 70.)
+        self.d_w = 1. - self.w
+
+
+NUM = 8
+DT = 1e-2
+STEPS = 5
+
+
+def test_describe_packed():
+    gen = CudaGenerator(Cell(), layout='packed')
+    gen.generate()
+    desc = gen.describe_layout(NUM)
+    fields = desc['fields']
+    assert sorted(fields) == ['g', 'stimulus', 'v', 'w']
+    assert desc['offsets'] == dict((key, i * NUM)
+        for i, key in enumerate(fields))
+    assert set(desc['strides'].values()) == set([1])
+    assert desc['size'] == 4 * NUM and desc['itemsize'] == 4
+    assert [name for _, name in gen.kernel_arguments()] == \
+        ['num_thread', 'dt', 'g_data']
+    index = fields.index('stimulus')
+    assert 'float stimulus = g_data[{} * num_thread + tid];'.format(index) \
+        in gen.render()
+
+
+def test_describe_aos():
+    gen = CudaGenerator(Cell(), layout='aos', float_type='double',
+        params='array')
+    gen.generate()
+    desc = gen.describe_layout(NUM)
+    fields = desc['fields']
+    assert fields[-1] == 'tau'
+    assert desc['offsets'] == dict((key, i) for i, key in enumerate(fields))
+    assert set(desc['strides'].values()) == set([5])
+    assert desc['size'] == 5 * NUM and desc['itemsize'] == 8
+    data = np.arange(desc['size'])
+    views = gen.field_views(data, NUM)
+    assert list(views['tau']) == list(range(4, 5 * NUM, 5))
+
+
+def test_invalid_layout():
+    with pytest.raises(ValueError):
+        CudaGenerator(Cell(), layout='rows')
+
+
+@pytest.mark.parametrize('layout', ['packed', 'aos'])
+def test_kernel_matches_reference(layout, build_dir):
+    model = Cell()
+    states, inters = initial(model, NUM)
+    inputs = dict(stimulus=np.linspace(0., 10., NUM))
+    expected = reference(model, states, inputs, DT, STEPS)
+    gen = CGenerator(model, float_type='double', layout=layout)
+    kernel = gen.load(cache=build_dir)
+    data = np.zeros(gen.describe_layout(NUM)['size'])
+    views = gen.field_views(data, NUM)
+    for arrays in (states, inters, inputs):
+        for key, val in arrays.items():
+            views[key][:] = val
+    for _ in range(STEPS):
+        kernel(NUM, DT, data.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    for key in model.states:
+        np.testing.assert_allclose(views[key], expected[key], rtol=1e-12)
+    np.testing.assert_array_equal(views['stimulus'], inputs['stimulus'])
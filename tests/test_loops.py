@@ -0,0 +1,90 @@
+"""
+Loops over range(), and their unrolling.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+
+from kernels import initial, reference, run_c
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class FixedLoop(object):
+    states = {'x': 0.}
+    params = {'k': 3, 'a': 0.5}
+    bounds = {}
+
+    def ode(self):
+        acc = 0.
+        for i in range(self.k):
+            acc = acc + self.a * i
+        for j in range(6, 0, -2):
+            acc = acc - j * self.x
+        self.d_x = acc - self.x
+
+
+class ReturnInLoop(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        for i in range(3):
+            if self.x > i:
+                return
+            self.d_x = self.x + i
+
+
+class BreakInLoop(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        for i in range(3):
+            if self.x > i:
+                break
+            self.d_x = self.x + i
+
+
+@pytest.mark.parametrize('options', [
+    dict(unroll=True),
+    dict(unroll=True, fixed=['k'], params='constant'),
+])
+def test_loop_bounded_by_param_is_unrolled(options):
+    gen = CudaGenerator(FixedLoop(), **options)
+    src = gen.render()
+    assert gen.reports['unroll']['unrolled'] == 2
+    assert 'for (' not in src
+
+
+def test_loop_bounded_by_runtime_param_is_kept():
+    gen = CudaGenerator(FixedLoop(), unroll=True, params='constant')
+    src = gen.render()
+    assert gen.reports['unroll']['unrolled'] == 1
+    assert 'for (int i = 0; i < params.k; ++i) {' in src
+
+
+@pytest.mark.parametrize('options', [{}, dict(unroll=True),
+    dict(unroll=True, fixed=['k'], params='constant')])
+def test_loops_match_reference(options, build_dir):
+    model = FixedLoop()
+    states, inters = initial(model, 8)
+    expected = reference(model, states, {}, 1e-2, 4)
+    gen = CGenerator(model, float_type='double', **options)
+    out = run_c(gen, states, inters, {}, 1e-2, 4, build_dir)
+    np.testing.assert_allclose(out['x'], expected['x'], rtol=1e-12)
+
+
+@pytest.mark.parametrize('model, keyword', [
+    (ReturnInLoop(), "'return'"),
+    (BreakInLoop(), "'break"),
+])
+def test_exit_from_loop_is_rejected(model, keyword):
+    with pytest.raises(NotImplementedError) as info:
+        CudaGenerator(model).generate()
+    # `break` is an instruction of its own before Python 3.8
+    assert keyword in str(info.value).lower()
@@ -0,0 +1,86 @@
+"""
+Static cost model and the traffic reported for a step of one thread.
+"""
+import pytest
+
+from pycodegen.cuda import CudaGenerator
+from pycodegen.expr import Name, Const, Attr, BinOp, Call, Assign, If, For, \
+    EndBlock
+from pycodegen.metrics import count_operations, arithmetic_operations
+
+translates = pytest.mark.usefixtures('translation')
+
+
+class Defaulted(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, stim=0.):
+        self.d_x = 1. if stim > 0.5 else -1.
+
+
+def test_count_operations():
+    exp = Call(Attr(Name('np'), 'exp'), [Name('x')])
+    counts = count_operations([
+        (0, For(Name('i'), Const(0), Const(3), Const(1))),
+        (4, Assign(Name('a'), BinOp('*', Name('a'), exp))),
+        (0, EndBlock()),
+        (0, If(BinOp('>', Name('a'), Const(1.)))),
+        (4, Assign(Name('a'), BinOp('/', Name('a'), Const(2.)))),
+        (0, EndBlock()),
+    ], lambda name: 'expf' if name == 'np.exp' else name)
+    assert counts['ops'] == dict(mul=3, compare=1, div=1)
+    assert counts['calls'] == dict(expf=3)
+    assert counts['transcendental'] == 3
+    assert counts['loops'] == 1 and counts['unbounded_loops'] == 0
+    assert counts['branches'] == 1
+    assert arithmetic_operations(counts) == 7
+
+
+def test_loop_with_unknown_trips_counts_once():
+    counts = count_operations([
+        (0, For(Name('i'), Const(0), Name('n'), Const(1))),
+        (4, Assign(Name('a'), BinOp('+', Name('a'), Name('i')))),
+        (0, EndBlock()),
+    ])
+    assert counts['ops'] == dict(add=1)
+    assert counts['unbounded_loops'] == 1
+
+
+def metrics(**options):
+    gen = CudaGenerator(Defaulted(), **options)
+    gen.generate()
+    return gen.reports['metrics']
+
+
+@translates
+def test_traffic_of_a_step():
+    report = metrics()
+    # states.x, read by `forward`, and `stim`
+    assert report['bytes_loaded'] == 8
+    assert report['bytes_stored'] == 4
+    assert report['arithmetic_intensity'] == report['flops'] / 12.
+
+
+@translates
+def test_multi_step_traffic_is_amortized():
+    assert metrics(multi_step=True)['bytes_loaded'] == 8
+    report = metrics(multi_step=True, steps_per_launch=4)
+    assert report['steps_per_launch'] == 4
+    assert report['bytes_loaded'] == 8 / 4.
+    assert report['bytes_stored'] == 4 / 4.
+    # the steps of a single-step kernel each load and store
+    assert metrics(steps_per_launch=4)['bytes_loaded'] == 8
+
+
+@translates
+def test_trace_stores_are_amortized():
+    report = metrics(multi_step=True, trace=4, steps_per_launch=8)
+    assert report['bytes_stored'] == 4 * (1 / 8. + 1 / 4.)
+    assert report['bytes_loaded'] == 8 / 8.
+
+
+def test_invalid_steps_per_launch():
+    with pytest.raises(ValueError):
+        CudaGenerator(Defaulted(), multi_step=True, steps_per_launch=0)
@@ -0,0 +1,66 @@
+"""
+Multi-step kernels: several steps per launch, with an optional trace.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+
+from kernels import initial, reference, run_c
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Leaky(object):
+    states = {'v': -65., 'w': 0.}
+    params = {'tau': 10., 'a': 0.2}
+    bounds = {'w': (0., 1.)}
+
+    def ode(self, stimulus=0.):
+        self.d_v = (stimulus - self.v - 65.) / self.tau - self.w
+        self.d_w = self.a * (1. - self.w) - self.w * np.exp(self.v / 50.)
+
+
+NUM = 32
+DT = 1e-2
+STEPS = 12
+
+
+def test_kernel_loops_over_steps():
+    gen = CudaGenerator(Leaky(), multi_step=True)
+    src = gen.render()
+    assert ('int ', 'num_steps') in gen.kernel_arguments()
+    assert 'for (int step = 0; step < num_steps; ++step) {' in src
+    # loaded before the loop and stored after it, once each
+    assert src.count('states.v = g_v[tid];') == 1
+    assert src.count('g_v[tid] = states.v;') == 1
+
+
+def test_trace_requires_multi_step():
+    with pytest.raises(ValueError):
+        CudaGenerator(Leaky(), trace=2)
+
+
+@pytest.mark.parametrize('trace', [None, 1, 4, 5])
+def test_matches_reference(trace, build_dir):
+    model = Leaky()
+    states, inters = initial(model, NUM)
+    inputs = dict(stimulus=np.linspace(0., 20., NUM))
+    expected = reference(model, states, inputs, DT, STEPS, trace)
+    gen = CGenerator(model, float_type='double', multi_step=True, trace=trace)
+    out = run_c(gen, states, inters, inputs, DT, STEPS, build_dir)
+    for key in expected:
+        np.testing.assert_allclose(out[key], expected[key], rtol=1e-12)
+
+
+def test_matches_single_steps(build_dir):
+    model = Leaky()
+    states, inters = initial(model, NUM)
+    inputs = dict(stimulus=np.linspace(0., 20., NUM))
+    single = run_c(CGenerator(model, float_type='double'), states, inters,
+        inputs, DT, STEPS, build_dir)
+    multi = run_c(CGenerator(model, float_type='double', multi_step=True),
+        states, inters, inputs, DT, STEPS, build_dir)
+    for key in model.states:
+        np.testing.assert_array_equal(multi[key], single[key])
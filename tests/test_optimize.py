@@ -0,0 +1,67 @@
+"""
+Optimization passes, on the source they produce.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.cuda import CudaGenerator
+from pycodegen.expr import Name, Const, BinOp
+from pycodegen.optimize import Folder
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Powers(object):
+    states = {'x': 1.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        a = np.exp(-self.x / 3.) ** 2
+        self.d_x = a + self.x ** 2 + (self.x + 1.) ** -1 + self.x ** -2
+
+
+class Division(object):
+    states = {'x': 1.}
+    params = {'k': 4, 'tau': 2.}
+    bounds = {}
+
+    def ode(self):
+        acc = 0.
+        for i in range(3):
+            acc = acc + i / 2 + self.k / 2
+        self.d_x = acc + self.x / 2 + self.x / self.tau
+
+
+def ode_source(model, **options):
+    gen = CudaGenerator(model, **options)
+    gen.generate()
+    return gen.ode_src.getvalue()
+
+
+def test_square_of_call_is_not_duplicated():
+    src = ode_source(Powers(), fold=True)
+    assert src.count('expf(') == 1
+    assert '(states.x * states.x)' in src
+    assert '(1.0f / (states.x + 1.0f))' in src
+    assert '(1.0f / (states.x * states.x))' in src
+    assert src.count('powf(') == 1
+
+
+def test_division_by_constant_becomes_multiplication():
+    src = ode_source(Division(), fold=True)
+    assert src.count('(states.x * 0.5f)') == 2
+    # `i` is a loop counter and K is 4: C divides them as integers
+    assert '(i / 2)' in src
+    assert '(K / 2)' in src
+
+
+def test_integer_division_is_kept():
+    folder = Folder(dict(K=4), ints=['i'])
+    for left in (Name('i'), Name('K'), BinOp('+', Name('i'), Const(1))):
+        assert folder(BinOp('/', left, Const(2))) == BinOp('/', left, Const(2))
+    assert folder(BinOp('/', Name('x'), Const(2))) == \
+        BinOp('*', Name('x'), Const(0.5))
+    assert folder(BinOp('/', Name('i'), Const(2.))) == \
+        BinOp('*', Name('i'), Const(0.5))
+
@@ -0,0 +1,94 @@
+"""
+Concurrent compilation with a stub compiler.
+"""
+import os
+import sys
+import stat
+
+import pytest
+
+if sys.version_info[0] < 3:
+    pytest.skip("the compile pipeline requires Python 3",
+        allow_module_level=True)
+
+from pycodegen.build import ArtifactCache, CompileError, artifact_key
+from pycodegen.pipeline import build_many
+
+STUB = """#!/bin/sh
+echo start >> {log}
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) out="$2"; shift;;
+        *.c) src="$1";;
+    esac
+    shift
+done
+sleep 0.2
+echo end >> {log}
+if grep -q FAIL "$src"; then
+    echo "stub: syntax error"
+    exit 3
+fi
+cp "$src" "$out"
+"""
+
+
+@pytest.fixture
+def stub(tmpdir):
+    """
+    Path of a compiler copying its source to the artifact, and of the log
+    of its runs.
+    """
+    log = str(tmpdir.join('log'))
+    cc = tmpdir.join('cc')
+    cc.write(STUB.format(log=log))
+    os.chmod(str(cc), os.stat(str(cc)).st_mode | stat.S_IEXEC)
+    return str(cc), log
+
+
+def runs(log):
+    """
+    Number of compiler runs, and the most that overlapped.
+    """
+    with open(log) as f:
+        events = f.read().split()
+    running = peak = 0
+    for event in events:
+        running += 1 if event == 'start' else -1
+        peak = max(peak, running)
+    return events.count('start'), peak
+
+
+def test_identical_sources_compile_once(stub, tmpdir):
+    cc, log = stub
+    cache = str(tmpdir.join('cache'))
+    sources = ['int a;\n', 'int b;\n', 'int a;\n', 'int c;\n', 'int a;\n']
+    paths = build_many(sources, cc=cc, cache=cache, workers=2)
+    assert runs(log) == (3, 2)
+    assert paths[0] == paths[2] == paths[4]
+    assert len(set(paths)) == 3
+    for src, path in zip(sources, paths):
+        assert path == ArtifactCache(cache).get(artifact_key(src, cc))
+        with open(path) as f:
+            assert f.read() == src
+    # every artifact is cached now
+    assert build_many(sources, cc=cc, cache=cache, workers=2) == paths
+    assert runs(log) == (3, 2)
+
+
+def test_workers_bound_concurrency(stub, tmpdir):
+    cc, log = stub
+    sources = ['int x{};\n'.format(i) for i in range(5)]
+    build_many(sources, cc=cc, cache=str(tmpdir.join('cache')), workers=3)
+    assert runs(log) == (5, 3)
+
+
+def test_compile_error(stub, tmpdir):
+    cc, log = stub
+    cache = str(tmpdir.join('cache'))
+    with pytest.raises(CompileError) as info:
+        build_many(['int a;\n', 'FAIL\n'], cc=cc, cache=cache, workers=2)
+    assert 'failed with exit code 3' in str(info.value)
+    assert 'stub: syntax error' in str(info.value)
+    # no work directory is left behind
+    assert all(name.endswith('.so') for name in os.listdir(cache))
@@ -0,0 +1,110 @@
+"""
+Generators shared by threads translating concurrently.
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+def rate(v):
+    if v > -40.:
+        return 0.1 * (v + 40.)
+    return 0.01
+
+
+class Neuron(object):
+    states = {'v': -65., 'm': 0.}
+    params = {'n': 3}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        acc = 0.
+        for i in range(self.n):
+            acc = acc + self.m / (i + 1.)
+        self.d_m = rate(self.v) * (1. - self.m) - acc
+        self.d_v = stimulus - 0.1 * (self.v + 70.) if self.v < 0. else -self.v
+
+
+def run_threads(target, num=16):
+    results = [None] * num
+    errors = []
+
+    def work(i):
+        try:
+            results[i] = target()
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(num)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return results
+
+
+@pytest.mark.parametrize('cls, options', [
+    (CudaGenerator, dict(cse=True, unroll=True)),
+    (CGenerator, dict(fold=True, inline='device')),
+    (NumpyGenerator, {}),
+])
+def test_concurrent_runs_match_serial(cls, options):
+    gen = cls(Neuron(), **options)
+    expected = gen.render()
+    assert gen.render() == expected
+
+    def render():
+        gen.generate()
+        return gen.render()
+
+    assert run_threads(render) == [expected] * 16
+    assert gen.render() == expected
+
+
+def test_run_is_private_to_its_thread():
+    gen = CudaGenerator(Neuron())
+    gen.generate()
+    signature = list(gen.new_signature)
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        gen.begin_run()
+        gen.new_signature.append('extra')
+        started.set()
+        release.wait()
+        gen.end_run()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+    # the unfinished run is invisible here
+    assert gen.new_signature == signature
+    release.set()
+    thread.join()
+    # a thread keeps seeing its own last run; others see the last one ended
+    assert gen.new_signature == signature
+    assert run_threads(lambda: gen.new_signature, 1) == \
+        [signature + ['extra']]
+
+
+def test_concurrent_numpy_kernels():
+    gen = NumpyGenerator(Neuron(), float_type='double')
+    v = np.linspace(-80., 10., 32)
+
+    def step():
+        states = dict(v=v.copy(), m=np.zeros(32))
+        # each thread loads a kernel with its own workspace
+        gen.load()(1e-2, states, num_steps=5)
+        return states['v']
+
+    results = run_threads(step, 8)
+    for out in results[1:]:
+        np.testing.assert_array_equal(out, results[0])
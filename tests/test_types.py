@@ -0,0 +1,108 @@
+"""
+Single- and double-precision output, and the promotions reported by type
+inference.
+"""
+import ctypes
+import warnings
+
+import numpy as np
+import pytest
+
+from pycodegen.c import CGenerator
+from pycodegen.cuda import CudaGenerator
+from pycodegen.expr import Name, Const, BinOp, Call, Attr, Assign
+from pycodegen.inference import PrecisionWarning, infer_types, promote
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Decay(object):
+    states = {'x': 1.}
+    params = {'tau': 2.}
+    bounds = {}
+
+    def ode(self, stimulus=0.):
+        self.d_x = np.exp(-self.x / self.tau) * 0.5 + stimulus
+
+
+class Unknown(object):
+    states = {'x': 1.}
+    params = {}
+    bounds = {}
+
+    def ode(self):
+        self.d_x = np.sign(self.x) * 0.5
+
+
+def render(model, **options):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        gen = CudaGenerator(model, **options)
+        gen.generate()
+    return gen, [x for x in caught if issubclass(x.category, PrecisionWarning)]
+
+
+def test_single_precision_literals_and_functions():
+    gen, caught = render(Decay())
+    src = gen.ode_src.getvalue()
+    assert 'expf(' in src and '0.5f' in src
+    assert caught == []
+    assert gen.reports['types']['promotions'] == []
+
+
+def test_double_precision():
+    gen, caught = render(Decay(), float_type='double')
+    src = gen.ode_src.getvalue()
+    assert 'exp(' in src and 'expf(' not in src
+    assert '0.5f' not in src and '0.5' in src
+    assert caught == []
+
+
+def test_unknown_function_is_reported():
+    gen, caught = render(Unknown())
+    messages = gen.reports['types']['promotions']
+    assert messages == [
+        "call to unknown function 'np.sign' is assumed to return double: "
+            "np.sign(states.x)",
+        "operands of '*' are promoted to double: (np.sign(states.x) * 0.5f)"]
+    assert [str(x.message) for x in caught] == messages
+    _, caught = render(Unknown(), float_type='double')
+    assert caught == []
+
+
+def test_promotion_is_reported_where_it_starts():
+    # y = (d * 2.0 + 1.0) * 3.0 with `d` a double
+    expr = BinOp('*', BinOp('+', BinOp('*', Name('d'), Const(2.)), Const(1.)),
+        Const(3.))
+    messages = infer_types([(0, Assign(Name('y'), expr))],
+        env=dict(d='double'), warn=False)
+    assert messages == ["operands of '*' are promoted to double"]
+    assert infer_types([(0, Assign(Name('y'), expr))], 'double',
+        env=dict(d='double'), warn=False) == []
+
+
+def test_known_functions_keep_float():
+    call = Call(Attr(Name('np'), 'exp'), [Name('x')])
+    stmt = Assign(Name('y'), BinOp('*', call, Const(2.)))
+    assert infer_types([(0, stmt)], functions=['np.exp'], warn=False) == []
+    assert len(infer_types([(0, stmt)], warn=False)) == 2
+
+
+def test_promote():
+    assert promote('int', 'float') == 'float'
+    assert promote('float', 'double', 'bool') == 'double'
+    assert promote('bool', 'int') == 'int'
+
+
+def test_single_precision_kernel_runs(build_dir):
+    num, dt = 16, 1e-2
+    gen = CGenerator(Decay())
+    kernel = gen.load(cache=build_dir)
+    x = np.linspace(0., 1., num).astype(np.float32)
+    stimulus = np.ones(num, dtype=np.float32)
+    ptr = ctypes.POINTER(ctypes.c_float)
+    args = dict(num_thread=num, dt=dt, g_x=x.ctypes.data_as(ptr),
+        g_stimulus=stimulus.ctypes.data_as(ptr))
+    expected = x + dt * (np.exp(-x / 2.) * 0.5 + 1.)
+    kernel(*[args[name] for _, name in gen.kernel_arguments()])
+    np.testing.assert_allclose(x, expected, rtol=1e-6)
@@ -0,0 +1,91 @@
+"""
+Inputs of the NumPy kernel, and their defaults.
+"""
+import numpy as np
+import pytest
+
+from pycodegen.cuda import CudaGenerator
+from pycodegen.vectorize import NumpyGenerator
+
+pytestmark = pytest.mark.usefixtures('translation')
+
+
+class Defaulted(object):
+    states = {'x': 0.}
+    params = {}
+    bounds = {}
+
+    def ode(self, stim=0.):
+        self.d_x = 1. if stim > 0.5 else -1.
+
+
+class Keywords(object):
+    states = {'x': 0.}
+    params = {'a': 2.}
+    bounds = {}
+
+    def ode(self, stim=1., **kwargs):
+        I = kwargs.pop('I', self.a * 2.)
+        self.d_x = I * self.a + stim - self.x
+
+
+def step(kernel, inputs=None, params=None):
+    states = dict(x=np.zeros(3))
+    kernel(1., states, inputs, params=params)
+    return states['x']
+
+
+def test_defaults_are_stripped_from_inputs():
+    gen = CudaGenerator(Defaulted())
+    src = gen.render()
+    assert gen.new_signature == ['stim']
+    assert gen.defaults == {'stim': '0.0'}
+    assert 'float stim\n' in src
+    assert '=0.0' not in src
+
+
+def test_keyword_input():
+    gen = CudaGenerator(Keywords())
+    gen.generate()
+    assert gen.new_signature == ['stim', 'I']
+    assert gen.defaults == {'stim': '1.0', 'I': '(A * 2.0f)'}
+
+
+def test_defaulted_input_may_be_omitted():
+    kernel = NumpyGenerator(Defaulted(), float_type='double').load()
+    np.testing.assert_array_equal(step(kernel), -1.)
+    np.testing.assert_array_equal(step(kernel, dict(stim=1.)), 1.)
+
+
+@pytest.mark.parametrize('options', [{}, dict(fixed=['a'])])
+def test_default_reads_parameters(options):
+    kernel = NumpyGenerator(Keywords(), float_type='double', **options).load()
+    # I = 2 * a
+    np.testing.assert_array_equal(step(kernel), 9.)
+    np.testing.assert_array_equal(step(kernel, params=dict(a=1.)), 3.)
+    np.testing.assert_array_equal(step(kernel, dict(I=np.ones(3), stim=0.)),
+        2.)
+
+
+def test_missing_input():
+    class Required(object):
+        states = {'x': 0.}
+        params = {}
+        bounds = {}
+
+        def ode(self, stim):
+            self.d_x = stim
+
+    kernel = NumpyGenerator(Required()).load()
+    with pytest.raises(ValueError) as info:
+        step(kernel)
+    assert 'missing inputs: stim' in str(info.value)
+
+
+def test_workspace_is_reused():
+    kernel = NumpyGenerator(Keywords(), float_type='double').load()
+    step(kernel)
+    arrays = dict(kernel.workspace.arrays)
+    step(kernel, dict(I=np.ones(3)))
+    assert all(kernel.workspace.arrays[key] is val
+        for key, val in arrays.items())